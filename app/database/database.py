@@ -1,18 +1,102 @@
-from peewee import SqliteDatabase
+from contextlib import contextmanager
+from time import perf_counter
+from peewee import SqliteDatabase, JOIN, chunked, fn
+from playhouse.pool import PooledSqliteDatabase
 from .exceptions import *
 from .models import *
+from .pragmas import get_pragmas
+from app.metrics import Histogram
 from app.logger import get_logger
 
 
 log = get_logger(__name__)
 
+# Размер пачки для многострочных INSERT/DELETE, чтобы не упираться в лимит переменных SQLite
+_BULK_CHUNK_SIZE = 400
+
+DB_QUERY_DURATION = Histogram('ufir_db_query_duration_seconds', 'Время выполнения SQL запроса по виду запроса',
+                              labels=('statement',))
+
+
+class _TimedQueryMixin:
+    """Учитывает время выполнения каждого SQL запроса в DB_QUERY_DURATION"""
+
+    def execute_sql(self, sql, params=None):
+        start = perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            # Вид запроса - первое слово SQL: select, insert, delete, begin и т.д.
+            DB_QUERY_DURATION.observe(perf_counter() - start, statement=sql.split(None, 1)[0].lower())
+
+
+class _SqliteDatabase(_TimedQueryMixin, SqliteDatabase):
+    pass
+
+
+class _PooledSqliteDatabase(_TimedQueryMixin, PooledSqliteDatabase):
+    pass
+
 
 class Database:
     """Класс для работы с БД SQLite"""
 
-    def __init__(self, database: str):
-        self.db = SqliteDatabase(database=database, pragmas={'foreign_keys': 1})
-        self.models = [Host, IpAddress]
+    def __init__(self, database: str, pragmas: dict = None, max_connections: int = 8, stale_timeout: int = 3600,
+                 pool_timeout: float = 30):
+        """
+        Args:
+            database (str): Путь до файла БД, ':memory:' - БД в памяти
+            pragmas (dict|None): Pragma SQLite, по умолчанию профиль из SQLITE_PROFILE
+            max_connections (int): Максимум соединений в пуле, по одному на поток
+            stale_timeout (int): Соединение старше этого времени в секундах открывается заново
+            pool_timeout (float): Время ожидания свободного соединения в секундах, если все соединения пула заняты
+        """
+        pragmas = pragmas if pragmas is not None else get_pragmas()
+        if database == ':memory:':
+            # У каждого соединения со своей БД в памяти собственная пустая база, поэтому пул здесь не нужен
+            self.db = _SqliteDatabase(database=database, pragmas=pragmas)
+        else:
+            # Соединения возвращаются в пул и переиспользуются, pragma применяются один раз при открытии.
+            # Соединение из пула может достаться другому потоку, поэтому check_same_thread отключен
+            self.db = _PooledSqliteDatabase(database=database, pragmas=pragmas, check_same_thread=False,
+                                           max_connections=max_connections, stale_timeout=stale_timeout,
+                                           timeout=pool_timeout)
+        self.models = [Host, IpAddress, Ip6Address, HostGroup, HostCheck, RouterGroupSnapshot]
+
+        # Все запросы моделей выполняются через это соединение, последний созданный Database становится текущим
+        database_proxy.initialize(self.db)
+
+    @contextmanager
+    def connection(self):
+        """
+        Соединение потока на время работы с БД. Соединение, открытое здесь, при выходе возвращается в пул,
+        поэтому потоки пула executor не держат соединения после завершения работы.
+        Уже открытое соединение потока не закрывается, вложенные вызовы безопасны
+
+        Returns:
+            Контекстный менеджер соединения
+        """
+        if not self.db.is_closed():
+            yield
+            return
+
+        self.db.connect()
+        try:
+            yield
+        finally:
+            self.db.close()
+
+    @staticmethod
+    def write_transaction():
+        """
+        Транзакция записи, которая сразу берет блокировку на запись (BEGIN IMMEDIATE).
+        Иначе два писателя (слежение за файлом и фоновая проверка) могут начать чтение, а затем
+        получить SQLITE_BUSY при повышении блокировки, которое busy_timeout уже не спасает
+
+        Returns:
+            Контекстный менеджер транзакции
+        """
+        return database_proxy.atomic('IMMEDIATE')
 
     def start(self) -> bool:
         """
@@ -22,13 +106,26 @@ class Database:
             bool: Состояние подключения к БД
         """
         try:
-            self.db.connect()
-            log.info(f"Подключение к базе данных {self.db.database} успешно")
+            self.db.connect(reuse_if_open=True)
+            log.info("Подключение к базе данных %s успешно", self.db.database)
             return True
         except OperationalError as dbErr:
             log.error(dbErr)
             return False
 
+    def close(self) -> None:
+        """
+        Закрывает соединения с БД, в том числе простаивающие в пуле
+
+        Returns:
+            None:
+        """
+        if not self.db.is_closed():
+            self.db.close()
+        if isinstance(self.db, PooledSqliteDatabase):
+            self.db.close_all()
+        log.info("Соединение с базой данных %s закрыто", self.db.database)
+
     def drop_all(self) -> None:
         """
         Удаляет все таблицы в базе данных
@@ -76,7 +173,7 @@ class Database:
         missing_tables = self._check_missing_tables(self.models)
 
         if missing_tables:
-            log.info(f"Создание недостающих таблиц: {', '.join([table.__name__ for table in missing_tables])}")
+            log.info("Создание недостающих таблиц: %s", ', '.join([table.__name__ for table in missing_tables]))
 
             try:
                 self.db.create_tables(missing_tables)
@@ -87,6 +184,28 @@ class Database:
         else:
             log.info("Таблицы базы данных в порядке")
 
+        self._init_indexes()
+
+    def _init_indexes(self) -> None:
+        """
+        Создает недостающие индексы в таблицах, созданных до их появления в моделях
+
+        Returns:
+            None:
+        """
+        index_names = {index.name for index in self.db.get_indexes(IpAddress._meta.table_name)}
+        missing_indexes = [index._name for index in IpAddress._meta.fields_to_index()
+                           if index._name not in index_names]
+        if not missing_indexes:
+            return
+
+        log.info("Создание недостающих индексов: %s", ', '.join(missing_indexes))
+        with self.write_transaction():
+            # Перед созданием уникального индекса убираем дубликаты, которые могли накопиться без него
+            first_rows = IpAddress.select(fn.MIN(IpAddress.id)).group_by(IpAddress.hostname_id, IpAddress.ip_address)
+            IpAddress.delete().where(IpAddress.id.not_in(first_rows)).execute()
+            IpAddress._schema.create_indexes(safe=True)
+
     def init(self) -> bool:
         """
         Инициализирует базу данных
@@ -121,7 +240,26 @@ class Database:
             raise IntegrityError("Данный хост уже существует в базе данных")
 
     @staticmethod
-    def check_ip_unique(hostname: Host, ip_check: str) -> bool:
+    def _ip_model(ip_address: str):
+        """
+        Args:
+            ip_address (str): IP адрес
+
+        Returns:
+            Модель таблицы для адреса: Ip6Address для IPv6, иначе IpAddress
+        """
+        return Ip6Address if ':' in ip_address else IpAddress
+
+    @classmethod
+    def _split_family(cls, ip_list) -> dict:
+        """Раскладывает адреса по моделям таблиц: IpAddress для IPv4 и Ip6Address для IPv6"""
+        ip_by_model = {}
+        for ip_address in ip_list:
+            ip_by_model.setdefault(cls._ip_model(ip_address), []).append(ip_address)
+        return ip_by_model
+
+    @classmethod
+    def check_ip_unique(cls, hostname: Host, ip_check: str) -> bool:
         """
         Проверяет на уникальность IP в записях к данном хосту
         Args:
@@ -131,8 +269,9 @@ class Database:
         Returns:
             bool: True - если IP уникальный, False - если уже записан в базе данных к данному хосту
         """
-        return True if IpAddress.get_or_none(IpAddress.hostname_id == hostname.id,
-                                             IpAddress.ip_address == ip_check) is None else False
+        model = cls._ip_model(ip_check)
+        return True if model.get_or_none(model.hostname_id == hostname.id,
+                                         model.ip_address == ip_check) is None else False
 
     @classmethod
     def add_host_ip(cls, hostname: Host, ip_address: str) -> IpAddress:
@@ -143,11 +282,11 @@ class Database:
             ip_address (str): IP-адрес для добавления
 
         Returns:
-            app.database.models.IpAddress: Добавленный IpAddress
+            app.database.models.IpAddress|app.database.models.Ip6Address: Добавленный IpAddress или Ip6Address
         """
         if cls.check_ip_unique(hostname=hostname, ip_check=ip_address):
-            ip_address_model = IpAddress.create(hostname_id=hostname.id, ip_address=ip_address)
-            log.info(f"[{hostname.hostname}] Добавлен IP: {ip_address}")
+            ip_address_model = cls._ip_model(ip_address).create(hostname_id=hostname.id, ip_address=ip_address)
+            log.debug("[%s] Добавлен IP: %s", hostname.hostname, ip_address)
             return ip_address_model
 
     @classmethod
@@ -159,12 +298,28 @@ class Database:
             ip_list (list): Список IP-адресов для добавления
 
         Returns:
-            list: Список добавленных IpAddress
+            list: Список добавленных IpAddress и Ip6Address
         """
-        # Добавляет все ip из списка с привязкой к указанному хосту
-        ip_address_models = [ip for ip in [
-            cls.add_host_ip(hostname=hostname, ip_address=ip_address) for ip_address in ip_list] if ip is not None]
+        ip_list = list(dict.fromkeys(ip_list))
+        if not ip_list:
+            return []
+
+        ip_address_models = []
+        with cls.write_transaction():
+            existing_ip = set(cls.get_host_ip_list(hostname=hostname))
+            new_ip = [ip_address for ip_address in ip_list if ip_address not in existing_ip]
+
+            for model, model_ip in cls._split_family(new_ip).items():
+                # Повторы отсекает уникальный индекс, on_conflict_ignore защищает от гонки с другим писателем
+                for rows in chunked(({model.hostname_id: hostname.id, model.ip_address: ip_address}
+                                     for ip_address in model_ip), _BULK_CHUNK_SIZE):
+                    model.insert_many(rows).on_conflict_ignore().execute()
+
+                ip_address_models.extend(model.select().where(model.hostname_id == hostname.id,
+                                                              model.ip_address.in_(model_ip)))
 
+        if ip_address_models:
+            log.debug("[%s] Добавлено IP: %d", hostname.hostname, len(ip_address_models))
         return ip_address_models
 
     @classmethod
@@ -188,6 +343,17 @@ class Database:
         """
         return Host.get_or_create(hostname=hostname)[0]
 
+    @classmethod
+    def get_host_by_name(cls, hostname: str) -> Host:
+        """
+        Получить модель хоста в базе данных по названию
+        Args:
+            hostname (str): Название хоста
+        Returns:
+            app.database.models.Host|None: Модель хоста, None - если хост не записан в базу данных
+        """
+        return Host.get_or_none(Host.hostname == hostname)
+
     @classmethod
     def get_host_ip_list(cls, hostname: Host) -> list:
         """
@@ -196,9 +362,13 @@ class Database:
             hostname (app.database.models.Host): Модель хоста, у которого необходимо найти все IP
 
         Returns:
-            list: Список IP адресов, связанных с указанным хостом
+            list: Список IP адресов, связанных с указанным хостом, IPv4 адреса идут первыми
         """
-        return [ip.ip_address for ip in IpAddress.select().where(IpAddress.hostname_id == hostname.id)]
+        return [ip_address for model in (IpAddress, Ip6Address)
+                for ip_address, in model.select(model.ip_address)
+                .where(model.hostname_id == hostname.id)
+                .order_by(model.id)
+                .tuples()]
 
     @classmethod
     def delete_ip_by_hostname(cls, hostname: Host, ip_address: str) -> None:
@@ -214,26 +384,270 @@ class Database:
         Raises:
             DoesNotExist: При попытке удалить по несуществующему ID
         """
+        model = cls._ip_model(ip_address)
         try:
-            IpAddress.get(IpAddress.hostname_id == hostname.id, IpAddress.ip_address == ip_address).delete_instance()
-            log.info(f"[{hostname.hostname}] Удален IP: {ip_address}")
+            model.get(model.hostname_id == hostname.id, model.ip_address == ip_address).delete_instance()
+            log.debug("[%s] Удален IP: %s", hostname.hostname, ip_address)
         except DoesNotExist:
             raise DoesNotExist(f"IP {ip_address} - не записан в бд")
 
     @classmethod
-    def delete_host_ip_list(cls, hostname: Host, ip_list: list) -> None:
+    def delete_host_ip_list(cls, hostname: Host, ip_list: list) -> int:
         """
         Удаляет список IP по id хоста
         Args:
             hostname (app.database.models.Host): Модель хоста, из которого необходимо убрать IP
             ip_list (list): Список IP-адресов для удаления
 
+        Returns:
+            int: Количество удаленных записей
+        """
+        deleted = 0
+        with cls.write_transaction():
+            for model, model_ip in cls._split_family(ip_list).items():
+                for ip_chunk in chunked(model_ip, _BULK_CHUNK_SIZE):
+                    deleted += model.delete().where(model.hostname_id == hostname.id,
+                                                    model.ip_address.in_(ip_chunk)).execute()
+
+        if deleted:
+            log.debug("[%s] Удалено IP: %d", hostname.hostname, deleted)
+        return deleted
+
+    @classmethod
+    def apply_ip_changes(cls, added: dict, deleted: dict) -> None:
+        """
+        Добавляет и удаляет IP нескольких хостов в одной транзакции
+        Args:
+            added (dict): Словарь название хоста - список IP для добавления
+            deleted (dict): Словарь название хоста - список IP для удаления
+
         Returns:
             None:
         """
-        # Добавляет все ip из списка с привязкой к указанному хосту
-        for ip_address in ip_list:
-            cls.delete_ip_by_hostname(hostname=hostname, ip_address=ip_address)
+        with cls.write_transaction():
+            hostname_list = list(set(added) | set(deleted))
+            # Удаление IP не должно создавать хосты, неизвестные хосты пропускаются
+            host_id = cls._host_ids(list(deleted), create=False)
+
+            deleted_count = 0
+            for hostname, ip_list in deleted.items():
+                if hostname not in host_id:
+                    continue
+                for model, model_ip in cls._split_family(ip_list).items():
+                    for ip_chunk in chunked(model_ip, _BULK_CHUNK_SIZE):
+                        deleted_count += model.delete().where(model.hostname_id == host_id[hostname],
+                                                              model.ip_address.in_(ip_chunk)).execute()
+
+            host_id = cls._host_ids(list(added))
+            rows = {}
+            for hostname, ip_list in added.items():
+                for model, model_ip in cls._split_family(ip_list).items():
+                    rows.setdefault(model, []).extend({model.hostname_id: host_id[hostname], model.ip_address: ip}
+                                                      for ip in model_ip)
+            for model, model_rows in rows.items():
+                for row_chunk in chunked(model_rows, _BULK_CHUNK_SIZE):
+                    model.insert_many(row_chunk).on_conflict_ignore().execute()
+
+        log.info("Изменения IP записаны в базу данных: хостов %d, добавлено IP: %d, удалено IP: %d",
+                 len(hostname_list), sum(map(len, added.values())), deleted_count)
+
+    @classmethod
+    def _host_ids(cls, hostname_list: list, create: bool = True) -> dict:
+        """Возвращает словарь название хоста - id, при create недостающие хосты создаются, иначе пропускаются"""
+        if create:
+            for hostname_chunk in chunked(hostname_list, _BULK_CHUNK_SIZE):
+                Host.insert_many([{Host.hostname: hostname}
+                                  for hostname in hostname_chunk]).on_conflict_ignore().execute()
+
+        host_id = {}
+        for hostname_chunk in chunked(hostname_list, _BULK_CHUNK_SIZE):
+            host_id.update(Host.select(Host.hostname, Host.id).where(Host.hostname.in_(hostname_chunk)).tuples())
+        return host_id
+
+    @classmethod
+    def add_group_hosts(cls, group: str, hostname_list: list) -> None:
+        """
+        Добавляет хосты в группу адресов, недостающие хосты создаются
+        Args:
+            group (str): Название группы адресов
+            hostname_list (list): Список названий хостов
+
+        Returns:
+            None:
+        """
+        hostname_list = list(dict.fromkeys(hostname_list))
+        if not hostname_list:
+            return
+
+        with cls.write_transaction():
+            rows = ({HostGroup.hostname_id: host_id, HostGroup.group: group}
+                    for host_id in cls._host_ids(hostname_list).values())
+            for row_chunk in chunked(rows, _BULK_CHUNK_SIZE):
+                HostGroup.insert_many(row_chunk).on_conflict_ignore().execute()
+
+        log.info("В группу %s добавлено хостов: %d", group, len(hostname_list))
+
+    @classmethod
+    def delete_group_hosts(cls, group: str, hostname_list: list) -> list:
+        """
+        Убирает хосты из группы адресов. Хосты, которые не остались ни в одной группе, удаляются вместе с IP
+        Args:
+            group (str): Название группы адресов
+            hostname_list (list): Список названий хостов
+
+        Returns:
+            list: Названия удаленных хостов
+        """
+        hostname_list = list(dict.fromkeys(hostname_list))
+        if not hostname_list:
+            return []
+
+        with cls.write_transaction():
+            for hostname_chunk in chunked(hostname_list, _BULK_CHUNK_SIZE):
+                host_ids = Host.select(Host.id).where(Host.hostname.in_(hostname_chunk))
+                HostGroup.delete().where(HostGroup.group == group, HostGroup.hostname_id.in_(host_ids)).execute()
+
+            orphaned = []
+            for hostname_chunk in chunked(hostname_list, _BULK_CHUNK_SIZE):
+                grouped_ids = HostGroup.select(HostGroup.hostname_id)
+                orphaned.extend(hostname for hostname, in Host.select(Host.hostname)
+                                .where(Host.hostname.in_(hostname_chunk), Host.id.not_in(grouped_ids))
+                                .tuples())
+            for hostname_chunk in chunked(orphaned, _BULK_CHUNK_SIZE):
+                Host.delete().where(Host.hostname.in_(hostname_chunk)).execute()
+
+        log.info("Из группы %s убрано хостов: %d, удалено хостов без групп: %d",
+                 group, len(hostname_list), len(orphaned))
+        return orphaned
+
+    @classmethod
+    def adopt_hosts(cls, group: str) -> int:
+        """
+        Добавляет в группу хосты, которые не состоят ни в одной группе.
+        Так в группу попадают хосты из БД, созданной до появления групп
+        Args:
+            group (str): Название группы адресов
+
+        Returns:
+            int: Количество добавленных в группу хостов
+        """
+        with cls.write_transaction():
+            hostname_list = [hostname for hostname, in Host.select(Host.hostname)
+                             .where(Host.id.not_in(HostGroup.select(HostGroup.hostname_id)))
+                             .tuples()]
+            cls.add_group_hosts(group=group, hostname_list=hostname_list)
+
+        return len(hostname_list)
+
+    @classmethod
+    def get_group_host_list(cls, group: str) -> list:
+        """
+        Получить названия хостов группы адресов
+        Args:
+            group (str): Название группы адресов
+
+        Returns:
+            list: Список названий хостов
+        """
+        return [hostname for hostname, in Host.select(Host.hostname)
+                .join(HostGroup, on=(HostGroup.hostname_id == Host.id))
+                .where(HostGroup.group == group)
+                .order_by(Host.id)
+                .tuples()]
+
+    @classmethod
+    def get_all_group_host_with_ip(cls) -> dict:
+        """
+        Получить хосты со всеми связанными IP по группам адресов, по одному запросу на IPv4 и IPv6
+        Returns:
+            dict: Словарь группа - словарь название хоста - список IP, хосты без IP получают пустой список
+        """
+        dict_group = {}
+        for model in (IpAddress, Ip6Address):
+            query = (Host
+                     .select(HostGroup.group, Host.hostname, model.ip_address)
+                     .join(HostGroup, on=(HostGroup.hostname_id == Host.id))
+                     .join(model, JOIN.LEFT_OUTER, on=(model.hostname_id == Host.id))
+                     .order_by(HostGroup.group, Host.id, model.id)
+                     .tuples())
+
+            for group, hostname, ip_address in query:
+                ip_list = dict_group.setdefault(group, {}).setdefault(hostname, [])
+                if ip_address is not None:
+                    ip_list.append(ip_address)
+
+        return dict_group
+
+    @classmethod
+    def save_host_expiry(cls, expiry: dict) -> None:
+        """
+        Сохраняет сроки следующей проверки хостов, чтобы после перезапуска проверялись только устаревшие хосты
+        Args:
+            expiry (dict): Словарь название хоста - срок проверки в unix time
+
+        Returns:
+            None:
+        """
+        if not expiry:
+            return
+
+        with cls.write_transaction():
+            host_id = {}
+            for hostname_chunk in chunked(list(expiry), _BULK_CHUNK_SIZE):
+                host_id.update(Host.select(Host.hostname, Host.id).where(Host.hostname.in_(hostname_chunk)).tuples())
+
+            # Хосты, удаленные из файлов после проверки, пропускаются
+            rows = ({HostCheck.hostname_id: host_id[hostname], HostCheck.expires_at: expires_at}
+                    for hostname, expires_at in expiry.items() if hostname in host_id)
+            for row_chunk in chunked(rows, _BULK_CHUNK_SIZE):
+                (HostCheck.insert_many(row_chunk)
+                 .on_conflict(conflict_target=[HostCheck.hostname_id], preserve=[HostCheck.expires_at])
+                 .execute())
+
+    @classmethod
+    def get_host_expiry(cls) -> dict:
+        """
+        Получить сроки следующей проверки хостов
+        Returns:
+            dict: Словарь название хоста - срок проверки в unix time
+        """
+        return dict(Host
+                    .select(Host.hostname, HostCheck.expires_at)
+                    .join(HostCheck, on=(HostCheck.hostname_id == Host.id))
+                    .tuples())
+
+    @classmethod
+    def save_router_snapshot(cls, router: str, group: str, fingerprint: str, entries: list) -> None:
+        """
+        Сохраняет прочитанное состояние группы роутера вместе с отпечатком, по которому его можно проверить
+        Args:
+            router (str): Название роутера
+            group (str): Название группы адресов
+            fingerprint (str): Отпечаток конфигурации группы
+            entries (list): Записи группы
+
+        Returns:
+            None:
+        """
+        with cls.write_transaction():
+            (RouterGroupSnapshot
+             .insert(router=router, group=group, fingerprint=fingerprint, entries=sorted(entries))
+             .on_conflict(conflict_target=[RouterGroupSnapshot.router, RouterGroupSnapshot.group],
+                          preserve=[RouterGroupSnapshot.fingerprint, RouterGroupSnapshot.entries])
+             .execute())
+
+    @classmethod
+    def get_router_snapshots(cls) -> dict:
+        """
+        Получить сохраненные состояния групп роутеров
+        Returns:
+            dict: Словарь (роутер, группа) - (отпечаток, список записей)
+        """
+        return {(router, group): (fingerprint, entries) for router, group, fingerprint, entries in
+                RouterGroupSnapshot
+                .select(RouterGroupSnapshot.router, RouterGroupSnapshot.group,
+                        RouterGroupSnapshot.fingerprint, RouterGroupSnapshot.entries)
+                .tuples()}
 
     @classmethod
     def delete_hostname(cls, hostname: Host) -> None:
@@ -250,7 +664,7 @@ class Database:
         """
         try:
             hostname.delete_instance()
-            log.info(f"Хост {hostname.hostname} удален со всеми связанными IP")
+            log.info("Хост %s удален со всеми связанными IP", hostname.hostname)
         except DoesNotExist:
             raise DoesNotExist(f"Хоста не существует")
 
@@ -259,9 +673,20 @@ class Database:
         """
         Получить словарь хостов со всеми связанными IP
         Returns:
-
-        """
-        dict_host = {host.hostname: cls.get_host_ip_list(host) for host in cls.get_host_list()}
+            dict: Словарь название хоста - список IP, хосты без IP получают пустой список. IPv4 адреса идут первыми
+        """
+        dict_host = {}
+        for model in (IpAddress, Ip6Address):
+            query = (Host
+                     .select(Host.hostname, model.ip_address)
+                     .join(model, JOIN.LEFT_OUTER, on=(model.hostname_id == Host.id))
+                     .order_by(Host.id, model.id)
+                     .tuples())
+
+            for hostname, ip_address in query:
+                ip_list = dict_host.setdefault(hostname, [])
+                if ip_address is not None:
+                    ip_list.append(ip_address)
 
         return dict_host
 
@@ -1,5 +1,32 @@
+import socket
+import zlib
 import peewee
-from os import environ
+
+# Модели привязываются к единственному экземпляру Database при его создании
+database_proxy = peewee.DatabaseProxy()
+
+
+class IPv6Field(peewee.BlobField):
+    """IPv6 адрес, хранится 16 байтами - 128-битным числом в порядке байтов сети"""
+
+    def db_value(self, value):
+        return None if value is None else socket.inet_pton(socket.AF_INET6, value)
+
+    def python_value(self, value):
+        return None if value is None else socket.inet_ntop(socket.AF_INET6, bytes(value))
+
+
+class CompressedListField(peewee.BlobField):
+    """Список строк, хранится сжатым текстом по строке на элемент"""
+
+    def db_value(self, value):
+        return None if value is None else zlib.compress('\n'.join(value).encode())
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        text = zlib.decompress(bytes(value)).decode()
+        return text.split('\n') if text else []
 
 
 class BaseModel(peewee.Model):
@@ -7,9 +34,7 @@ class BaseModel(peewee.Model):
     id = peewee.PrimaryKeyField(null=False)
 
     class Meta:
-        # Ниже представлен небольшой костыль, ибо записывание переменных из config.env в переменные среды
-        # происходит позже, чем инициализация пакетов и этих моделей. Следовательно, сюда передавались None..
-        database = peewee.SqliteDatabase(database=environ.get('SQLITE_PATH'), pragmas={'foreign_keys': 1})
+        database = database_proxy
 
 
 class Host(BaseModel):
@@ -21,4 +46,46 @@ class IpAddress(BaseModel):
     """Модель таблицы IP адресов"""
     hostname_id = peewee.ForeignKeyField(model=Host, to_field='id', on_delete='cascade', on_update='cascade',
                                          null=False, verbose_name="ID Хоста")
-    ip_address = peewee.IPField(null=False, verbose_name="IP Адрес")
+    ip_address = peewee.IPField(null=False, index=True, verbose_name="IP Адрес")
+
+    class Meta:
+        # Уникальность IP в рамках хоста проверяет сама БД
+        indexes = ((('hostname_id', 'ip_address'), True),)
+
+
+class Ip6Address(BaseModel):
+    """Модель таблицы IPv6 адресов"""
+    hostname_id = peewee.ForeignKeyField(model=Host, to_field='id', on_delete='cascade', on_update='cascade',
+                                         null=False, verbose_name="ID Хоста")
+    ip_address = IPv6Field(null=False, index=True, verbose_name="IPv6 Адрес")
+
+    class Meta:
+        indexes = ((('hostname_id', 'ip_address'), True),)
+
+
+class HostGroup(BaseModel):
+    """Модель таблицы принадлежности хостов к группам адресов firewall"""
+    hostname_id = peewee.ForeignKeyField(model=Host, to_field='id', on_delete='cascade', on_update='cascade',
+                                         null=False, verbose_name="ID Хоста")
+    group = peewee.CharField(null=False, index=True, verbose_name="Группа адресов")
+
+    class Meta:
+        indexes = ((('hostname_id', 'group'), True),)
+
+
+class HostCheck(BaseModel):
+    """Модель таблицы сроков следующей проверки хостов, по истечении TTL их записей"""
+    hostname_id = peewee.ForeignKeyField(model=Host, to_field='id', on_delete='cascade', on_update='cascade',
+                                         null=False, unique=True, verbose_name="ID Хоста")
+    expires_at = peewee.FloatField(null=False, verbose_name="Срок проверки, unix time")
+
+
+class RouterGroupSnapshot(BaseModel):
+    """Модель таблицы последнего прочитанного состояния групп адресов роутеров"""
+    router = peewee.CharField(null=False, verbose_name="Роутер")
+    group = peewee.CharField(null=False, verbose_name="Группа адресов")
+    fingerprint = peewee.CharField(null=False, verbose_name="Отпечаток конфигурации группы")
+    entries = CompressedListField(null=False, verbose_name="Записи группы")
+
+    class Meta:
+        indexes = ((('router', 'group'), True),)
@@ -0,0 +1,48 @@
+from os import environ
+
+# Исходный режим: журнал отката и полный fsync на каждую транзакцию
+LEGACY_PRAGMAS = {
+    'foreign_keys': 1,
+}
+
+# WAL позволяет читателям не ждать писателя, а synchronous=NORMAL в WAL не теряет целостность при сбое,
+# только последние транзакции при отключении питания
+PERFORMANCE_PRAGMAS = {
+    'foreign_keys': 1,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -16000,  # Отрицательное значение - размер в KiB
+    'mmap_size': 64 * 1024 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+
+PROFILES = {
+    'legacy': LEGACY_PRAGMAS,
+    'performance': PERFORMANCE_PRAGMAS,
+}
+
+
+def get_pragmas(profile: str = None) -> dict:
+    """
+    Собирает pragma для SQLite из профиля и переопределений из переменных среды
+    Args:
+        profile (str|None): Название профиля, по умолчанию SQLITE_PROFILE или performance
+
+    Returns:
+        dict: Словарь pragma для peewee.SqliteDatabase
+
+    Raises:
+        KeyError: Если профиль не существует
+    """
+    profile = profile or environ.get('SQLITE_PROFILE', 'performance')
+    if profile not in PROFILES:
+        raise KeyError(f"Профиль SQLite {profile} не существует, доступны: {', '.join(PROFILES)}")
+
+    pragmas = dict(PROFILES[profile])
+    for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'busy_timeout'):
+        value = environ.get(f'SQLITE_{pragma.upper()}')
+        if value:
+            pragmas[pragma] = int(value) if value.lstrip('-').isdigit() else value
+
+    return pragmas
@@ -1 +1 @@
-from app.file.file import HostFile
+from app.file.file import HostFile, HostFileIndex
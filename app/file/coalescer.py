@@ -0,0 +1,81 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+from app.logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class EventCoalescer:
+    """
+    Собирает пачку событий файловой системы в одно обновление.
+    События приходят из потока Observer, а обновление выполняется в event loop после окна тишины
+    """
+
+    def __init__(self, callback: Callable[[], Awaitable[None]], quiet_window: float = 1.0):
+        """
+        Args:
+            callback (Callable): Корутина обновления, вызывается один раз на пачку событий
+            quiet_window (float): Сколько секунд не должно быть новых событий, чтобы пачка считалась законченной
+        """
+        self.callback = callback
+        self.quiet_window = quiet_window
+        self.events = 0
+        self.runs = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Привязывает очередь событий к event loop, после этого события начинают приниматься
+        Args:
+            loop (asyncio.AbstractEventLoop): Event loop, в котором выполняется обновление
+
+        Returns:
+            None:
+        """
+        self._loop = loop
+        self._queue = asyncio.Queue()
+
+    def notify(self) -> None:
+        """
+        Сообщает о событии. Безопасно вызывать из любого потока
+
+        Returns:
+            None:
+        """
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+    async def run(self) -> None:
+        """
+        Обрабатывает события до отмены задачи
+
+        Returns:
+            None:
+        """
+        if self._loop is None:
+            self.attach(asyncio.get_running_loop())
+
+        while True:
+            await self._queue.get()
+            burst = 1
+
+            # Ждем, пока события перестанут приходить хотя бы на quiet_window
+            while True:
+                try:
+                    await asyncio.wait_for(self._queue.get(), timeout=self.quiet_window)
+                    burst += 1
+                except asyncio.TimeoutError:
+                    break
+
+            self.events += burst
+            self.runs += 1
+            log.debug("Обработка %d событий одним обновлением", burst)
+
+            try:
+                await self.callback()
+            except Exception as err:
+                # Ошибка одного обновления не должна останавливать слежение за файлом
+                log.exception("Ошибка обновления по событиям файла: %s", err)
@@ -1,6 +1,61 @@
 from app.setting import DATABASE
+from hashlib import blake2b
+from typing import Iterable, Optional
 import re
 
+_SPACES_RE = re.compile(r'(\s+)')
+_HOSTNAME_RE = re.compile(r".+\..+")
+
+
+def parse_hosts(content: str) -> list:
+    """
+    Разбирает содержимое файла хостов
+    Args:
+        content (str): Содержимое файла
+
+    Returns:
+        list: Список нормализованных хостов без повторов в порядке следования в файле
+    """
+    hostnames = (_SPACES_RE.sub('', line) for line in content.split("\n"))
+    return list(dict.fromkeys(host for host in hostnames if _HOSTNAME_RE.match(host) is not None))
+
+
+class HostFileIndex:
+    """Последний разобранный снимок файла хостов, по которому изменения вычисляются разностью множеств"""
+
+    def __init__(self, host_file_path: str, hostnames: Iterable[str] = ()):
+        """
+        Args:
+            host_file_path (str): Путь до файла с хостами
+            hostnames (Iterable[str]): Хосты, которые уже учтены, например записанные в БД
+        """
+        self.host_file_path = host_file_path
+        self.hostnames = set(hostnames)
+        self.content_hash = None
+
+    def update(self) -> Optional[tuple]:
+        """
+        Перечитывает файл и сравнивает его с последним снимком
+        Returns:
+            tuple|None: Списки добавленных и удаленных хостов, None - если содержимое файла не изменилось
+        """
+        with open(self.host_file_path, 'rb') as host_file:
+            content = host_file.read()
+
+        content_hash = blake2b(content, digest_size=16).digest()
+        if content_hash == self.content_hash:
+            return None
+
+        hostnames = parse_hosts(content.decode('utf-8', errors='replace'))
+        hostname_set = set(hostnames)
+
+        added_hosts = [host for host in hostnames if host not in self.hostnames]
+        deleted_hosts = sorted(self.hostnames - hostname_set)
+
+        self.hostnames = hostname_set
+        self.content_hash = content_hash
+        return added_hosts, deleted_hosts
+
 
 class HostFile:
     """Класс для работы с файлом списка хостов"""
@@ -8,21 +63,20 @@ class HostFile:
     def __init__(self, host_file_path: str):
         self.host_file_path = host_file_path
 
+    def _read_hosts(self) -> list:
+        with open(self.host_file_path, 'r') as host_file:
+            return parse_hosts(host_file.read())
+
     def find_new_host(self) -> list:
         """
         Ищет обновления в файле
         Returns:
             list: Список добавленных хостов
         """
+        hostname_db = {host.hostname for host in DATABASE.get_host_list()}
 
-        hostname_db = DATABASE.get_host_list()
-
-        with open(self.host_file_path, 'r') as host_file:
-            # Читаем список хостов из файла и разделяем их по символу переноса строки
-            read_hosts = host_file.read().split("\n")
-            # Отделяем хосты, которые занесены в БД
-            return [re.sub(r'(\s+)', '', host) for host in read_hosts if
-                    host not in [host.hostname for host in hostname_db] and re.match(r".+\..+", host) is not None]
+        # Отделяем хосты, которые занесены в БД
+        return [host for host in self._read_hosts() if host not in hostname_db]
 
     def find_deleted_host(self) -> list:
         """
@@ -30,10 +84,7 @@ class HostFile:
         Returns:
             list: Список хостов, которые были удалены
         """
-        hostname_db = DATABASE.get_host_list()
+        read_hosts = set(self._read_hosts())
 
-        with open(self.host_file_path, 'r') as host_file:
-            # Читаем список хостов из файла и разделяем их по символу переноса строки
-            read_hosts = host_file.read().split("\n")
-            # Ищем разницу между тем, что в файле и в базе данных
-            return [host for host in hostname_db if host.hostname not in read_hosts]
+        # Ищем разницу между тем, что в файле и в базе данных
+        return [host for host in DATABASE.get_host_list() if host.hostname not in read_hosts]
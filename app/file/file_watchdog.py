@@ -1,71 +1,142 @@
+from asyncio import get_running_loop, to_thread
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
 from pathlib import Path
-from app.file import HostFile
-from app.lookup import find_all_ip_hostname
+from app.file import HostFileIndex
+from app.file.coalescer import EventCoalescer
 from app.logger import get_logger
-from app.utils import add_new_ip_all_service, delete_host_from_all_service
+from app.metrics import Counter
+from app.utils import apply_host_list_changes, sync_router
+from app.setting import DATABASE, LOOKUP, RECONCILERS
 
 
 log = get_logger(__name__)
 
+WATCHDOG_EVENTS = Counter('ufir_watchdog_events_total', 'События файловой системы по спискам хостов',
+                          labels=('event',))
+WATCHDOG_UPDATES = Counter('ufir_watchdog_updates_total', 'Обновления после пачки событий файловой системы')
+
 
 class HostFileWatchdog:
-    """Класс для работы со слежением за файлом с хостами"""
-    def __init__(self, file_path: [Path, str]):
-        self.file_path = Path(file_path)
+    """Класс для работы со слежением за файлами с хостами нескольких групп адресов"""
+    def __init__(self, host_lists: dict, quiet_window: float = 1.0):
+        """
+        Args:
+            host_lists (dict): Словарь группа адресов - путь до файла с хостами этой группы
+            quiet_window (float): Окно тишины в секундах, за которое пачка событий сводится в одно обновление
+        """
+        self.file_paths = {group: Path(file_path) for group, file_path in host_lists.items()}
         self.observer = Observer()
 
-        # Если файла с хостами не существует - создать его
-        if not self.file_path.exists():
-            log.warning(f"По адресу {self.file_path} не обнаружен файл, будет создан новый")
-            try:
-                self.file_path.touch()
-            except OSError as err:
-                log.error(f"Ошибка при создании файла: {err}")
-
-        hostname_handler = self.HostFileHandler(
-            patterns=[self.file_path.parts[-1]],
-            ignore_directories=True,
-            case_sensitive=False)
-        file_dir = '/'.join(self.file_path.parts[:-1]).replace("\\", '') if len(self.file_path.parts) > 1 else "./"
-        self.observer.schedule(hostname_handler, path=file_dir)
+        for file_path in self.file_paths.values():
+            # Если файла с хостами не существует - создать его
+            if not file_path.exists():
+                log.warning("По адресу %s не обнаружен файл, будет создан новый", file_path)
+                try:
+                    file_path.touch()
+                except OSError as err:
+                    log.error("Ошибка при создании файла: %s", err)
+
+        self.indexes = {group: HostFileIndex(host_file_path=str(file_path),
+                                             hostnames=DATABASE.get_group_host_list(group=group))
+                        for group, file_path in self.file_paths.items()}
+        self.coalescer = EventCoalescer(callback=self.update_ip_table, quiet_window=quiet_window)
+
+        # Один Observer следит за всеми каталогами, в каждом каталоге - только за файлами списков
+        directories = {}
+        for file_path in self.file_paths.values():
+            file_dir = '/'.join(file_path.parts[:-1]).replace("\\", '') if len(file_path.parts) > 1 else "./"
+            directories.setdefault(file_dir, []).append(file_path.parts[-1])
+
+        for file_dir, patterns in directories.items():
+            hostname_handler = self.HostFileHandler(
+                coalescer=self.coalescer,
+                patterns=patterns,
+                ignore_directories=True,
+                case_sensitive=False)
+            self.observer.schedule(hostname_handler, path=file_dir)
 
     class HostFileHandler(PatternMatchingEventHandler):
         """Класс слежения за изменениями в файле"""
+        def __init__(self, coalescer: EventCoalescer, **kwargs):
+            """
+            Args:
+                coalescer (EventCoalescer): Очередь, в которую передаются события для обработки в event loop
+            """
+            super().__init__(**kwargs)
+            self.coalescer = coalescer
+
         def on_modified(self, event):
             """Обрабатывает ивенты при изменениях в файле"""
-            self.update_ip_table(event.src_path)
+            WATCHDOG_EVENTS.inc(event='modified')
+            self.coalescer.notify()
 
-        @classmethod
-        def update_ip_table(cls, file_path: str) -> None:
-            """
-            Обновить данные в ip таблицах, если найдены изменения
-            Args:
-                file_path (str): Путь до файла с хостами
+        def on_created(self, event):
+            """Обрабатывает создание файла, например после удаления и записи заново"""
+            WATCHDOG_EVENTS.inc(event='created')
+            self.coalescer.notify()
 
-            Returns:
-                None:
-            """
-            host_file = HostFile(host_file_path=file_path)
-            new_hosts = host_file.find_new_host()
-            if new_hosts:
-                log.info(f"Обнаружено добавление хостов: {', '.join(new_hosts)}")
-                for host in new_hosts:
-                    ip_list = find_all_ip_hostname(hostname=host)
-                    add_new_ip_all_service(hostname=host, ip_address_list=ip_list)
+        def on_moved(self, event):
+            """Обрабатывает атомарное сохранение через запись во временный файл и переименование"""
+            WATCHDOG_EVENTS.inc(event='moved')
+            self.coalescer.notify()
 
-            deleted_hosts = host_file.find_deleted_host()
+    async def update_ip_table(self) -> None:
+        """
+        Обновить данные в ip таблицах, если найдены изменения в каком-либо из файлов.
+        Хост, добавленный сразу в несколько групп или уже известный по другой группе, не ищется повторно
+
+        Returns:
+            None:
+        """
+        WATCHDOG_UPDATES.inc()
+        added, deleted = {}, {}
+        for group, index in self.indexes.items():
+            # Чтение файла списка блокирующее, поэтому идет в отдельном потоке
+            file_changes = await to_thread(index.update)
+            if file_changes is None:
+                continue
+
+            new_hosts, deleted_hosts = file_changes
+            if new_hosts:
+                log.info("Обнаружено добавление хостов в группу %s: %d", group, len(new_hosts))
+                log.debug("Добавлены хосты группы %s: %s", group, ', '.join(new_hosts))
+                added[group] = new_hosts
             if deleted_hosts:
-                log.info(f"Обнаружено удаление хостов: {', '.join([host.hostname for host in deleted_hosts])}")
-                for host in deleted_hosts:
-                    delete_host_from_all_service(hostname=host)
+                log.info("Обнаружено удаление хостов из группы %s: %d", group, len(deleted_hosts))
+                log.debug("Удалены хосты группы %s: %s", group, ', '.join(deleted_hosts))
+                deleted[group] = deleted_hosts
+
+        if not added and not deleted:
+            return
+
+        lookup_result = {}
+        for hostname in {host for hosts in added.values() for host in hosts}:
+            known = [reconciler for reconciler in RECONCILERS.values() if hostname in reconciler.desired.hosts()]
+            if known:
+                lookup_result[hostname] = sorted(known[0].desired.host_ip(hostname))
+
+        new_hosts = list(dict.fromkeys(host for hosts in added.values() for host in hosts
+                                       if host not in lookup_result))
+        if new_hosts:
+            for host, result in (await LOOKUP.resolve_all(new_hosts)).items():
+                lookup_result[host] = result.ip_list if result is not None else []
+
+        await apply_host_list_changes(added=added, deleted=deleted, lookup_result=lookup_result)
+
+        # Изменения всех групп применяются в UBNT за одну сессию конфигурации
+        await sync_router()
 
     async def start(self) -> None:
         """
-        Запускает слежение за файлом
+        Запускает слежение за файлом и обработку событий в event loop
         Returns:
             None:
         """
+        self.coalescer.attach(get_running_loop())
         self.observer.start()
-        log.info(f"Запущено слежение за файлом {self.file_path}")
+        log.info("Запущено слежение за файлами %s", ', '.join(map(str, self.file_paths.values())))
+
+        # Файлы могли измениться, пока сервис не работал
+        self.coalescer.notify()
+        await self.coalescer.run()
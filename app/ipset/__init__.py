@@ -0,0 +1 @@
+from app.ipset.ipset import IPSet, ip_to_int, int_to_ip, ip6_to_int, int_to_ip6
@@ -0,0 +1,275 @@
+import socket
+import sys
+from array import array
+from bisect import bisect_left
+from functools import partial
+from typing import Iterable, Union
+
+try:
+    import numpy
+except ImportError:
+    # Без numpy операции над множествами выполняются средствами стандартной библиотеки
+    numpy = None
+
+
+# Беззнаковое 32-битное целое, на большинстве платформ это 'I'
+_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+_SWAP_BYTES = sys.byteorder == 'little'
+
+
+def ip_to_int(ip_address: str) -> int:
+    """
+    Переводит IPv4 адрес в число
+    Args:
+        ip_address (str): IPv4 адрес в десятичной записи с точками
+
+    Returns:
+        int: Адрес как беззнаковое 32-битное число
+
+    Raises:
+        ValueError: Если строка не является IPv4 адресом
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"{ip_address!r} не является IPv4 адресом") from None
+
+
+def int_to_ip(value: int) -> str:
+    """
+    Переводит число в IPv4 адрес
+    Args:
+        value (int): Беззнаковое 32-битное число
+
+    Returns:
+        str: IPv4 адрес в десятичной записи с точками
+    """
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+def ip6_to_int(ip_address: str) -> int:
+    """
+    Переводит IPv6 адрес в число
+    Args:
+        ip_address (str): IPv6 адрес
+
+    Returns:
+        int: Адрес как беззнаковое 128-битное число
+
+    Raises:
+        ValueError: Если строка не является IPv6 адресом
+    """
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"{ip_address!r} не является IPv6 адресом") from None
+
+
+def int_to_ip6(value: int) -> str:
+    """
+    Переводит число в IPv6 адрес
+    Args:
+        value (int): Беззнаковое 128-битное число
+
+    Returns:
+        str: IPv6 адрес в сокращенной записи
+    """
+    return socket.inet_ntop(socket.AF_INET6, value.to_bytes(16, 'big'))
+
+
+class IPSet:
+    """
+    Множество IPv4 адресов, хранящееся как отсортированный массив 32-битных чисел.
+    Занимает 4 байта на адрес вместо ~100 байт на строку в set, а операции над множествами
+    выполняются слиянием массивов (в numpy - векторно)
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, values: Iterable[int] = ()):
+        """
+        Args:
+            values (Iterable[int]): Адреса в виде чисел, в любом порядке и с повторами
+        """
+        self._data = array(_TYPECODE, sorted(set(values)))
+
+    @classmethod
+    def _from_sorted(cls, data) -> 'IPSet':
+        """Создает множество из уже отсортированного массива без повторов"""
+        ip_set = cls.__new__(cls)
+        if numpy is not None and isinstance(data, numpy.ndarray):
+            data = array(_TYPECODE, data.astype(numpy.uint32).tobytes())
+        ip_set._data = data
+        return ip_set
+
+    @classmethod
+    def from_sorted_values(cls, values: Iterable[int]) -> 'IPSet':
+        """
+        Создает множество из чисел, которые уже отсортированы и не повторяются, например из ORDER BY в БД
+        Args:
+            values (Iterable[int]): Адреса в виде чисел по возрастанию
+
+        Returns:
+            IPSet: Множество адресов
+        """
+        return cls._from_sorted(array(_TYPECODE, values))
+
+    @classmethod
+    def from_strings(cls, ip_list: Iterable[str], strict: bool = True) -> 'IPSet':
+        """
+        Создает множество из строк
+        Args:
+            ip_list (Iterable[str]): IPv4 адреса
+            strict (bool): True - поднимать ошибку на строке, которая не является IPv4 адресом, False - пропускать ее
+
+        Returns:
+            IPSet: Множество адресов
+
+        Raises:
+            ValueError: Если strict и строка не является IPv4 адресом
+        """
+        ip_list = list(ip_list)
+        try:
+            packed = b''.join(map(partial(socket.inet_pton, socket.AF_INET), ip_list))
+        except (OSError, TypeError):
+            # Среди строк есть не IPv4 адрес - разбираем по одной, чтобы найти или пропустить его
+            packed = bytearray()
+            for ip_address in ip_list:
+                try:
+                    packed += socket.inet_pton(socket.AF_INET, ip_address)
+                except (OSError, TypeError):
+                    if strict:
+                        raise ValueError(f"{ip_address!r} не является IPv4 адресом") from None
+
+        data = array(_TYPECODE, bytes(packed))
+        if _SWAP_BYTES:
+            data.byteswap()
+
+        if numpy is not None:
+            return cls._from_sorted(numpy.unique(numpy.frombuffer(data, dtype=numpy.uint32)))
+        return cls(data)
+
+    def to_strings(self) -> list:
+        """
+        Returns:
+            list: Отсортированный список адресов в виде строк
+        """
+        data = array(_TYPECODE, self._data)
+        if _SWAP_BYTES:
+            data.byteswap()
+        packed = data.tobytes()
+        return [socket.inet_ntoa(packed[index:index + 4]) for index in range(0, len(packed), 4)]
+
+    def values(self) -> array:
+        """
+        Returns:
+            array: Отсортированный массив адресов в виде чисел, без копирования
+        """
+        return self._data
+
+    def between(self, first: int, last: int) -> array:
+        """
+        Адреса из диапазона, найденные двоичным поиском
+        Args:
+            first (int): Первый адрес диапазона в виде числа
+            last (int): Последний адрес диапазона в виде числа
+
+        Returns:
+            array: Отсортированный массив адресов диапазона
+        """
+        return self._data[bisect_left(self._data, first):bisect_left(self._data, last + 1)]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __bool__(self) -> bool:
+        return len(self._data) > 0
+
+    def __iter__(self):
+        return iter(self.to_strings())
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, IPSet):
+            return NotImplemented
+        return self._data == other._data
+
+    def __repr__(self) -> str:
+        return f"IPSet({len(self)} адресов)"
+
+    @staticmethod
+    def _value(ip_address: Union[str, int]) -> int:
+        return ip_address if isinstance(ip_address, int) else ip_to_int(ip_address)
+
+    def _index(self, value: int) -> int:
+        index = bisect_left(self._data, value)
+        return index if index < len(self._data) and self._data[index] == value else -1
+
+    def __contains__(self, ip_address: Union[str, int]) -> bool:
+        try:
+            return self._index(self._value(ip_address)) >= 0
+        except ValueError:
+            return False
+
+    def add(self, ip_address: Union[str, int]) -> None:
+        """
+        Добавляет адрес, сохраняя порядок. Вставка сдвигает хвост массива, поэтому подходит для точечных изменений
+        Args:
+            ip_address (str|int): IPv4 адрес
+
+        Returns:
+            None:
+        """
+        value = self._value(ip_address)
+        index = bisect_left(self._data, value)
+        if index == len(self._data) or self._data[index] != value:
+            self._data.insert(index, value)
+
+    def discard(self, ip_address: Union[str, int]) -> None:
+        """
+        Удаляет адрес, если он есть в множестве
+        Args:
+            ip_address (str|int): IPv4 адрес
+
+        Returns:
+            None:
+        """
+        try:
+            index = self._index(self._value(ip_address))
+        except ValueError:
+            return
+        if index >= 0:
+            del self._data[index]
+
+    def _numpy_pair(self, other: 'IPSet') -> tuple:
+        return numpy.frombuffer(self._data, dtype=numpy.uint32), numpy.frombuffer(other._data, dtype=numpy.uint32)
+
+    def union(self, other: 'IPSet') -> 'IPSet':
+        """Адреса, которые есть хотя бы в одном из множеств"""
+        if numpy is not None:
+            return self._from_sorted(numpy.union1d(*self._numpy_pair(other)))
+        return IPSet(set(self._data).union(other._data))
+
+    def difference(self, other: 'IPSet') -> 'IPSet':
+        """Адреса, которых нет в other"""
+        if numpy is not None:
+            return self._from_sorted(numpy.setdiff1d(*self._numpy_pair(other), assume_unique=True))
+        other_values = set(other._data)
+        return self._from_sorted(array(_TYPECODE, (value for value in self._data if value not in other_values)))
+
+    def intersection(self, other: 'IPSet') -> 'IPSet':
+        """Адреса, которые есть в обоих множествах"""
+        if numpy is not None:
+            return self._from_sorted(numpy.intersect1d(*self._numpy_pair(other), assume_unique=True))
+        other_values = set(other._data)
+        return self._from_sorted(array(_TYPECODE, (value for value in self._data if value in other_values)))
+
+    def symmetric_difference(self, other: 'IPSet') -> 'IPSet':
+        """Адреса, которые есть только в одном из множеств"""
+        if numpy is not None:
+            return self._from_sorted(numpy.setxor1d(*self._numpy_pair(other), assume_unique=True))
+        return IPSet(set(self._data).symmetric_difference(other._data))
+
+    __or__ = union
+    __sub__ = difference
+    __and__ = intersection
+    __xor__ = symmetric_difference
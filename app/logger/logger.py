@@ -1,33 +1,121 @@
+import atexit
+import json
 import logging
+import logging.handlers
 from os import environ
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock
+from typing import Optional
 
-_log_format = f"%(asctime)s [%(levelname)s] - %(name)s | %(message)s"
-_log_level = environ.get("LOGGING_LEVEL", "WARNING").upper()
+_log_format = "%(asctime)s [%(levelname)s] - %(name)s | %(message)s"
+
+_lock = Lock()
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует запись журнала одной строкой JSON для сборщиков логов"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level: Optional[str] = None, path: Optional[str] = None, json_format: Optional[bool] = None,
+                      max_bytes: Optional[int] = None, backup_count: Optional[int] = None) -> None:
+    """
+    Настраивает обработчики журнала один раз на процесс. Записи из event loop и потоков попадают в очередь,
+    а вывод в консоль и запись в файл с ротацией выполняет отдельный поток QueueListener.
+    Не переданные параметры берутся из LOGGING_LEVEL, LOGGING_PATH, LOGGING_FORMAT, LOGGING_MAX_BYTES
+    и LOGGING_BACKUP_COUNT, повторный вызов ничего не меняет
+    Args:
+        level (str|None): Уровень журнала
+        path (str|None): Путь до файла журнала
+        json_format (bool|None): Записывать журнал строками JSON
+        max_bytes (int|None): Размер файла журнала, после которого он ротируется, 0 - без ротации
+        backup_count (int|None): Количество хранимых старых файлов журнала
+
+    Returns:
+        None:
+    """
+    global _queue_handler, _listener
+
+    with _lock:
+        if _queue_handler is not None:
+            return
+
+        level = (level or environ.get("LOGGING_LEVEL", "WARNING")).upper()
+        if json_format is None:
+            json_format = environ.get("LOGGING_FORMAT", "text").lower() == "json"
+        formatter = JsonFormatter() if json_format else logging.Formatter(_log_format)
+
+        path = Path(path or environ.get("LOGGING_PATH", 'ufir.log'))
+        # Каталог журнала не хранится в репозитории и создается при первом запуске
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            filename=path,
+            maxBytes=max_bytes if max_bytes is not None else int(environ.get("LOGGING_MAX_BYTES", "10485760")),
+            backupCount=backup_count if backup_count is not None else int(environ.get("LOGGING_BACKUP_COUNT", "5")),
+            encoding='utf-8')
+        handlers = [logging.StreamHandler(), file_handler]
+        for handler in handlers:
+            handler.setLevel(level)
+            handler.setFormatter(formatter)
+
+        queue = SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(queue)
+        _queue_handler.setLevel(level)
+        _listener = logging.handlers.QueueListener(queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # Записи, оставшиеся в очереди, дописываются при завершении процесса
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Дописывает записи из очереди и останавливает поток журнала
+
+    Returns:
+        None:
+    """
+    global _queue_handler, _listener
+
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        for logger in logging.Logger.manager.loggerDict.values():
+            if isinstance(logger, logging.Logger) and _queue_handler in logger.handlers:
+                logger.removeHandler(_queue_handler)
+        _queue_handler, _listener = None, None
 
 
 def get_logger(name: str) -> logging.Logger:
     """
-    Получить сконфигурированный логгер
+    Получить сконфигурированный логгер. Повторный вызов с тем же именем не добавляет обработчиков
     Args:
         name (str): Название модуля
 
     Returns:
         logging.Logger: Сконфигурированный экземпляр логгера
     """
-
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(_log_level)
-    stream_handler.setFormatter(logging.Formatter(_log_format))
-
-    file_handler = logging.FileHandler(
-        filename=environ.get("LOGGING_PATH", 'ufir.log'),
-        encoding='utf-8')
-    file_handler.setLevel(_log_level)
-    file_handler.setFormatter(logging.Formatter(_log_format))
+    configure_logging()
 
     logger = logging.getLogger(name)
-    logger.setLevel(_log_level)
-    logger.addHandler(stream_handler)
-    logger.addHandler(file_handler)
+    logger.setLevel(_queue_handler.level)
+    if _queue_handler not in logger.handlers:
+        logger.addHandler(_queue_handler)
 
     return logger
@@ -1 +1,4 @@
-from app.lookup.lookup import *
\ No newline at end of file
+from app.lookup.dns import DnsResolver, LookupResult
+from app.lookup.async_lookup import AsyncLookup
+from app.lookup.scheduler import TtlScheduler
+from app.lookup.cache import DnsCache
@@ -0,0 +1,173 @@
+import asyncio
+import socket
+import re
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Iterable, Optional
+from app.lookup.cache import DnsCache
+from app.lookup.dns import DnsResolver, LookupResult, QTYPE_A, QTYPE_AAAA
+from app.lookup.exceptions import *
+from app.metrics import Counter, Histogram
+from app.logger import get_logger
+
+
+log = get_logger(__name__)
+
+LOOKUP_DURATION = Histogram('ufir_lookup_duration_seconds', 'Время lookup хоста с повторными попытками')
+LOOKUPS = Counter('ufir_lookups_total', 'Lookup хостов по результату: found, not_found, failed и cached',
+                  labels=('result',))
+
+
+class AsyncLookup:
+    """Асинхронный lookup хостов с ограничением количества одновременных запросов"""
+
+    def __init__(self, concurrency: int = 64, timeout: float = 5.0, retries: int = 2,
+                 resolver: Optional[DnsResolver] = None, ipv6: bool = False, cache: Optional[DnsCache] = None,
+                 samples: int = 1):
+        """
+        Args:
+            concurrency (int): Максимальное количество одновременных запросов
+            timeout (float): Время ожидания ответа на один запрос в секундах
+            retries (int): Количество повторных попыток при превышении времени ожидания
+            resolver (DnsResolver|None): DNS клиент, если не указан - используется системный резолвер без TTL
+            ipv6 (bool): Искать также IPv6 адреса (записи AAAA)
+            cache (DnsCache|None): Общий кэш результатов, None - каждый lookup идет к резолверу
+            samples (int): Количество запросов каждого типа записей к DNS клиенту за один lookup, ответы объединяются.
+                           Так собираются адреса, которые round-robin DNS отдает разными подмножествами
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.resolver = resolver
+        self.ipv6 = ipv6
+        self.cache = cache
+        self.samples = max(1, samples)
+        self._in_flight = {}  # Хост - задача lookup, которую разделяют одновременные запросы одного хоста
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Отдельный пул потоков под резолвер, чтобы запросы не ждали в очереди общего executor
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='lookup')
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """
+        Общий для всех lookup семафор, создается при первом использовании в работающем event loop
+
+        Returns:
+            asyncio.Semaphore: Семафор, ограничивающий количество одновременных запросов значением concurrency
+        """
+        loop = asyncio.get_running_loop()
+        # Семафор привязан к event loop, в котором был создан
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _query(self, hostname: str) -> LookupResult:
+        """
+        Выполняет один запрос к резолверу без блокировки event loop.
+        Записи A и AAAA и повторные запросы samples выполняются одновременно и занимают одно место
+        в ограничении одновременных запросов
+        Args:
+            hostname (str): Название хоста
+
+        Returns:
+            LookupResult: Список IP адресов в порядке ответа резолвера, IPv4 первыми, и минимальный TTL ответов
+        """
+        if self.resolver is not None:
+            qtypes = (QTYPE_A, QTYPE_AAAA) if self.ipv6 else (QTYPE_A,)
+            results = await asyncio.gather(*(self.resolver.query(hostname=hostname, qtype=qtype)
+                                             for qtype in qtypes for _ in range(self.samples)))
+            if len(results) == 1:
+                return results[0]
+
+            ttl_list = [result.ttl for result in results if result.ttl is not None]
+            return LookupResult(ip_list=list(dict.fromkeys(ip for result in results for ip in result.ip_list)),
+                                ttl=min(ttl_list) if ttl_list else None)
+
+        family = socket.AF_UNSPEC if self.ipv6 else socket.AF_INET
+        address_info = await asyncio.get_running_loop().run_in_executor(
+            self._executor, socket.getaddrinfo, hostname, None, family, socket.SOCK_STREAM)
+        # IPv4 адреса первыми, порядок внутри семейства сохраняется
+        address_info.sort(key=lambda info: info[0] != socket.AF_INET)
+
+        # getaddrinfo возвращает по записи на каждый адрес, убираем дубликаты с сохранением порядка
+        return LookupResult(ip_list=list(dict.fromkeys(info[4][0] for info in address_info)))
+
+    async def resolve(self, hostname: str,
+                      semaphore: Optional[asyncio.Semaphore] = None) -> Optional[LookupResult]:
+        """
+        Ищет все ip по заданному host с учетом таймаута и повторных попыток.
+        Результат берется из кэша, если он там есть, а одновременные запросы одного хоста выполняются одним lookup
+        Args:
+            hostname (str): Название хоста, по которому необходимо найти ip
+            semaphore (asyncio.Semaphore|None): Семафор, ограничивающий количество одновременных запросов,
+                                                 None - общий семафор экземпляра
+
+        Returns:
+            LookupResult|None: Список IP адресов и TTL, пустой список - если хост не существует,
+                               None - если резолвер так и не ответил
+        """
+        clear_hostname = re.sub(r'(\s+)', '', hostname)
+        if self.cache is not None:
+            found, result = self.cache.get(clear_hostname)
+            if found:
+                LOOKUPS.inc(result='cached')
+                return result
+
+        task = self._in_flight.get(clear_hostname)
+        if task is None:
+            semaphore = semaphore or self._get_semaphore()
+            task = asyncio.ensure_future(self._resolve(clear_hostname, semaphore))
+            self._in_flight[clear_hostname] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(clear_hostname, None))
+
+        # Отмена одного из ожидающих не должна отменять lookup остальных
+        return await asyncio.shield(task)
+
+    async def _resolve(self, hostname: str, semaphore: asyncio.Semaphore) -> Optional[LookupResult]:
+        """Выполняет lookup с повторными попытками и сохраняет результат в кэш"""
+        result = None
+        start = perf_counter()
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    result = await asyncio.wait_for(self._query(hostname), timeout=self.timeout)
+                break
+
+            except socket.gaierror as err:
+                # Временная ошибка резолвера - имеет смысл повторить, остальные ошибки означают отсутствие хоста
+                if err.errno != socket.EAI_AGAIN:
+                    log.error("Ошибка lookup хоста %s - %s", hostname, err)
+                    result = LookupResult(ip_list=[])
+                    break
+                log.warning("Временная ошибка lookup хоста %s, попытка %d - %s", hostname, attempt + 1, err)
+
+            except (DnsError, OSError) as err:
+                log.warning("Ошибка DNS сервера при lookup хоста %s, попытка %d - %s", hostname, attempt + 1, err)
+
+            except asyncio.TimeoutError:
+                log.warning("Превышено время ожидания lookup хоста %s, попытка %d", hostname, attempt + 1)
+
+        else:
+            log.error("Не удалось выполнить lookup хоста %s за %d попыток", hostname, self.retries + 1)
+
+        LOOKUP_DURATION.observe(perf_counter() - start)
+        LOOKUPS.inc(result='failed' if result is None else 'found' if result.ip_list else 'not_found')
+        if self.cache is not None:
+            self.cache.store(hostname, result)
+        return result
+
+    async def resolve_all(self, hostname_list: Iterable[str]) -> dict:
+        """
+        Параллельно ищет ip для всех переданных хостов
+        Args:
+            hostname_list (Iterable[str]): Список хостов
+
+        Returns:
+            dict: Словарь хост - LookupResult, для хостов без ответа резолвера значение None
+        """
+        hostname_list = list(hostname_list)
+
+        lookup_result = await asyncio.gather(*[self.resolve(hostname=hostname) for hostname in hostname_list])
+
+        return dict(zip(hostname_list, lookup_result))
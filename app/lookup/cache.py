@@ -0,0 +1,140 @@
+import math
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+
+from app.lookup.dns import LookupResult
+
+
+class DnsCacheStats:
+    """Статистика кэша результатов lookup"""
+
+    def __init__(self):
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.negative_hits + self.misses
+        return (self.hits + self.negative_hits) / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+class DnsCache:
+    """
+    Общий кэш результатов lookup с вытеснением давно не использованных хостов.
+    Положительные ответы хранятся по TTL записей, отсутствие хоста и ошибки резолвера - короткое время,
+    чтобы неудачный хост не запрашивался на каждом проходе
+    """
+
+    def __init__(self, max_size: int = 10000, min_ttl: float = 0, max_ttl: float = 3600, default_ttl: float = 30,
+                 negative_ttl: float = 30, failure_ttl: float = 5, refresh_margin: float = 1.0):
+        """
+        Args:
+            max_size (int): Максимальное количество хостов в кэше
+            min_ttl (float): Минимальное время хранения положительного ответа в секундах
+            max_ttl (float): Максимальное время хранения положительного ответа в секундах
+            default_ttl (float): Время хранения ответа без TTL, например от системного резолвера
+            negative_ttl (float): Максимальное время хранения ответа об отсутствии хоста (NXDOMAIN)
+            failure_ttl (float): Время хранения ошибки резолвера (SERVFAIL, превышение времени ожидания)
+            refresh_margin (float): Запись, которой осталось жить меньше этого времени, считается устаревшей,
+                                    чтобы проверка по истечении TTL получала свежий ответ
+        """
+        self.max_size = max_size
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.failure_ttl = failure_ttl
+        self.refresh_margin = refresh_margin
+        self.stats = DnsCacheStats()
+        self._entries = OrderedDict()  # Хост - (время истечения по monotonic, LookupResult|None)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, hostname: str, now: Optional[float] = None) -> tuple:
+        """
+        Ищет результат lookup в кэше
+        Args:
+            hostname (str): Название хоста
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            tuple: Найден ли хост и его LookupResult с оставшимся TTL. None вместо результата - резолвер не ответил
+        """
+        now = monotonic() if now is None else now
+        with self._lock:
+            cached = self._entries.get(hostname)
+            if cached is None or cached[0] - now <= self.refresh_margin:
+                self.stats.misses += 1
+                return False, None
+
+            self._entries.move_to_end(hostname)
+            expires, result = cached
+            if result is None or not result.ip_list:
+                self.stats.negative_hits += 1
+            else:
+                self.stats.hits += 1
+
+        if result is None or result.ttl is None:
+            return True, result
+        return True, result._replace(ttl=math.ceil(expires - now))
+
+    def store(self, hostname: str, result: Optional[LookupResult], now: Optional[float] = None) -> None:
+        """
+        Сохраняет результат lookup
+        Args:
+            hostname (str): Название хоста
+            result (LookupResult|None): Результат lookup, None - резолвер не ответил
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            None:
+        """
+        if self.max_size <= 0:
+            return
+
+        if result is None:
+            ttl = self.failure_ttl
+        elif not result.ip_list:
+            ttl = min(result.ttl, self.negative_ttl) if result.ttl is not None else self.negative_ttl
+        elif result.ttl is None:
+            ttl = self.default_ttl
+        else:
+            ttl = min(max(result.ttl, self.min_ttl), self.max_ttl)
+
+        now = monotonic() if now is None else now
+        with self._lock:
+            self._entries[hostname] = (now + ttl, result)
+            self._entries.move_to_end(hostname)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, hostname: str = None) -> None:
+        """
+        Удаляет хост из кэша, следующий lookup пойдет к резолверу
+        Args:
+            hostname (str|None): Название хоста, None - очистить кэш
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            if hostname is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(hostname, None)
@@ -0,0 +1,230 @@
+import asyncio
+import random
+import socket
+import struct
+from typing import NamedTuple, Optional
+
+from app.lookup.exceptions import *
+
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+_CLASS_IN = 1
+_FLAG_RD = 0x0100
+_FLAG_TC = 0x0200
+_HEADER = struct.Struct('!HHHHHH')
+_RR_HEADER = struct.Struct('!HHIH')
+
+
+class LookupResult(NamedTuple):
+    """Результат lookup хоста"""
+    ip_list: list
+    ttl: Optional[int] = None  # Минимальный TTL записей ответа, None - если TTL неизвестен
+
+
+class DnsRecord(NamedTuple):
+    """Запись из секции ответа DNS"""
+    name: str
+    rtype: int
+    ttl: int
+    value: str
+
+
+class DnsResponse(NamedTuple):
+    """Разобранный ответ DNS сервера"""
+    qid: int
+    rcode: int
+    truncated: bool
+    answers: list
+    negative_ttl: Optional[int]  # TTL отрицательного ответа по SOA из секции authority
+
+
+def build_query(qid: int, hostname: str, qtype: int) -> bytes:
+    """
+    Собирает DNS запрос
+    Args:
+        qid (int): Идентификатор запроса
+        hostname (str): Название хоста
+        qtype (int): Тип запрашиваемой записи
+
+    Returns:
+        bytes: DNS запрос в формате wire
+    """
+    qname = b''.join(bytes([len(label)]) + label for label in hostname.strip('.').encode('idna').split(b'.'))
+
+    return _HEADER.pack(qid, _FLAG_RD, 1, 0, 0, 0) + qname + b'\x00' + struct.pack('!HH', qtype, _CLASS_IN)
+
+
+def _read_name(data: bytes, offset: int) -> tuple:
+    """
+    Читает доменное имя с учетом сжатия
+    Args:
+        data (bytes): Сообщение целиком
+        offset (int): Смещение начала имени
+
+    Returns:
+        tuple: Имя и смещение сразу после него
+    """
+    labels = []
+    end_offset = None
+
+    # Ограничиваем количество переходов по указателям, чтобы не зациклиться на некорректном ответе
+    for _ in range(128):
+        length = data[offset]
+
+        if length & 0xC0 == 0xC0:
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+        elif length == 0:
+            return '.'.join(labels), end_offset if end_offset is not None else offset + 1
+        else:
+            labels.append(data[offset + 1:offset + 1 + length].decode('ascii', errors='replace'))
+            offset += length + 1
+
+    raise DnsError("Некорректное сжатие имени в ответе DNS")
+
+
+def parse_response(data: bytes) -> DnsResponse:
+    """
+    Разбирает ответ DNS сервера
+    Args:
+        data (bytes): Ответ в формате wire
+
+    Returns:
+        DnsResponse: Разобранный ответ
+
+    Raises:
+        DnsError: Если ответ не удается разобрать
+    """
+    try:
+        qid, flags, qd_count, an_count, ns_count, _ = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+
+        for _ in range(qd_count):
+            offset = _read_name(data, offset)[1] + 4
+
+        answers = []
+        negative_ttl = None
+        for index in range(an_count + ns_count):
+            name, offset = _read_name(data, offset)
+            rtype, rclass, ttl, rd_length = _RR_HEADER.unpack_from(data, offset)
+            offset += _RR_HEADER.size
+            rdata_offset, offset = offset, offset + rd_length
+
+            if index >= an_count:
+                # В секции authority интересует только SOA - из нее берется TTL отрицательного ответа
+                if rtype == QTYPE_SOA:
+                    soa_minimum = struct.unpack_from('!I', data, offset - 4)[0]
+                    negative_ttl = min(ttl, soa_minimum)
+                continue
+
+            if rtype == QTYPE_A:
+                value = socket.inet_ntop(socket.AF_INET, data[rdata_offset:offset])
+            elif rtype == QTYPE_AAAA:
+                value = socket.inet_ntop(socket.AF_INET6, data[rdata_offset:offset])
+            elif rtype == QTYPE_CNAME:
+                value = _read_name(data, rdata_offset)[0]
+            else:
+                continue
+
+            answers.append(DnsRecord(name=name, rtype=rtype, ttl=ttl, value=value))
+
+    except (struct.error, IndexError, ValueError) as err:
+        raise DnsError(f"Некорректный ответ DNS: {err}")
+
+    return DnsResponse(qid=qid, rcode=flags & 0x000F, truncated=bool(flags & _FLAG_TC), answers=answers,
+                       negative_ttl=negative_ttl)
+
+
+class _UdpQueryProtocol(asyncio.DatagramProtocol):
+    """Протокол для одного UDP запроса к DNS серверу"""
+
+    def __init__(self, query: bytes, qid: int, response: asyncio.Future):
+        self.query = query
+        self.qid = qid
+        self.response = response
+
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+
+    def datagram_received(self, data, addr):
+        # Ответы с чужим идентификатором игнорируются
+        if not self.response.done() and len(data) >= 2 and struct.unpack_from('!H', data)[0] == self.qid:
+            self.response.set_result(data)
+
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+
+
+class DnsResolver:
+    """Асинхронный DNS клиент, который читает записи вместе с их TTL"""
+
+    def __init__(self, nameserver: str = '127.0.0.1', port: int = 53):
+        """
+        Args:
+            nameserver (str): Адрес DNS сервера
+            port (int): Порт DNS сервера
+        """
+        self.nameserver = nameserver
+        self.port = port
+
+    async def _query_udp(self, query: bytes, qid: int) -> bytes:
+        loop = asyncio.get_running_loop()
+        response = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpQueryProtocol(query=query, qid=qid, response=response),
+            remote_addr=(self.nameserver, self.port))
+        try:
+            return await response
+        finally:
+            transport.close()
+
+    async def _query_tcp(self, query: bytes) -> bytes:
+        reader, writer = await asyncio.open_connection(self.nameserver, self.port)
+        try:
+            writer.write(struct.pack('!H', len(query)) + query)
+            await writer.drain()
+            length = struct.unpack('!H', await reader.readexactly(2))[0]
+            return await reader.readexactly(length)
+        finally:
+            writer.close()
+
+    async def query(self, hostname: str, qtype: int = QTYPE_A) -> LookupResult:
+        """
+        Запрашивает записи указанного типа
+        Args:
+            hostname (str): Название хоста
+            qtype (int): Тип записи, QTYPE_A или QTYPE_AAAA
+
+        Returns:
+            LookupResult: Список адресов и минимальный TTL ответа. Для несуществующего хоста - пустой список
+                          и TTL отрицательного ответа из SOA, None - если SOA в ответе нет
+
+        Raises:
+            DnsServerError: Если сервер вернул ошибку
+        """
+        qid = random.getrandbits(16)
+        query = build_query(qid=qid, hostname=hostname, qtype=qtype)
+
+        response = parse_response(await self._query_udp(query=query, qid=qid))
+        if response.truncated:
+            # Ответ не поместился в UDP пакет - повторяем запрос по TCP
+            response = parse_response(await self._query_tcp(query=query))
+
+        if response.rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+            raise DnsServerError(rcode=response.rcode)
+
+        ip_list = list(dict.fromkeys(record.value for record in response.answers if record.rtype == qtype))
+        if response.rcode == RCODE_NXDOMAIN or not ip_list:
+            # Отрицательный ответ кэшируется на TTL, который задает зона в SOA
+            return LookupResult(ip_list=[], ttl=response.negative_ttl)
+
+        return LookupResult(ip_list=ip_list, ttl=min(record.ttl for record in response.answers))
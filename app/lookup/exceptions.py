@@ -0,0 +1,10 @@
+class DnsError(Exception):
+    """Ошибка разбора ответа DNS сервера"""
+
+
+class DnsServerError(DnsError):
+    """DNS сервер вернул ошибку, после которой имеет смысл повторить запрос (SERVFAIL, REFUSED)"""
+
+    def __init__(self, rcode: int):
+        super().__init__(f"DNS сервер вернул код ошибки {rcode}")
+        self.rcode = rcode
@@ -0,0 +1,129 @@
+import heapq
+from itertools import count
+from time import monotonic
+from typing import Iterable, Optional
+
+
+class TtlScheduler:
+    """Очередь с приоритетом, которая назначает повторную проверку каждого хоста по истечении его TTL"""
+
+    def __init__(self, min_ttl: float, max_ttl: float, default_ttl: Optional[float] = None):
+        """
+        Args:
+            min_ttl (float): Минимальный интервал между проверками хоста в секундах
+            max_ttl (float): Максимальный интервал между проверками хоста в секундах
+            default_ttl (float|None): Интервал для хостов, TTL которых неизвестен, по умолчанию max_ttl
+        """
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.default_ttl = default_ttl if default_ttl is not None else max_ttl
+        self._queue = []
+        self._due = {}
+        self._sequence = count()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, hostname: str) -> bool:
+        return hostname in self._due
+
+    def schedule(self, hostname: str, ttl: Optional[float] = None, now: Optional[float] = None) -> float:
+        """
+        Назначает следующую проверку хоста
+        Args:
+            hostname (str): Название хоста
+            ttl (float|None): TTL записи, None - использовать интервал по умолчанию
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            float: Время следующей проверки по monotonic
+        """
+        now = monotonic() if now is None else now
+        interval = self.default_ttl if ttl is None else min(max(ttl, self.min_ttl), self.max_ttl)
+        return self.schedule_at(hostname, due=now + interval)
+
+    def schedule_at(self, hostname: str, due: float) -> float:
+        """
+        Назначает проверку хоста на заданное время без ограничения интервала, например из сохраненного снимка
+        Args:
+            hostname (str): Название хоста
+            due (float): Время проверки по monotonic
+
+        Returns:
+            float: Время следующей проверки по monotonic
+        """
+        # Старые записи хоста в куче не удаляются, а пропускаются при извлечении
+        self._due[hostname] = due
+        heapq.heappush(self._queue, (due, next(self._sequence), hostname))
+        return due
+
+    def forget(self, hostname: str) -> None:
+        """
+        Убирает хост из расписания
+        Args:
+            hostname (str): Название хоста
+
+        Returns:
+            None:
+        """
+        self._due.pop(hostname, None)
+
+    def sync(self, hostname_list: Iterable[str], now: Optional[float] = None) -> None:
+        """
+        Приводит расписание к актуальному списку хостов: новые хосты проверяются сразу, удаленные забываются
+        Args:
+            hostname_list (Iterable[str]): Актуальный список хостов
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            None:
+        """
+        now = monotonic() if now is None else now
+        hostname_list = set(hostname_list)
+
+        for hostname in set(self._due) - hostname_list:
+            self.forget(hostname)
+
+        for hostname in hostname_list - set(self._due):
+            self._due[hostname] = now
+            heapq.heappush(self._queue, (now, next(self._sequence), hostname))
+
+    def pop_due(self, now: Optional[float] = None, window: float = 1.0) -> list:
+        """
+        Извлекает хосты, время проверки которых наступило
+        Args:
+            now (float|None): Текущее время по monotonic
+            window (float): Хосты, срок которых наступит в пределах этого окна, извлекаются вместе с остальными
+
+        Returns:
+            list: Список хостов для проверки
+        """
+        now = monotonic() if now is None else now
+        due_hosts = []
+
+        while self._queue and self._queue[0][0] <= now + window:
+            due, _, hostname = heapq.heappop(self._queue)
+            if self._due.get(hostname) == due:
+                del self._due[hostname]
+                due_hosts.append(hostname)
+
+        return due_hosts
+
+    def next_delay(self, now: Optional[float] = None) -> float:
+        """
+        Время до ближайшей проверки
+        Args:
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            float: Количество секунд до ближайшей проверки, max_ttl - если расписание пустое
+        """
+        now = monotonic() if now is None else now
+
+        while self._queue and self._due.get(self._queue[0][2]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+
+        if not self._queue:
+            return self.max_ttl
+
+        return max(self._queue[0][0] - now, 0.0)
@@ -0,0 +1,2 @@
+from app.metrics.metrics import DEFAULT_BUCKETS, REGISTRY, Counter, Gauge, Histogram, Registry
+from app.metrics.server import MetricsServer
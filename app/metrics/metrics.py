@@ -0,0 +1,221 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Iterable, Optional
+
+# Границы гистограмм по умолчанию в секундах, от миллисекунды до минуты
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    return f"{{{','.join(pairs)}}}" if pairs else ''
+
+
+class Registry:
+    """Набор метрик, который отдается одним ответом в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric) -> None:
+        """
+        Добавляет метрику в набор
+        Args:
+            metric (Metric): Метрика
+
+        Returns:
+            None:
+
+        Raises:
+            ValueError: Если метрика с таким именем уже есть
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Все метрики в текстовом формате Prometheus 0.0.4
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Метрика с необязательными метками. Значение может задаваться вызовами методов или читаться
+    функцией callback при каждой выдаче, например из уже существующей статистики
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 callback: Optional[Callable[[], object]] = None, registry: Optional[Registry] = REGISTRY):
+        """
+        Args:
+            name (str): Имя метрики
+            documentation (str): Описание метрики
+            labels (Iterable[str]): Имена меток
+            callback (Callable|None): Функция, возвращающая значение или словарь кортеж значений меток - значение
+            registry (Registry|None): Набор, в который добавляется метрика, None - не добавлять
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._values = {}
+        self._lock = Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, переданы {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> list:
+        """
+        Returns:
+            list: Строки значений метрики в текстовом формате Prometheus
+        """
+        if self.callback is not None:
+            values = self.callback()
+            values = values if isinstance(values, dict) else {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+            if not values and not self.labels:
+                values = {(): 0}
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Counter(Metric):
+    """Счетчик, который только увеличивается"""
+
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Увеличивает счетчик
+        Args:
+            amount (float): Величина увеличения, не меньше 0
+            **labels: Значения меток
+
+        Returns:
+            None:
+
+        Raises:
+            ValueError: Если amount отрицательный
+        """
+        if amount < 0:
+            raise ValueError(f"Счетчик {self.name} не может уменьшаться")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Значение, которое может как расти, так и уменьшаться"""
+
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам с суммой и количеством наблюдений"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        """
+        Args:
+            name (str): Имя метрики
+            documentation (str): Описание метрики
+            labels (Iterable[str]): Имена меток
+            buckets (Iterable[float]): Верхние границы корзин по возрастанию, корзина +Inf добавляется сама
+            registry (Registry|None): Набор, в который добавляется метрика, None - не добавлять
+        """
+        super().__init__(name=name, documentation=documentation, labels=labels, registry=registry)
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets if bucket != float('inf')))
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Учитывает наблюдение
+        Args:
+            value (float): Наблюдаемое значение
+            **labels: Значения меток
+
+        Returns:
+            None:
+        """
+        key = self._key(labels)
+        with self._lock:
+            # Корзины хранятся без накопления, накопленные значения считаются при выдаче
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока в секундах"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def value(self, **labels) -> tuple:
+        """
+        Returns:
+            tuple: Количество наблюдений и их сумма
+        """
+        counts, total = self._values.get(self._key(labels), ([0], 0.0))
+        return sum(counts), total
+
+    def collect(self) -> list:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labels + ('le',), key + (_format_value(bucket),))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
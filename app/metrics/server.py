@@ -0,0 +1,80 @@
+import asyncio
+from typing import Optional
+from app.metrics.metrics import REGISTRY, Registry
+from app.logger import get_logger
+
+
+log = get_logger(__name__)
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsServer:
+    """HTTP сервер в event loop сервиса, отдающий метрики по GET /metrics"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9108, registry: Registry = REGISTRY,
+                 timeout: float = 5.0):
+        """
+        Args:
+            host (str): Адрес, на котором принимаются подключения
+            port (int): Порт, 0 - любой свободный
+            registry (Registry): Набор выдаваемых метрик
+            timeout (float): Время ожидания запроса от клиента в секундах
+        """
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.timeout = timeout
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """
+        Начинает принимать подключения, после запуска port содержит фактический порт
+
+        Returns:
+            None:
+        """
+        self._server = await asyncio.start_server(self._handle, host=self.host, port=self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        log.info("Метрики доступны по адресу http://%s:%d/metrics", self.host, self.port)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Отвечает на один запрос и закрывает соединение"""
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=self.timeout)
+            method, path, *_ = request.split(b'\r\n', 1)[0].decode('latin-1').split(' ') + ['', '']
+            if method != 'GET':
+                status, body = '405 Method Not Allowed', b''
+            elif path.split('?', 1)[0] != '/metrics':
+                status, body = '404 Not Found', b''
+            else:
+                status, body = '200 OK', self.registry.render().encode()
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {_CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        """
+        Запускает сервер и обслуживает подключения до отмены задачи
+
+        Returns:
+            None:
+        """
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
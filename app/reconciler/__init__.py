@@ -0,0 +1,3 @@
+from app.reconciler.aggregation import CidrAggregator
+from app.reconciler.damping import FlapDamper
+from app.reconciler.reconciler import DEFAULT_ROUTER, DesiredState, Reconciler, RouterView
@@ -0,0 +1,119 @@
+from bisect import bisect_left
+from typing import Optional, Sequence
+from app.ipset import ip_to_int, int_to_ip
+
+
+class CidrAggregator:
+    """
+    Сворачивает IP адреса в сети CIDR, которые принимает address-group EdgeOS.
+    Адреса делятся на блоки длины block_prefix, и каждый блок сворачивается независимо,
+    поэтому изменение одного IP требует пересчета только его блока
+    """
+
+    def __init__(self, coverage: Optional[float] = 1.0, block_prefix: int = 24):
+        """
+        Args:
+            coverage (float|None): Минимальная доля адресов сети, при которой адреса сворачиваются в сеть.
+                                   1.0 - только точное объединение, меньше - в группу попадают и соседние адреса,
+                                   которые хосты не возвращали. None - не сворачивать
+            block_prefix (int): Длина префикса самой большой сети, в которую могут свернуться адреса
+
+        Raises:
+            ValueError: Если coverage или block_prefix вне допустимых значений
+        """
+        if coverage is not None and not 0 < coverage <= 1:
+            raise ValueError(f"Доля покрытия {coverage} должна быть в пределах (0, 1]")
+        if not 0 < block_prefix <= 32:
+            raise ValueError(f"Длина префикса {block_prefix} должна быть в пределах (0, 32]")
+
+        self.coverage = coverage
+        self.block_prefix = block_prefix
+        self._shift = 32 - block_prefix
+
+    @property
+    def enabled(self) -> bool:
+        return self.coverage is not None
+
+    def block(self, value: int) -> int:
+        """
+        Args:
+            value (int): IP адрес в виде числа
+
+        Returns:
+            int: Номер блока адреса
+        """
+        return value >> self._shift
+
+    def block_range(self, block: int) -> tuple:
+        """
+        Args:
+            block (int): Номер блока
+
+        Returns:
+            tuple: Первый и последний адрес блока в виде чисел
+        """
+        first = block << self._shift
+        return first, first + (1 << self._shift) - 1
+
+    def entry_block(self, entry: str) -> Optional[int]:
+        """
+        Определяет блок сети или диапазона из группы на роутере
+        Args:
+            entry (str): Сеть вида 10.0.0.0/24 или диапазон вида 10.0.0.1-10.0.0.9
+
+        Returns:
+            int|None: Номер блока, None - если запись не разбирается или больше блока.
+                      Такие записи добавлены не сервисом, и он их не трогает
+        """
+        try:
+            if '/' in entry:
+                network, prefix = entry.split('/', 1)
+                prefix = int(prefix)
+                if not 0 <= prefix <= 32:
+                    return None
+                first = ip_to_int(network)
+                last = first | ((1 << (32 - prefix)) - 1)
+            elif '-' in entry:
+                first, last = map(ip_to_int, entry.split('-', 1))
+            else:
+                return None
+        except ValueError:
+            return None
+
+        return self.block(first) if self.block(first) == self.block(last) else None
+
+    def aggregate(self, block: int, values: Sequence[int]) -> list:
+        """
+        Сворачивает адреса блока в минимальный набор записей с учетом доли покрытия
+        Args:
+            block (int): Номер блока
+            values (Sequence[int]): Отсортированные адреса блока в виде чисел
+
+        Returns:
+            list: Записи группы - адреса и сети CIDR
+        """
+        if not self.enabled:
+            return [int_to_ip(value) for value in values]
+
+        entries = []
+        self._cover(block << self._shift, self.block_prefix, values, 0, len(values), entries)
+        return entries
+
+    def _cover(self, network: int, prefix: int, values: Sequence[int], low: int, high: int, entries: list) -> None:
+        count = high - low
+        if count == 0:
+            return
+        if count == 1:
+            entries.append(int_to_ip(values[low]))
+            return
+
+        # Сверху вниз: берется самая большая сеть, покрытая не меньше чем на coverage
+        size = 1 << (32 - prefix)
+        if count >= self.coverage * size:
+            entries.append(f"{int_to_ip(network)}/{prefix}")
+            return
+
+        half = network + size // 2
+        middle = bisect_left(values, half, low, high)
+        self._cover(network, prefix + 1, values, low, middle, entries)
+        self._cover(half, prefix + 1, values, middle, high, entries)
@@ -0,0 +1,107 @@
+from time import monotonic
+from typing import Iterable, Optional
+
+
+class DampingStats:
+    """Статистика подавления удалений IP"""
+
+    def __init__(self):
+        self.suppressed = 0
+        self.removed = 0
+        self.recovered = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'suppressed': self.suppressed,
+            'removed': self.removed,
+            'recovered': self.recovered,
+        }
+
+
+class FlapDamper:
+    """
+    Подавление удалений IP, которые пропадают из ответа резолвера на время.
+    Round-robin DNS на каждый запрос отдает разное подмножество адресов, поэтому IP удаляется у хоста, только
+    если его не было в ответе missed_threshold проверок подряд и с первого пропуска прошло не меньше grace_period
+    """
+
+    def __init__(self, missed_threshold: int = 1, grace_period: float = 0):
+        """
+        Args:
+            missed_threshold (int): Количество проверок подряд без IP, после которого IP удаляется, 1 - без подавления
+            grace_period (float): Минимальное время в секундах с первого пропуска IP до его удаления
+
+        Raises:
+            ValueError: Если missed_threshold меньше 1 или grace_period отрицательный
+        """
+        if missed_threshold < 1:
+            raise ValueError(f"Количество пропусков {missed_threshold} должно быть не меньше 1")
+        if grace_period < 0:
+            raise ValueError(f"Время ожидания {grace_period} не может быть отрицательным")
+
+        self.missed_threshold = missed_threshold
+        self.grace_period = grace_period
+        self.stats = DampingStats()
+        self._missed = {}  # Хост - словарь IP - (количество пропусков подряд, время первого пропуска)
+
+    def __len__(self) -> int:
+        return sum(map(len, self._missed.values()))
+
+    @property
+    def enabled(self) -> bool:
+        return self.missed_threshold > 1 or self.grace_period > 0
+
+    def observe(self, hostname: str, current_ip: Iterable[str], ip_list: Iterable[str],
+                now: Optional[float] = None) -> list:
+        """
+        Учитывает ответ резолвера для хоста
+        Args:
+            hostname (str): Название хоста
+            current_ip (Iterable[str]): IP хоста в желаемом состоянии
+            ip_list (Iterable[str]): IP из ответа резолвера
+            now (float|None): Текущее время по monotonic
+
+        Returns:
+            list: IP, которые должны остаться у хоста: ответ резолвера и пропавшие IP, удаление которых подавлено
+        """
+        now = monotonic() if now is None else now
+        ip_list = list(dict.fromkeys(ip_list))
+        answered = set(ip_list)
+        host_missed = self._missed.get(hostname, {})
+
+        recovered = answered & host_missed.keys()
+        self.stats.recovered += len(recovered)
+
+        missed, kept = {}, []
+        for ip_address in current_ip:
+            if ip_address in answered:
+                continue
+
+            count, since = host_missed.get(ip_address, (0, now))
+            count += 1
+            if count >= self.missed_threshold and now - since >= self.grace_period:
+                self.stats.removed += 1
+                continue
+
+            missed[ip_address] = (count, since)
+            kept.append(ip_address)
+
+        self.stats.suppressed += len(kept)
+        if missed:
+            self._missed[hostname] = missed
+        else:
+            self._missed.pop(hostname, None)
+
+        return ip_list + kept
+
+    def sync(self, hostname_list: Iterable[str]) -> None:
+        """
+        Забывает пропуски хостов, которых больше нет в списках
+        Args:
+            hostname_list (Iterable[str]): Актуальный список хостов
+
+        Returns:
+            None:
+        """
+        for hostname in self._missed.keys() - set(hostname_list):
+            del self._missed[hostname]
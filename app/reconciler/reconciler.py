@@ -0,0 +1,484 @@
+from itertools import chain
+from typing import Iterable, Optional
+from app.ipset import IPSet, ip_to_int, int_to_ip, ip6_to_int, int_to_ip6
+from app.reconciler.aggregation import CidrAggregator
+from app.ubnt.changeset import UbntChangeSet
+from app.logger import get_logger
+
+
+log = get_logger(__name__)
+
+
+class DesiredState:
+    """
+    Индекс желаемого состояния группы: IP - множество хостов, которым он принадлежит.
+    IP должен быть в группе роутера, пока у него есть хотя бы один владелец
+    """
+
+    def __init__(self):
+        self._owners = {}  # IP - множество хостов
+        self._host_ip = {}  # Хост - множество IP
+        self.version = 0  # Меняется при добавлении и удалении хостов
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def __contains__(self, ip_address: str) -> bool:
+        return ip_address in self._owners
+
+    def hosts(self):
+        """
+        Returns:
+            Представление названий всех хостов индекса
+        """
+        return self._host_ip.keys()
+
+    def ip_addresses(self):
+        """
+        Returns:
+            Представление всех IP, которые должны быть в группе
+        """
+        return self._owners.keys()
+
+    def host_ip(self, hostname: str) -> set:
+        """
+        Args:
+            hostname (str): Название хоста
+
+        Returns:
+            set: IP хоста, пустое множество - если хост неизвестен
+        """
+        return set(self._host_ip.get(hostname, ()))
+
+    def owners(self, ip_address: str) -> set:
+        """
+        Args:
+            ip_address (str): IP адрес
+
+        Returns:
+            set: Хосты, которым принадлежит IP
+        """
+        return set(self._owners.get(ip_address, ()))
+
+    def add_host_ip(self, hostname: str, ip_list: Iterable[str]) -> tuple:
+        """
+        Добавляет IP хосту
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): IP адреса
+
+        Returns:
+            tuple: IP, которых у хоста еще не было, и IP, у которых появился первый владелец
+        """
+        host_ip = self._host_ip.get(hostname)
+        if host_ip is None:
+            host_ip = self._host_ip[hostname] = set()
+            self.version += 1
+
+        added, appeared = [], []
+        for ip_address in ip_list:
+            if ip_address in host_ip:
+                continue
+            host_ip.add(ip_address)
+            added.append(ip_address)
+
+            owners = self._owners.get(ip_address)
+            if owners is None:
+                owners = self._owners[ip_address] = set()
+                appeared.append(ip_address)
+            owners.add(hostname)
+
+        return added, appeared
+
+    def delete_host_ip(self, hostname: str, ip_list: Iterable[str]) -> tuple:
+        """
+        Убирает IP у хоста
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): IP адреса
+
+        Returns:
+            tuple: IP, которые были у хоста, и IP, у которых не осталось владельцев
+        """
+        host_ip = self._host_ip.get(hostname, set())
+
+        deleted, orphaned = [], []
+        for ip_address in ip_list:
+            if ip_address not in host_ip:
+                continue
+            host_ip.discard(ip_address)
+            deleted.append(ip_address)
+
+            owners = self._owners[ip_address]
+            owners.discard(hostname)
+            if not owners:
+                del self._owners[ip_address]
+                orphaned.append(ip_address)
+
+        return deleted, orphaned
+
+    def set_host_ip(self, hostname: str, ip_list: Iterable[str]) -> tuple:
+        """
+        Заменяет IP хоста результатом lookup
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): Актуальные IP хоста
+
+        Returns:
+            tuple: Добавленные и удаленные у хоста IP, а также IP, у которых появился первый или ушел последний владелец
+        """
+        ip_list = set(ip_list)
+        current_ip = self._host_ip.get(hostname, set())
+        deleted, orphaned = self.delete_host_ip(hostname, current_ip - ip_list)
+        added, appeared = self.add_host_ip(hostname, ip_list - current_ip)
+        return added, deleted, appeared + orphaned
+
+    def remove_host(self, hostname: str) -> tuple:
+        """
+        Удаляет хост со всеми его IP
+        Args:
+            hostname (str): Название хоста
+
+        Returns:
+            tuple: IP хоста и IP, у которых не осталось владельцев
+        """
+        if hostname not in self._host_ip:
+            return [], []
+
+        deleted, orphaned = self.delete_host_ip(hostname, list(self._host_ip[hostname]))
+        del self._host_ip[hostname]
+        self.version += 1
+        return deleted, orphaned
+
+
+DEFAULT_ROUTER = 'default'
+
+
+class RouterView:
+    """Известное состояние группы на одном роутере и блоки, которые нужно с ним сверить"""
+
+    def __init__(self):
+        self.ip = IPSet()  # Отдельные адреса группы на роутере
+        self.networks = {}  # Блок - сети и диапазоны группы на роутере
+        self.dirty = set()  # Блоки, которые нужно сверить
+        self.ip6 = set()  # IPv6 адреса группы на роутере в виде 128-битных чисел
+        self.dirty6 = set()  # IPv6 адреса, которые нужно сверить
+
+
+class Reconciler:
+    """
+    Сверяет желаемое состояние группы с известным состоянием роутеров.
+    Адреса группы делятся на блоки, и для каждого роутера помнятся только блоки, изменившиеся с прошлого применения,
+    поэтому план строится за время, пропорциональное количеству изменений, а не размеру базы данных.
+    Желаемое состояние одно на все роутеры, у каждого роутера свое известное состояние группы.
+    IPv6 адреса хостов сверяются поадресно с отдельной группой ipv6-address-group.
+    Используется из event loop, поэтому блокировок не содержит
+    """
+
+    def __init__(self, group: str, aggregator: Optional[CidrAggregator] = None,
+                 routers: Iterable[str] = (DEFAULT_ROUTER,), group6: Optional[str] = None):
+        """
+        Args:
+            group (str): Группа адресов на роутере
+            aggregator (CidrAggregator|None): Сворачивание адресов в сети, по умолчанию адреса не сворачиваются
+            routers (Iterable[str]): Названия роутеров, на которые применяется группа. Первый роутер - роутер
+                                     по умолчанию для методов, которым роутер не передан
+            group6 (str|None): Группа IPv6 адресов на роутере, None - IPv6 адреса хостов не применяются
+
+        Raises:
+            ValueError: Если не передано ни одного роутера
+        """
+        self.group = group
+        self.group6 = group6
+        self.aggregator = aggregator if aggregator is not None else CidrAggregator(coverage=None)
+        self.desired = DesiredState()
+        # Пока группа не прочитана, считается, что на роутере записано желаемое состояние из базы данных
+        self.routers = {router: RouterView() for router in routers}
+        if not self.routers:
+            raise ValueError("Не передано ни одного роутера")
+        self.default_router = next(iter(self.routers))
+        self._block_ip = {}  # Блок - адреса желаемого состояния в виде чисел
+        self._desired_ip6 = set()  # IPv6 адреса желаемого состояния в виде чисел
+
+    def __len__(self) -> int:
+        return (len(set().union(*(view.dirty for view in self.routers.values())))
+                + len(set().union(*(view.dirty6 for view in self.routers.values()))))
+
+    @property
+    def router_ip(self) -> IPSet:
+        """Отдельные адреса группы на роутере по умолчанию"""
+        return self.routers[self.default_router].ip
+
+    @property
+    def desired_ip(self) -> IPSet:
+        """Отдельные IPv4 адреса желаемого состояния, собранные из блоков без разбора строк"""
+        return IPSet(chain.from_iterable(self._block_ip.values()))
+
+    @property
+    def router_networks(self) -> dict:
+        """Сети и диапазоны группы на роутере по умолчанию по блокам"""
+        return self.routers[self.default_router].networks
+
+    def _view(self, router: Optional[str]) -> RouterView:
+        return self.routers[self.default_router if router is None else router]
+
+    def _update_blocks(self, ip_list: Iterable[str]) -> None:
+        """Переносит изменения желаемого состояния в блоки и отмечает блоки для сверки на всех роутерах"""
+        blocks, addresses6 = set(), set()
+        for ip_address in ip_list:
+            try:
+                value = ip_to_int(ip_address)
+            except ValueError:
+                self._update_ip6(ip_address, addresses6)
+                continue
+            block = self.aggregator.block(value)
+            block_ip = self._block_ip.setdefault(block, set())
+            if ip_address in self.desired:
+                block_ip.add(value)
+            else:
+                block_ip.discard(value)
+                if not block_ip:
+                    del self._block_ip[block]
+            blocks.add(block)
+
+        if blocks or addresses6:
+            for view in self.routers.values():
+                view.dirty.update(blocks)
+                view.dirty6.update(addresses6)
+
+    def _update_ip6(self, ip_address: str, addresses6: set) -> None:
+        """Переносит изменение IPv6 адреса в желаемое состояние, если IPv6 группа задана"""
+        if self.group6 is None:
+            return
+        try:
+            value = ip6_to_int(ip_address)
+        except ValueError:
+            return
+        if ip_address in self.desired:
+            self._desired_ip6.add(value)
+        else:
+            self._desired_ip6.discard(value)
+        addresses6.add(value)
+
+    def _wanted_entries(self, block: int) -> set:
+        return set(self.aggregator.aggregate(block, sorted(self._block_ip.get(block, ()))))
+
+    def _present_entries(self, view: RouterView, block: int) -> set:
+        addresses = view.ip.between(*self.aggregator.block_range(block))
+        return set(map(int_to_ip, addresses)) | view.networks.get(block, set())
+
+    def load(self, host_with_ip: dict) -> None:
+        """
+        Заполняет индекс записями из базы данных при запуске
+        Args:
+            host_with_ip (dict): Словарь название хоста - список IP
+
+        Returns:
+            None:
+        """
+        for hostname, ip_list in host_with_ip.items():
+            self._update_blocks(self.desired.add_host_ip(hostname, ip_list)[1])
+
+        router_entries = [entry for block in self._block_ip for entry in self._wanted_entries(block)]
+        for view in self.routers.values():
+            self._set_router_entries(view, router_entries)
+            view.ip6 = set(self._desired_ip6)
+            view.dirty.clear()
+            view.dirty6.clear()
+        log.info("Загружено состояние группы %s: хостов %d, IP %d, из них IPv6 %d, блоков %d, роутеров %d",
+                 self.group, len(self.desired.hosts()), len(self.desired), len(self._desired_ip6), len(self._block_ip),
+                 len(self.routers))
+
+    def add_host_ip(self, hostname: str, ip_list: Iterable[str]) -> list:
+        """
+        Добавляет IP хосту и отмечает IP, которые нужно добавить в группу
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): IP адреса
+
+        Returns:
+            list: IP, которых у хоста еще не было
+        """
+        added, appeared = self.desired.add_host_ip(hostname, ip_list)
+        self._update_blocks(appeared)
+        return added
+
+    def delete_host_ip(self, hostname: str, ip_list: Iterable[str]) -> list:
+        """
+        Убирает IP у хоста. IP, которые остались нужны другим хостам, из группы не удаляются
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): IP адреса
+
+        Returns:
+            list: IP, которые были у хоста
+        """
+        deleted, orphaned = self.desired.delete_host_ip(hostname, ip_list)
+        self._update_blocks(orphaned)
+        return deleted
+
+    def set_host_ip(self, hostname: str, ip_list: Iterable[str]) -> tuple:
+        """
+        Заменяет IP хоста результатом lookup
+        Args:
+            hostname (str): Название хоста
+            ip_list (Iterable[str]): Актуальные IP хоста
+
+        Returns:
+            tuple: Добавленные и удаленные у хоста IP
+        """
+        added, deleted, changed = self.desired.set_host_ip(hostname, ip_list)
+        self._update_blocks(changed)
+        return added, deleted
+
+    def remove_host(self, hostname: str) -> list:
+        """
+        Удаляет хост со всеми его IP
+        Args:
+            hostname (str): Название хоста
+
+        Returns:
+            list: IP хоста
+        """
+        deleted, orphaned = self.desired.remove_host(hostname)
+        self._update_blocks(orphaned)
+        return deleted
+
+    def _set_router_entries(self, view: RouterView, entries: Iterable[str]) -> None:
+        """Раскладывает записи группы на отдельные адреса и сети по блокам"""
+        entries = list(entries)
+        view.ip = IPSet.from_strings(entries, strict=False)
+        view.networks = {}
+        for entry in entries:
+            block = self.aggregator.entry_block(entry)
+            if block is not None:
+                view.networks.setdefault(block, set()).add(entry)
+
+    def set_router_state(self, entries: Iterable[str], router: Optional[str] = None) -> None:
+        """
+        Запоминает прочитанное содержимое группы на роутере и отмечает все расхождения с желаемым состоянием.
+        Сети и диапазоны больше блока добавлены не сервисом и не учитываются
+        Args:
+            entries (Iterable[str]): Записи группы на роутере - адреса, сети и диапазоны
+            router (str|None): Название роутера, None - роутер по умолчанию
+
+        Returns:
+            None:
+        """
+        view = self._view(router)
+        self._set_router_entries(view, entries)
+        if self.aggregator.enabled:
+            # Свернутые сети надо сравнивать с пересчитанными, поэтому сверяются все блоки
+            view.dirty = set(self._block_ip) | set(view.networks)
+            view.dirty.update(map(self.aggregator.block, view.ip.values()))
+            return
+
+        view.dirty = set(map(self.aggregator.block, view.ip.symmetric_difference(self.desired_ip).values()))
+        view.dirty.update(view.networks)
+
+    def set_router_state6(self, entries: Iterable[str], router: Optional[str] = None) -> None:
+        """
+        Запоминает прочитанное содержимое IPv6 группы на роутере и отмечает расхождения с желаемым состоянием.
+        Сети добавлены не сервисом и не учитываются
+        Args:
+            entries (Iterable[str]): Записи IPv6 группы на роутере
+            router (str|None): Название роутера, None - роутер по умолчанию
+
+        Returns:
+            None:
+        """
+        view = self._view(router)
+        view.ip6 = set()
+        for entry in entries:
+            try:
+                view.ip6.add(ip6_to_int(entry))
+            except ValueError:
+                continue
+        view.dirty6 = view.ip6 ^ self._desired_ip6
+
+    def plan(self, router: Optional[str] = None) -> UbntChangeSet:
+        """
+        Строит минимальный набор изменений группы по блокам, изменившимся с прошлого применения на роутере.
+        Удаления идут первыми, чтобы сеть не пересекалась с адресами, которые она заменяет
+        Args:
+            router (str|None): Название роутера, None - роутер по умолчанию
+
+        Returns:
+            UbntChangeSet: Набор изменений
+        """
+        view = self._view(router)
+        added, deleted = [], []
+        for block in view.dirty:
+            wanted, present = self._wanted_entries(block), self._present_entries(view, block)
+            added.extend(wanted - present)
+            deleted.extend(present - wanted)
+
+        added6 = sorted(value for value in view.dirty6 if value in self._desired_ip6 and value not in view.ip6)
+        deleted6 = sorted(value for value in view.dirty6 if value not in self._desired_ip6 and value in view.ip6)
+
+        change_set = UbntChangeSet()
+        change_set.delete(address_list=sorted(deleted), group=self.group)
+        if self.group6 is not None:
+            change_set.delete(address_list=map(int_to_ip6, deleted6), group=self.group6)
+        change_set.add(address_list=sorted(added), group=self.group)
+        if self.group6 is not None:
+            change_set.add(address_list=map(int_to_ip6, added6), group=self.group6)
+        return change_set
+
+    def acknowledge(self, entries: Iterable, router: Optional[str] = None) -> None:
+        """
+        Отмечает изменения, примененные на роутере. Непримененные изменения остаются в плане роутера
+        до следующей попытки
+        Args:
+            entries (Iterable): Примененные ChangeEntry
+            router (str|None): Название роутера, None - роутер по умолчанию
+
+        Returns:
+            None:
+        """
+        view = self._view(router)
+        blocks = set()
+        for entry in entries:
+            if self.group6 is not None and entry.group == self.group6:
+                self._acknowledge_ip6(view, entry)
+                continue
+            if entry.group != self.group:
+                continue
+
+            block = self.aggregator.entry_block(entry.address)
+            if block is not None:
+                networks = view.networks.setdefault(block, set())
+                if entry.action == 'set':
+                    networks.add(entry.address)
+                else:
+                    networks.discard(entry.address)
+                    if not networks:
+                        del view.networks[block]
+            else:
+                try:
+                    block = self.aggregator.block(ip_to_int(entry.address))
+                except ValueError:
+                    continue
+                if entry.action == 'set':
+                    view.ip.add(entry.address)
+                else:
+                    view.ip.discard(entry.address)
+            blocks.add(block)
+
+        # Желаемое состояние могло снова измениться, пока изменения применялись
+        for block in blocks:
+            if self._wanted_entries(block) == self._present_entries(view, block):
+                view.dirty.discard(block)
+
+    def _acknowledge_ip6(self, view: RouterView, entry) -> None:
+        """Отмечает примененное изменение IPv6 группы"""
+        try:
+            value = ip6_to_int(entry.address)
+        except ValueError:
+            return
+        if entry.action == 'set':
+            view.ip6.add(value)
+        else:
+            view.ip6.discard(value)
+        if (value in self._desired_ip6) == (value in view.ip6):
+            view.dirty6.discard(value)
@@ -1,15 +1,80 @@
 from os import environ
 from app.database import Database
-from app.ubnt import UbntService
+from app.ubnt import RouterFleet, ScriptDriver, UbntService, parse_router_list
+from app.lookup import AsyncLookup, DnsCache, DnsResolver
+from app.reconciler import CidrAggregator, FlapDamper, Reconciler
+from app.metrics import MetricsServer
 
 
-DATABASE = Database(database=environ.get("SQLITE_PATH"))
+DATABASE = Database(
+    database=environ.get("SQLITE_PATH"),
+    max_connections=int(environ.get("SQLITE_MAX_CONNECTIONS", "8")),
+    stale_timeout=int(environ.get("SQLITE_STALE_TIMEOUT", "3600")),
+    pool_timeout=float(environ.get("SQLITE_POOL_TIMEOUT", "30"))
+)
 DATABASE.init()
-UBNT = UbntService(
-    host=environ.get("UBNT_HOST"),
-    login=environ.get("UBNT_USER"),
-    password=environ.get("UBNT_PASSWORD"),
-    port=int(environ.get("UBNT_PORT")),
-    key=environ.get("UBNT_PRIVATE_KEY"),
-    firewall_group=environ.get("UBNT_FIREWALL_GROUP")
+ROUTERS = RouterFleet(
+    services=[UbntService(
+        host=host,
+        login=environ.get("UBNT_USER"),
+        password=environ.get("UBNT_PASSWORD"),
+        port=port,
+        key=environ.get("UBNT_PRIVATE_KEY"),
+        firewall_group=environ.get("UBNT_FIREWALL_GROUP"),
+        pipeline_size=int(environ.get("UBNT_PIPELINE_SIZE", "100")),
+        keepalive=int(environ.get("UBNT_KEEPALIVE", "60")),
+        idle_timeout=float(environ.get("UBNT_IDLE_TIMEOUT", "600")),
+        backoff_base=float(environ.get("UBNT_BACKOFF_BASE", "1")),
+        backoff_max=float(environ.get("UBNT_BACKOFF_MAX", "300")),
+        driver=ScriptDriver() if environ.get("UBNT_DRIVER", "cli") == "script" else None
+    ) for host, port in parse_router_list(environ.get("UBNT_HOST"), default_port=int(environ.get("UBNT_PORT")))],
+    workers=int(environ.get("UBNT_WORKERS", "4"))
+)
+HOST_LISTS, GROUPS_V6 = {}, {}
+for _item in filter(None, (item.strip() for item in environ.get("HOSTS_LISTS", "").split(','))):
+    # группа[/группа IPv6]=файл
+    _groups, _, _path = _item.partition('=')
+    _group, _, _group6 = (part.strip() for part in _groups.partition('/'))
+    HOST_LISTS[_group] = _path.strip()
+    if _group6:
+        GROUPS_V6[_group] = _group6
+if not HOST_LISTS:
+    HOST_LISTS[environ.get("UBNT_FIREWALL_GROUP")] = environ.get("HOSTS_FILE_PATH")
+    if environ.get("UBNT_FIREWALL_GROUP_V6"):
+        GROUPS_V6[environ.get("UBNT_FIREWALL_GROUP")] = environ.get("UBNT_FIREWALL_GROUP_V6")
+DNS_CACHE = DnsCache(
+    max_size=int(environ.get("LOOKUP_CACHE_SIZE", "10000")),
+    default_ttl=float(environ.get("LOOKUP_MIN_TTL", "30")),
+    negative_ttl=float(environ.get("LOOKUP_NEGATIVE_TTL", "30")),
+    failure_ttl=float(environ.get("LOOKUP_FAILURE_TTL", "5"))
+)
+LOOKUP = AsyncLookup(
+    concurrency=int(environ.get("LOOKUP_CONCURRENCY", "64")),
+    timeout=float(environ.get("LOOKUP_TIMEOUT", "5")),
+    retries=int(environ.get("LOOKUP_RETRIES", "2")),
+    resolver=DnsResolver(
+        nameserver=environ.get("LOOKUP_NAMESERVER", "127.0.0.1"),
+        port=int(environ.get("LOOKUP_NAMESERVER_PORT", "53"))
+    ) if environ.get("LOOKUP_BACKEND", "system") == "dns" else None,
+    ipv6=bool(GROUPS_V6),
+    cache=DNS_CACHE,
+    samples=int(environ.get("LOOKUP_SAMPLES", "1"))
+)
+DAMPER = FlapDamper(
+    missed_threshold=int(environ.get("LOOKUP_FLAP_MISSES", "1")),
+    grace_period=float(environ.get("LOOKUP_FLAP_GRACE", "0"))
+)
+AGGREGATOR = CidrAggregator(
+    coverage=float(environ.get("UBNT_AGGREGATE_COVERAGE")) if environ.get("UBNT_AGGREGATE_COVERAGE") else None,
+    block_prefix=int(environ.get("UBNT_AGGREGATE_PREFIX", "24"))
 )
+RECONCILERS = {group: Reconciler(group=group, aggregator=AGGREGATOR, routers=ROUTERS, group6=GROUPS_V6.get(group))
+               for group in HOST_LISTS}
+DATABASE.adopt_hosts(group=next(iter(HOST_LISTS)))
+_group_host_with_ip = DATABASE.get_all_group_host_with_ip()
+for _group, _reconciler in RECONCILERS.items():
+    _reconciler.load(_group_host_with_ip.get(_group, {}))
+METRICS = MetricsServer(
+    host=environ.get("METRICS_HOST", "127.0.0.1"),
+    port=int(environ.get("METRICS_PORT"))
+) if environ.get("METRICS_PORT") else None
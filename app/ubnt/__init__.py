@@ -1 +1,5 @@
 from app.ubnt.ubnt import *
+from app.ubnt.changeset import *
+from app.ubnt.driver import *
+from app.ubnt.parser import *
+from app.ubnt.fleet import *
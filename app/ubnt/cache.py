@@ -0,0 +1,131 @@
+import threading
+from typing import Iterable, Optional
+
+
+class CacheStats:
+    """Статистика кэша состояния групп"""
+
+    def __init__(self):
+        self.probes = 0
+        self.hits = 0
+        self.dumps = 0
+        self.local_updates = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'probes': self.probes,
+            'hits': self.hits,
+            'dumps': self.dumps,
+            'local_updates': self.local_updates,
+        }
+
+
+class RouterStateCache:
+    """
+    Кэш записей групп адресов роутера с отпечатком конфигурации группы.
+    Пока отпечаток на роутере совпадает с сохраненным, записи группы берутся из кэша без полного вывода группы
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+        self._groups = {}  # Группа - (отпечаток, множество записей)
+        self._lock = threading.Lock()
+
+    def __contains__(self, group: str) -> bool:
+        return group in self._groups
+
+    def fingerprint(self, group: str) -> Optional[str]:
+        """
+        Args:
+            group (str): Название группы
+
+        Returns:
+            str|None: Сохраненный отпечаток группы, None - если группы нет в кэше
+        """
+        cached = self._groups.get(group)
+        return cached[0] if cached is not None else None
+
+    def entries(self, group: str) -> Optional[list]:
+        """
+        Args:
+            group (str): Название группы
+
+        Returns:
+            list|None: Отсортированные записи группы, None - если группы нет в кэше
+        """
+        cached = self._groups.get(group)
+        return sorted(cached[1]) if cached is not None else None
+
+    def store(self, group: str, fingerprint: str, entries: Iterable[str]) -> None:
+        """
+        Сохраняет полностью прочитанную группу
+        Args:
+            group (str): Название группы
+            fingerprint (str): Отпечаток конфигурации группы, снятый до чтения
+            entries (Iterable[str]): Записи группы
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            self._groups[group] = (fingerprint, set(entries))
+            self.stats.dumps += 1
+
+    def restore(self, group: str, fingerprint: str, entries: Iterable[str]) -> None:
+        """
+        Загружает группу из сохраненного снимка. Записи используются, только пока отпечаток на роутере
+        совпадает с сохраненным, поэтому устаревший снимок приведет к обычному чтению группы
+        Args:
+            group (str): Название группы
+            fingerprint (str): Отпечаток конфигурации группы из снимка
+            entries (Iterable[str]): Записи группы из снимка
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            self._groups[group] = (fingerprint, set(entries))
+
+    def apply(self, entries: Iterable, fingerprints: dict) -> None:
+        """
+        Переносит в кэш собственные изменения после успешного commit, чтобы не читать группу заново
+        Args:
+            entries (Iterable): Примененные ChangeEntry
+            fingerprints (dict): Группа - отпечаток после commit, None - отпечаток снять не удалось
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            for entry in entries:
+                cached = self._groups.get(entry.group)
+                if cached is None:
+                    continue
+                if entry.action == 'set':
+                    cached[1].add(entry.address)
+                else:
+                    cached[1].discard(entry.address)
+
+            for group, fingerprint in fingerprints.items():
+                if group not in self._groups:
+                    continue
+                if fingerprint is None:
+                    del self._groups[group]
+                else:
+                    self._groups[group] = (fingerprint, self._groups[group][1])
+                    self.stats.local_updates += 1
+
+    def invalidate(self, group: str = None) -> None:
+        """
+        Сбрасывает кэш группы, следующее чтение получит группу с роутера целиком
+        Args:
+            group (str|None): Название группы, None - сбросить все группы
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            if group is None:
+                self._groups.clear()
+            else:
+                self._groups.pop(group, None)
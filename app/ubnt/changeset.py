@@ -0,0 +1,124 @@
+from typing import Iterable, NamedTuple
+
+
+ADDRESS_GROUP = 'address-group'
+IPV6_ADDRESS_GROUP = 'ipv6-address-group'
+
+
+def group_type(address: str) -> str:
+    """
+    Тип группы, в которую записывается адрес
+    Args:
+        address (str): Адрес, сеть или диапазон
+
+    Returns:
+        str: ipv6-address-group для IPv6, иначе address-group
+    """
+    return IPV6_ADDRESS_GROUP if ':' in address else ADDRESS_GROUP
+
+
+class ChangeEntry(NamedTuple):
+    """Одно изменение в группе адресов"""
+    action: str  # set - добавить адрес в группу, delete - удалить адрес из группы
+    group: str
+    address: str
+
+    @property
+    def group_type(self) -> str:
+        return group_type(self.address)
+
+    def command(self) -> str:
+        """
+        Команда режима конфигурации для изменения
+
+        Returns:
+            str: Команда для EdgeOS
+        """
+        if self.group_type == IPV6_ADDRESS_GROUP:
+            return f"{self.action} firewall group ipv6-address-group {self.group} ipv6-address {self.address}"
+        return f"{self.action} firewall group address-group {self.group} address {self.address}"
+
+
+class UbntChangeSet:
+    """Набор изменений групп адресов, который применяется за одну сессию конфигурации"""
+
+    possible_actions = ('set', 'delete',)
+
+    def __init__(self):
+        # Ключ - группа и адрес, так что последующее действие над тем же адресом заменяет предыдущее
+        self._entries = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def record(self, action: str, address_list: Iterable[str], group: str) -> None:
+        """
+        Записывает действие над списком адресов
+        Args:
+            action (str): set - добавить адреса в группу, delete - удалить адреса из группы
+            address_list (Iterable[str]): Список адресов
+            group (str): Название группы
+
+        Returns:
+            None:
+
+        Raises:
+            KeyError: Если переданный action не является допустимым
+        """
+        if action not in self.possible_actions:
+            raise KeyError(f"Действие {action} - недопустимо")
+
+        for address in address_list:
+            self._entries[(group, address)] = ChangeEntry(action=action, group=group, address=address)
+
+    def update(self, other: 'UbntChangeSet') -> None:
+        """
+        Переносит изменения другого набора, например плана другой группы адресов
+        Args:
+            other (UbntChangeSet): Набор изменений
+
+        Returns:
+            None:
+        """
+        self._entries.update(other._entries)
+
+    def add(self, address_list: Iterable[str], group: str) -> None:
+        """
+        Записывает добавление адресов в группу
+        Args:
+            address_list (Iterable[str]): Список адресов
+            group (str): Название группы
+
+        Returns:
+            None:
+        """
+        self.record(action='set', address_list=address_list, group=group)
+
+    def delete(self, address_list: Iterable[str], group: str) -> None:
+        """
+        Записывает удаление адресов из группы
+        Args:
+            address_list (Iterable[str]): Список адресов
+            group (str): Название группы
+
+        Returns:
+            None:
+        """
+        self.record(action='delete', address_list=address_list, group=group)
+
+    def entries(self, action: str = None) -> list:
+        """
+        Получить список изменений
+        Args:
+            action (str|None): Вернуть только изменения с указанным действием
+
+        Returns:
+            list: Список ChangeEntry
+        """
+        return [entry for entry in self._entries.values() if action is None or entry.action == action]
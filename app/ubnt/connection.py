@@ -0,0 +1,237 @@
+import threading
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable, Optional, TypeVar
+
+import paramiko
+from Exscript import Account
+from Exscript.protocols import SSH2
+from Exscript.protocols.exception import InvalidCommandException, ProtocolException
+
+from app.ubnt.exceptions import *
+from app.metrics import Counter
+from app.logger import get_logger
+
+log = get_logger(__name__)
+
+T = TypeVar('T')
+
+# Ошибки, после которых соединение считается потерянным
+_CONNECTION_ERRORS = (OSError, EOFError, paramiko.SSHException, ProtocolException)
+
+SSH_ROUND_TRIPS = Counter('ufir_ssh_round_trips_total',
+                          'Обмены с роутером: строки интерактивного shell и exec каналы', labels=('router',))
+
+
+def _count_round_trips(ssh: SSH2, router: str) -> None:
+    """
+    Учитывает каждую строку shell и каждый exec канал соединения в SSH_ROUND_TRIPS,
+    так обмены считаются одинаково для всех драйверов и чтения групп
+    Args:
+        ssh (SSH2): Подключенный объект SSH2
+        router (str): Название роутера для метки
+
+    Returns:
+        None:
+    """
+    def counted(method: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            SSH_ROUND_TRIPS.inc(router=router)
+            return method(*args, **kwargs)
+        return wrapper
+
+    ssh.execute = counted(ssh.execute)
+    if getattr(ssh, 'client', None) is not None:
+        ssh.client.open_session = counted(ssh.client.open_session)
+
+
+class ConnectionStats:
+    """Статистика подключений к роутеру"""
+
+    def __init__(self):
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.last_connect_latency = 0.0
+        self.total_connect_latency = 0.0
+
+    @property
+    def average_connect_latency(self) -> float:
+        return self.total_connect_latency / self.connects if self.connects else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'failures': self.failures,
+            'last_connect_latency': self.last_connect_latency,
+            'average_connect_latency': self.average_connect_latency,
+        }
+
+
+class SshConnectionManager:
+    """
+    Держит постоянное SSH соединение с роутером и выдает его по одному пользователю за раз.
+    Конфигурация EdgeOS - общее состояние сессии, поэтому соединение одно, а доступ к нему сериализован
+    """
+
+    def __init__(self, host: str, port: int, account: Account, keepalive: int = 60, idle_timeout: float = 600,
+                 backoff_base: float = 1, backoff_max: float = 300, timeout: int = 30,
+                 ssh_factory: Callable[..., SSH2] = SSH2):
+        """
+        Args:
+            host (str): Хост для подключения к роутеру
+            port (int): Порт для подключения к роутеру
+            account (Account): Учетная запись для входа
+            keepalive (int): Интервал keep-alive пакетов в секундах
+            idle_timeout (float): Соединение, которое простаивало дольше, открывается заново
+            backoff_base (float): Задержка перед повторным подключением после первой неудачи в секундах
+            backoff_max (float): Максимальная задержка перед повторным подключением в секундах
+            timeout (int): Время ожидания подключения и ответа на команду в секундах
+            ssh_factory (Callable): Фабрика объектов SSH2
+        """
+        self.host = host
+        self.port = port
+        self.account = account
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.ssh_factory = ssh_factory
+        self.stats = ConnectionStats()
+
+        self._ssh: Optional[SSH2] = None
+        self._lock = threading.RLock()
+        self._last_used = 0.0
+        self._failures_in_row = 0
+        self._retry_at = 0.0
+
+    def is_connected(self) -> bool:
+        """
+        Проверяет, что транспорт SSH соединения жив
+
+        Returns:
+            bool: True - соединение установлено
+        """
+        client = getattr(self._ssh, 'client', None)
+        return client is not None and client.is_active()
+
+    def _connect(self) -> SSH2:
+        """
+        Открывает новое соединение с учетом задержки после неудачных попыток
+
+        Returns:
+            SSH2: Подключенный объект SSH2
+
+        Raises:
+            SSHConnectionError: Если подключиться не удалось или не истекла задержка после прошлой неудачи
+        """
+        now = monotonic()
+        if now < self._retry_at:
+            raise SSHConnectionError(f"Повторное подключение к {self.host}:{self.port} "
+                                     f"возможно через {self._retry_at - now:.1f} с")
+
+        ssh = self.ssh_factory(connect_timeout=self.timeout, timeout=self.timeout)
+        try:
+            ssh.connect(hostname=self.host, port=self.port)
+            ssh.login(self.account)
+            if getattr(ssh, 'client', None) is not None:
+                ssh.client.set_keepalive(self.keepalive)
+            _count_round_trips(ssh, router=f"{self.host}:{self.port}")
+
+        except _CONNECTION_ERRORS as err:
+            self._failures_in_row += 1
+            self.stats.failures += 1
+            delay = min(self.backoff_base * 2 ** (self._failures_in_row - 1), self.backoff_max)
+            self._retry_at = monotonic() + delay
+            log.error("Не удалось подключиться по ssh к %s:%s, следующая попытка через %.1f с - %s",
+                      self.host, self.port, delay, err)
+            raise SSHConnectionError(err) from err
+
+        latency = monotonic() - now
+        if self.stats.connects:
+            self.stats.reconnects += 1
+        self.stats.connects += 1
+        self.stats.last_connect_latency = latency
+        self.stats.total_connect_latency += latency
+        self._failures_in_row = 0
+        self._retry_at = 0.0
+
+        log.info("Подключенно по ssh к %s@%s:%s за %.2f с", self.account.get_name(), self.host, self.port, latency)
+        return ssh
+
+    def close(self) -> None:
+        """
+        Закрывает текущее соединение
+
+        Returns:
+            None:
+        """
+        with self._lock:
+            if self._ssh is not None:
+                try:
+                    self._ssh.close(force=True)
+                except _CONNECTION_ERRORS + (AttributeError,):
+                    pass
+                self._ssh = None
+
+    @contextmanager
+    def session(self):
+        """
+        Выдает подключенный SSH2 в монопольное пользование, переподключаясь при необходимости.
+        При обрыве соединения внутри блока оно закрывается, а ошибка поднимается как SSHConnectionError
+
+        Yields:
+            SSH2: Подключенный объект SSH2
+
+        Raises:
+            SSHConnectionError: Если соединение недоступно или оборвалось
+        """
+        with self._lock:
+            if self._ssh is not None and monotonic() - self._last_used > self.idle_timeout:
+                log.info("Соединение с %s:%s простаивало дольше %s с", self.host, self.port, self.idle_timeout)
+                self.close()
+
+            if self._ssh is not None and not self.is_connected():
+                log.warning("Соединение с %s:%s потеряно", self.host, self.port)
+                self.close()
+
+            if self._ssh is None:
+                self._ssh = self._connect()
+
+            try:
+                yield self._ssh
+            except InvalidCommandException:
+                raise
+            except _CONNECTION_ERRORS as err:
+                self.close()
+                raise SSHConnectionError(err) from err
+            finally:
+                self._last_used = monotonic()
+
+    def run(self, action: Callable[[SSH2], T]) -> T:
+        """
+        Выполняет действие в сессии. Если переиспользованное соединение оказалось оборванным
+        (роутер перезагрузился, пока соединение простаивало), действие один раз повторяется на новом соединении
+        Args:
+            action (Callable): Функция, принимающая подключенный SSH2
+
+        Returns:
+            Результат action
+
+        Raises:
+            SSHConnectionError: Если соединение недоступно или оборвалось
+        """
+        with self._lock:
+            reused = self._ssh is not None
+            try:
+                with self.session() as ssh:
+                    return action(ssh)
+            except SSHConnectionError as err:
+                if not reused:
+                    raise
+                log.warning("Соединение с %s:%s оборвалось, повторное подключение - %s", self.host, self.port, err)
+
+            with self.session() as ssh:
+                return action(ssh)
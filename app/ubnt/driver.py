@@ -0,0 +1,183 @@
+import re
+
+from Exscript.protocols import SSH2
+from Exscript.protocols.exception import InvalidCommandException, ProtocolException
+
+from app.logger import get_logger
+
+log = get_logger(__name__)
+
+_FAILED_RE = re.compile(r'^__failed__ (\d+)\s*$', re.MULTILINE)
+_COMMIT_FAILED = '__commit_failed__'
+
+
+class RouterDriver:
+    """
+    Способ применения изменений групп на роутере в открытом SSH соединении.
+    Чтение групп и отпечатков выполняется командами op режима и от способа применения не зависит
+    """
+
+    name = None
+
+    def apply(self, ssh: SSH2, entries: list) -> list:
+        """
+        Применяет изменения за одну сессию конфигурации с единственным commit; save
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+            entries (list): Список ChangeEntry
+
+        Returns:
+            list: Список примененных ChangeEntry, пустой - если commit не удался
+        """
+        raise NotImplementedError
+
+
+class CliDriver(RouterDriver):
+    """Команды вводятся в интерактивный shell EdgeOS с ожиданием приглашения после каждой пачки"""
+
+    name = 'cli'
+
+    def __init__(self, pipeline_size: int = 100):
+        """
+        Args:
+            pipeline_size (int): Количество команд, отправляемых на роутер одной строкой
+        """
+        self.pipeline_size = pipeline_size
+
+    @staticmethod
+    def configure_mode(ssh: SSH2) -> None:
+        """
+        Переход в режим конфигурации ubnt
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+
+        Returns:
+            None:
+        """
+        try:
+            ssh.execute("configure")
+        except InvalidCommandException as err:
+            # Если не находит команду configure, то скорее всего подключение уже в режиме configure
+            if 'configure: command not found' in err.args[0]:
+                ssh.execute("discard")
+            else:
+                raise InvalidCommandException(err)
+
+    @staticmethod
+    def drop_connection(ssh: SSH2) -> None:
+        """
+        Закрывает соединение, состояние которого неизвестно. Менеджер соединения увидит закрытый транспорт
+        и откроет новое соединение в следующей сессии
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+
+        Returns:
+            None:
+        """
+        try:
+            ssh.close(force=True)
+        except (OSError, EOFError, ProtocolException, AttributeError):
+            pass
+
+    def apply(self, ssh: SSH2, entries: list) -> list:
+        self.configure_mode(ssh)
+
+        applied = []
+        for start in range(0, len(entries), self.pipeline_size):
+            chunk = entries[start:start + self.pipeline_size]
+            try:
+                # Команды пачки отправляются одной строкой, чтобы не ждать приглашение после каждой
+                ssh.execute("; ".join(entry.command() for entry in chunk))
+                applied.extend(chunk)
+            except InvalidCommandException:
+                # В пачке есть ошибочная команда - повторяем по одной, чтобы узнать, какие применились
+                for entry in chunk:
+                    try:
+                        ssh.execute(entry.command())
+                        applied.append(entry)
+                    except InvalidCommandException as err:
+                        log.debug("Команда %s не применена: %s", entry.command(), err)
+
+        if len(applied) < len(entries):
+            log.warning("Не применено команд: %d из %d", len(entries) - len(applied), len(entries))
+
+        try:
+            ssh.execute("commit; save")
+        except InvalidCommandException as err:
+            log.error("Ошибка commit, изменения отменены: %s", err)
+            try:
+                ssh.execute("discard")
+                ssh.execute("exit")
+            except InvalidCommandException as cleanup_err:
+                # Сессия могла остаться в режиме конфигурации - следующая сессия должна начаться на новом соединении
+                log.error("Не удалось выйти из режима конфигурации после ошибки commit, соединение закрыто: %s",
+                          cleanup_err)
+                self.drop_connection(ssh)
+            return []
+
+        ssh.execute("exit")
+        return applied
+
+
+class ScriptDriver(RouterDriver):
+    """
+    Все изменения отправляются одним скриптом vbash в отдельный exec канал того же SSH соединения.
+    Скрипт выполняется на роутере целиком, без обмена приглашениями на каждую пачку команд и без
+    состояния режима конфигурации в интерактивном shell
+    """
+
+    name = 'script'
+
+    def __init__(self, interpreter: str = '/bin/vbash -s', timeout: float = 300):
+        """
+        Args:
+            interpreter (str): Команда, которая выполняет скрипт из stdin
+            timeout (float): Время ожидания выполнения скрипта в секундах
+        """
+        self.interpreter = interpreter
+        self.timeout = timeout
+
+    @staticmethod
+    def build_script(entries: list) -> str:
+        """
+        Собирает скрипт применения изменений. Номер каждой неудачной команды выводится отдельной строкой,
+        чтобы вернуть список примененных изменений так же, как при вводе команд по одной.
+        Удаление адреса, которого уже нет в группе, считается примененным, как и в CliDriver
+        Args:
+            entries (list): Список ChangeEntry
+
+        Returns:
+            str: Текст скрипта vbash
+        """
+        lines = ["source /opt/vyatta/etc/functions/script-template", "configure"]
+        for index, entry in enumerate(entries):
+            command = entry.command()
+            if entry.action == 'delete':
+                # delete без значения в группе завершается ошибкой "Nothing to delete", поэтому сначала проверка
+                command = f"! cli-shell-api exists {command.split(' ', 1)[1]} || {command}"
+            lines.append(f"{command} || echo __failed__ {index}")
+        lines += [f"commit || {{ echo {_COMMIT_FAILED}; discard; exit 1; }}", "save", "exit", ""]
+        return '\n'.join(lines)
+
+    def apply(self, ssh: SSH2, entries: list) -> list:
+        channel = ssh.client.open_session(timeout=self.timeout)
+        try:
+            channel.settimeout(self.timeout)
+            channel.exec_command(self.interpreter)
+            channel.sendall(self.build_script(entries).encode())
+            channel.shutdown_write()
+            output = channel.makefile('rb').read().decode(errors='replace')
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+
+        if _COMMIT_FAILED in output or status != 0:
+            log.error("Ошибка выполнения скрипта, изменения отменены, код завершения %s: %s", status, output.strip())
+            return []
+
+        failed = {int(index) for index in _FAILED_RE.findall(output)}
+        if failed:
+            log.warning("Не применено команд: %d из %d", len(failed), len(entries))
+        for index in sorted(failed):
+            log.debug("Команда %s не применена", entries[index].command())
+        return [entry for index, entry in enumerate(entries) if index not in failed]
@@ -1,3 +1,7 @@
 from socket import timeout
 
 SSHTimeoutError = timeout
+
+
+class SSHConnectionError(Exception):
+    """Соединение с роутером по SSH недоступно или оборвалось"""
@@ -0,0 +1,184 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Iterable, NamedTuple, Optional, TypeVar
+
+from app.ubnt.changeset import ADDRESS_GROUP
+from app.ubnt.parser import classify
+from app.ubnt.ubnt import UbntService
+from app.logger import get_logger
+
+log = get_logger(__name__)
+
+T = TypeVar('T')
+
+
+def parse_router_list(value: str, default_port: int = 22) -> list:
+    """
+    Разбирает список роутеров из настройки вида "192.168.1.1, 192.168.2.1:2222"
+    Args:
+        value (str): Адреса роутеров через запятую, порт указывается через двоеточие
+        default_port (int): Порт для адресов без явного порта
+
+    Returns:
+        list: Список пар хост - порт без повторов
+    """
+    routers = []
+    for address in filter(None, (part.strip() for part in value.split(','))):
+        host, _, port = address.partition(':')
+        routers.append((host, int(port) if port else default_port))
+
+    return list(dict.fromkeys(routers))
+
+
+class RouterReport(NamedTuple):
+    """Результат применения изменений на одном роутере"""
+    router: str
+    planned: int
+    applied: int
+    elapsed: float
+    failures: int  # Количество неудачных применений подряд, 0 - последнее применение прошло полностью
+
+    @property
+    def ok(self) -> bool:
+        return self.applied == self.planned
+
+
+class RouterFleet:
+    """
+    Несколько роутеров с одной и той же группой адресов.
+    Действия выполняются на всех роутерах параллельно пулом потоков ограниченного размера.
+    У каждого роутера свое соединение с задержкой повторного подключения и свой кэш состояния групп,
+    поэтому недоступный роутер не задерживает остальные
+    """
+
+    def __init__(self, services: Iterable[UbntService], workers: int = 4):
+        """
+        Args:
+            services (Iterable[UbntService]): Сервисы роутеров, названия роутеров должны быть уникальны
+            workers (int): Максимальное количество роутеров, с которыми идет работа одновременно
+
+        Raises:
+            ValueError: Если не передано ни одного роутера или названия роутеров повторяются
+        """
+        services = list(services)
+        self.services = {service.name: service for service in services}
+        if not self.services or len(self.services) != len(services):
+            raise ValueError("Список роутеров пуст или содержит повторы")
+
+        self.workers = workers
+        self.failures = dict.fromkeys(self.services, 0)
+        self.reports = {}  # Роутер - последний RouterReport
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(self.services))),
+                                            thread_name_prefix='router')
+
+    def __len__(self) -> int:
+        return len(self.services)
+
+    def __iter__(self):
+        return iter(self.services)
+
+    async def _map_async(self, action: Callable[[UbntService], T], routers: Optional[Iterable[str]] = None) -> dict:
+        """
+        Выполняет действие на роутерах параллельно в пуле потоков, не блокируя event loop.
+        Даже для одного роутера действие уходит в пул, так как SSH сессия блокирующая
+        Args:
+            action (Callable): Функция, принимающая UbntService
+            routers (Iterable[str]|None): Названия роутеров, None - все роутеры
+
+        Returns:
+            dict: Словарь роутер - результат action
+        """
+        routers = list(self.services if routers is None else routers)
+        futures = [asyncio.wrap_future(self._executor.submit(action, self.services[router])) for router in routers]
+        return dict(zip(routers, await asyncio.gather(*futures)))
+
+    @staticmethod
+    def _apply_action(change_sets: dict) -> Callable[[UbntService], tuple]:
+        """Действие применения набора изменений роутера с замером времени"""
+        def apply(service: UbntService) -> tuple:
+            start = monotonic()
+            return service.apply_changes(change_sets[service.name]), monotonic() - start
+        return apply
+
+    async def apply_changes_async(self, change_sets: dict) -> dict:
+        """
+        Применяет на каждом роутере его набор изменений, каждый за одну сессию конфигурации.
+        Event loop на время SSH сессий не блокируется
+        Args:
+            change_sets (dict): Словарь роутер - UbntChangeSet
+
+        Returns:
+            dict: Словарь роутер - список примененных ChangeEntry
+        """
+        results = await self._map_async(self._apply_action(change_sets),
+                                        [router for router, change_set in change_sets.items() if change_set])
+        return self._report(change_sets, results)
+
+    def _report(self, change_sets: dict, results: dict) -> dict:
+        """
+        Учитывает результаты применения изменений в отчетах роутеров
+        Args:
+            change_sets (dict): Словарь роутер - UbntChangeSet
+            results (dict): Словарь роутер - (список примененных ChangeEntry, время применения)
+
+        Returns:
+            dict: Словарь роутер - список примененных ChangeEntry
+        """
+        applied_changes = {}
+        for router, (applied, elapsed) in results.items():
+            planned = sum(classify(entry.address) is not None for entry in change_sets[router])
+            self.failures[router] = 0 if len(applied) == planned else self.failures[router] + 1
+            report = self.reports[router] = RouterReport(router=router, planned=planned, applied=len(applied),
+                                                         elapsed=elapsed, failures=self.failures[router])
+            applied_changes[router] = applied
+
+            if report.ok:
+                log.info("Роутер %s: применено изменений %d за %.2f с", router, report.applied, report.elapsed)
+            else:
+                # Непримененные изменения остаются в плане роутера и повторяются на следующем проходе
+                log.warning("Роутер %s: применено изменений %d из %d, неудачных применений подряд: %d",
+                            router, report.applied, report.planned, report.failures)
+
+        return applied_changes
+
+    async def group_changed_async(self, group_name: str, group_type: str = ADDRESS_GROUP) -> dict:
+        """
+        Проверяет отпечаток группы на всех роутерах, не блокируя event loop
+        Args:
+            group_name (str): Название группы
+            group_type (str): address-group или ipv6-address-group
+
+        Returns:
+            dict: Словарь роутер - результат UbntService.group_changed
+        """
+        return await self._map_async(lambda service: service.group_changed(group_name=group_name,
+                                                                           group_type=group_type))
+
+    async def get_group_ip_list_async(self, group_name: str, routers: Optional[Iterable[str]] = None,
+                                      use_cache: bool = True, group_type: str = ADDRESS_GROUP) -> dict:
+        """
+        Читает записи группы на роутерах, не блокируя event loop: IPv4 для address-group,
+        IPv6 для ipv6-address-group
+        Args:
+            group_name (str): Название группы
+            routers (Iterable[str]|None): Названия роутеров, None - все роутеры
+            use_cache (bool): False - прочитать группу с роутера, даже если отпечаток не изменился
+            group_type (str): address-group или ipv6-address-group
+
+        Returns:
+            dict: Словарь роутер - список записей, None - если не удалось подключиться к роутеру
+        """
+        return await self._map_async(lambda service: service.get_group_ip_list(
+            group_name=group_name, use_cache=use_cache, group_type=group_type), routers)
+
+    def close(self) -> None:
+        """
+        Закрывает соединения со всеми роутерами и пул потоков
+
+        Returns:
+            None:
+        """
+        for service in self.services.values():
+            service.connection.close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,111 @@
+import re
+import socket
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+_OCTET = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_IPV4 = rf'{_OCTET}(?:\.{_OCTET}){{3}}'
+_PREFIX_V4 = r'(?:3[0-2]|[12]?[0-9])'
+
+# Адрес, сеть или диапазон IPv4 одним проходом: тип определяется по тому, какая группа совпала
+_IPV4_ENTRY_RE = re.compile(rf'{_IPV4}(?:(/{_PREFIX_V4})|(-{_IPV4}))?')
+_IPV6_CANDIDATE_RE = re.compile(r'[0-9A-Fa-f:.]*:[0-9A-Fa-f:.]*(?:/(?:12[0-8]|1[01][0-9]|[1-9]?[0-9]))?')
+
+# Участник группы в выводе show firewall group - строка с отступом из одного значения,
+# заголовки (Name, Type, Members) пишутся без отступа. IPv4 записи разбираются тем же проходом
+_MEMBER_RE = re.compile(rf'^[ \t]+(?:({_IPV4}(?:(/{_PREFIX_V4})|(-{_IPV4}))?)|(\S+))[ \t]*\r?$', re.MULTILINE)
+# Строка show configuration commands с участником группы адресов
+_COMMAND_RE = re.compile(
+    r"^set firewall group (address-group|ipv6-address-group|network-group|ipv6-network-group) "
+    r"'?([^\s']+)'? (address|ipv6-address|network|ipv6-network) '?([^\s']+)'?[ \t\r]*$",
+    re.MULTILINE)
+
+ADDRESS = 'address'
+NETWORK = 'network'
+RANGE = 'range'
+IPV6_ADDRESS = 'ipv6-address'
+IPV6_NETWORK = 'ipv6-network'
+
+IPV4_KINDS = (ADDRESS, NETWORK, RANGE)
+IPV6_KINDS = (IPV6_ADDRESS, IPV6_NETWORK)
+
+
+class GroupEntry(NamedTuple):
+    """Запись группы firewall"""
+    kind: str  # address, network, range, ipv6-address или ipv6-network
+    value: str
+
+
+class ConfiguredEntry(NamedTuple):
+    """Запись группы из show configuration commands"""
+    group_type: str  # address-group, ipv6-address-group, network-group или ipv6-network-group
+    group: str
+    entry: GroupEntry
+
+
+def classify(value: str) -> Optional[GroupEntry]:
+    """
+    Определяет тип записи группы
+    Args:
+        value (str): Адрес, сеть CIDR или диапазон адресов
+
+    Returns:
+        GroupEntry|None: Запись с типом, None - если значение не является адресом, сетью или диапазоном
+    """
+    match = _IPV4_ENTRY_RE.fullmatch(value)
+    if match is not None:
+        network, address_range = match.groups()
+        return GroupEntry(NETWORK if network else RANGE if address_range else ADDRESS, value)
+
+    if _IPV6_CANDIDATE_RE.fullmatch(value):
+        address, _, prefix = value.partition('/')
+        try:
+            socket.inet_pton(socket.AF_INET6, address)
+        except OSError:
+            return None
+        return GroupEntry(IPV6_NETWORK if prefix else IPV6_ADDRESS, value)
+
+    return None
+
+
+def _lines(output: Union[str, Iterable[str]]) -> Iterator[str]:
+    if isinstance(output, str):
+        yield output
+    else:
+        yield from output
+
+
+def parse_show_group(output: Union[str, Iterable[str]]) -> Iterator[GroupEntry]:
+    """
+    Разбирает вывод show firewall group по мере поступления
+    Args:
+        output (str|Iterable[str]): Вывод команды целиком или по частям, каждая часть из целых строк
+
+    Yields:
+        GroupEntry: Записи группы в порядке вывода, строки, которые не являются записями, пропускаются
+    """
+    for chunk in _lines(output):
+        for match in _MEMBER_RE.finditer(chunk):
+            address, network, address_range, other = match.groups()
+            if address is not None:
+                yield GroupEntry(NETWORK if network else RANGE if address_range else ADDRESS, address)
+                continue
+
+            entry = classify(other)
+            if entry is not None:
+                yield entry
+
+
+def parse_configuration_commands(output: Union[str, Iterable[str]]) -> Iterator[ConfiguredEntry]:
+    """
+    Разбирает вывод show configuration commands, оставляя только участников групп адресов и сетей
+    Args:
+        output (str|Iterable[str]): Вывод команды целиком или по частям, каждая часть из целых строк
+
+    Yields:
+        ConfiguredEntry: Записи групп в порядке вывода
+    """
+    for chunk in _lines(output):
+        for match in _COMMAND_RE.finditer(chunk):
+            entry = classify(match.group(4))
+            if entry is not None:
+                yield ConfiguredEntry(group_type=match.group(1), group=match.group(2), entry=entry)
@@ -3,17 +3,34 @@ from Exscript.protocols.exception import InvalidCommandException
 from Exscript.key import PrivateKey
 from Exscript import Account
 from pathlib import Path
+from typing import Optional
 import re
 
+from app.ubnt.cache import RouterStateCache
+from app.ubnt.changeset import ADDRESS_GROUP, IPV6_ADDRESS_GROUP, UbntChangeSet
+from app.ubnt.connection import SshConnectionManager
+from app.ubnt.driver import CliDriver, RouterDriver
+from app.ubnt.parser import IPV4_KINDS, IPV6_KINDS, classify, parse_show_group, parse_configuration_commands
 from app.ubnt.exceptions import *
+from app.metrics import Counter, Histogram
 from app.logger import get_logger
 
 log = get_logger(__name__)
 
+_MD5_RE = re.compile(r'\b[0-9a-f]{32}\b')
+
+COMMIT_DURATION = Histogram('ufir_commit_duration_seconds',
+                            'Время применения изменений драйвером роутера вместе с commit; save',
+                            labels=('router', 'driver'))
+CHANGES_APPLIED = Counter('ufir_router_changes_total', 'Изменения групп, отправленные на роутер',
+                          labels=('router', 'result'))
+
 
 class UbntService:
     def __init__(self, host: str, login: str, firewall_group: str, password: str = '', port: int = 22,
-                 key: [str, Path, None] = None):
+                 key: [str, Path, None] = None, pipeline_size: int = 100, keepalive: int = 60,
+                 idle_timeout: float = 600, backoff_base: float = 1, backoff_max: float = 300,
+                 driver: Optional[RouterDriver] = None):
         """
         Args:
             host (str): Хост для подключения к роутеру
@@ -22,130 +39,276 @@ class UbntService:
             port (int): Порт для подключения к роутеру
             key (str|Path|None): Путь до приватного ключа для подключения к роутеру
             firewall_group (str): Название группы ip-адресов для firewall
+            pipeline_size (int): Количество команд, отправляемых на роутер одной строкой
+            keepalive (int): Интервал keep-alive пакетов SSH соединения в секундах
+            idle_timeout (float): Соединение, которое простаивало дольше, открывается заново
+            backoff_base (float): Задержка перед повторным подключением после первой неудачи в секундах
+            backoff_max (float): Максимальная задержка перед повторным подключением в секундах
+            driver (RouterDriver|None): Способ применения изменений, по умолчанию ввод команд в интерактивный shell
         """
         self.host = host
         self.login = login
         self.password = password
         self.port = port
         self.key = PrivateKey().from_file(key) if key is not None else key
-        self.ssh = SSH2()
         self.firewall_group = firewall_group
+        self.pipeline_size = pipeline_size
+        self.connection = SshConnectionManager(
+            host=host, port=port, account=Account(name=login, password=password, key=self.key),
+            keepalive=keepalive, idle_timeout=idle_timeout, backoff_base=backoff_base, backoff_max=backoff_max)
+        self.driver = driver if driver is not None else CliDriver(pipeline_size=pipeline_size)
+        self.cache = RouterStateCache()
 
-    def __ssh_connect(self):
-        """Открыть соединение по SSH"""
-        self.ssh.connect(hostname=self.host, port=self.port)
-        self.ssh.login(Account(name=self.login, password=self.password, key=self.key))
-        log.info(f"Подключенно по ssh к {self.login}@{self.host}:{self.port}")
+    @property
+    def name(self) -> str:
+        """Название роутера для отчетов и журнала"""
+        return f"{self.host}:{self.port}"
 
-    def _configure_mode(self) -> None:
+    def apply_changes(self, change_set: UbntChangeSet) -> list:
         """
-        Переход в режим конфигурации ubnt
+        Применяет набор изменений за одну сессию конфигурации с единственным commit; save
+        Args:
+            change_set (UbntChangeSet): Набор изменений групп адресов
+
         Returns:
-            None:
+            list: Список примененных ChangeEntry, пустой - если применить изменения не удалось
         """
+        entries = [entry for entry in change_set if classify(entry.address) is not None]
+        if not entries:
+            return []
+
         try:
-            self.ssh.execute("configure")
+            return self.connection.run(lambda ssh: self._apply_entries(ssh=ssh, entries=entries))
+
+        except SSHConnectionError as err:
+            log.error("Ошибка SSH: %s", err)
+            return []
+
         except InvalidCommandException as err:
-            # Если не находит команду configure, то скорее всего подключение уже в режиме configure
-            if 'configure: command not found' in err.args[0]:
-                self.ssh.execute("discard")
-            else:
-                raise InvalidCommandException(err)
+            log.error("Роутер %s отклонил команду: %s", self.name, err)
+            return []
 
-    def _ip_group_action(self, ip_address_list: list, group_name: str, action: str):
+    def _apply_entries(self, ssh: SSH2, entries: list) -> list:
+        """
+        Применяет изменения в открытой сессии
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+            entries (list): Список ChangeEntry
+
+        Returns:
+            list: Список примененных ChangeEntry
+        """
+        # Если группу успели изменить не мы, локально обновлять кэш нельзя
+        cached_groups = {entry.group: entry.group_type for entry in entries if entry.group in self.cache}
+        for group, group_type in cached_groups.items():
+            if self._probe(ssh, group, group_type) != self.cache.fingerprint(group):
+                self.cache.invalidate(group)
+
+        with COMMIT_DURATION.time(router=self.name, driver=self.driver.name):
+            applied = self.driver.apply(ssh=ssh, entries=entries)
+        CHANGES_APPLIED.inc(len(applied), router=self.name, result='applied')
+        CHANGES_APPLIED.inc(len(entries) - len(applied), router=self.name, result='rejected')
+
+        if applied:
+            applied_groups = {entry.group: entry.group_type for entry in applied}
+            self.cache.apply(applied, {group: self._probe(ssh, group, group_type)
+                                       for group, group_type in applied_groups.items() if group in self.cache})
+
+        log.info("Применено изменений: %d из %d, добавлено: %d, удалено: %d", len(applied), len(entries),
+                 sum(entry.action == 'set' for entry in applied), sum(entry.action == 'delete' for entry in applied))
+        return applied
+
+    def _ip_group_action(self, ip_address_list: list, group_name: str, action: str) -> list:
         """
             Производит указанное действие в группе IP адресов
             Args:
                 ip_address_list (list): Список ip адресов для firewall
                 group_name (str): Название группы, где необходимо провести действие
                 action(str):
-                            add - Добавить список IP в группу,
+                            set - Добавить список IP в группу,
                             delete - Удалить список IP из группы
             Returns:
-                None:
+                list: Список примененных ChangeEntry
 
             Raises:
                 KeyError: Если переданный action не является допустимым
             """
-        possible_actions = ('set', 'delete',)
-
-        if action not in possible_actions:
-            raise KeyError(f"Действие {action} - недопустимо")
-        try:
-            if not self.ssh.is_app_authorized():
-                self.__ssh_connect()
+        change_set = UbntChangeSet()
+        change_set.record(action=action, address_list=ip_address_list, group=group_name)
 
-            self._configure_mode()
+        return self.apply_changes(change_set)
 
-            for ip in ip_address_list:
-                if re.match((r'(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.' * 4)[:-2], ip) is not None:
-                    self.ssh.execute(f"{action} firewall group address-group {group_name} address {ip}")
-
-            self.ssh.execute("commit; save")
-            self.ssh.execute("exit")
-
-            log.info(f"{'Добавлены' if action == 'set' else 'Удалены'} "
-                     f"IP: {', '.join(ip_address_list)} для группы {group_name}")
-
-        except SSHTimeoutError as err:
-            log.error(f"Ошибка SSH: {err}")
-
-    def add_new_ip(self, ip_address_list: list) -> None:
+    def add_new_ip(self, ip_address_list: list) -> list:
         """
         Добавляет IP адреса в группу для Firewall
         Args:
             ip_address_list (list): Список ip адресов для добавления в firewall
         Returns:
-            None:
+            list: Список примененных ChangeEntry
         """
-        self._ip_group_action(ip_address_list=ip_address_list, group_name=self.firewall_group, action='set')
+        return self._ip_group_action(ip_address_list=ip_address_list, group_name=self.firewall_group, action='set')
 
-    def delete_ip(self, ip_address_list: list) -> None:
+    def delete_ip(self, ip_address_list: list) -> list:
         """
         Удаляет IP адреса из группы для Firewall
         Args:
             ip_address_list (list): Список ip адресов для удаления из firewall
         Returns:
-            None:
+            list: Список примененных ChangeEntry
         """
-        self._ip_group_action(ip_address_list=ip_address_list, group_name=self.firewall_group, action='delete')
+        return self._ip_group_action(ip_address_list=ip_address_list, group_name=self.firewall_group, action='delete')
 
-    def _force_close_configure_mode(self) -> None:
+    @staticmethod
+    def _force_close_configure_mode(ssh: SSH2) -> None:
         """
         Гарантировано выйти из режима конфигурации
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+
         Returns:
             None:
         """
         try:
-            self.ssh.execute("configure")
+            ssh.execute("configure")
         except InvalidCommandException:
             pass
         finally:
-            self.ssh.execute("exit discard")
+            ssh.execute("exit discard")
+
+    def _show_group(self, ssh: SSH2, group_name: str) -> list:
+        """
+        Читает записи группы в открытой сессии
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+            group_name (str): Название группы
+
+        Returns:
+            list: Список GroupEntry
+        """
+        self._force_close_configure_mode(ssh)
+        ssh.response = str()  # Очищаем последний response
+        ssh.execute(f"show firewall group {group_name} | no-more")
+        return list(parse_show_group(ssh.response))
+
+    def get_group_entries(self, group_name: str) -> [list, None]:
+        """
+        Получить записи группы с их типами: адреса, сети, диапазоны и IPv6
+        Args:
+            group_name (str): Название группы
+
+        Returns:
+            list|None: Список GroupEntry, None - если не удалось подключиться к роутеру или он отклонил команду
+        """
+        try:
+            return self.connection.run(lambda ssh: self._show_group(ssh=ssh, group_name=group_name))
+
+        except SSHConnectionError as err:
+            log.error("Ошибка SSH: %s", err)
+
+        except InvalidCommandException as err:
+            log.error("Роутер %s отклонил команду: %s", self.name, err)
+
+    def get_configuration_entries(self) -> [list, None]:
+        """
+        Получить записи всех групп адресов и сетей из show configuration commands за одну команду
+        Returns:
+            list|None: Список ConfiguredEntry, None - если не удалось подключиться к роутеру или он отклонил команду
+        """
+        def show_configuration(ssh: SSH2) -> list:
+            self._force_close_configure_mode(ssh)
+            ssh.response = str()
+            ssh.execute("show configuration commands | no-more")
+            return list(parse_configuration_commands(ssh.response))
+
+        try:
+            return self.connection.run(show_configuration)
+
+        except SSHConnectionError as err:
+            log.error("Ошибка SSH: %s", err)
+
+        except InvalidCommandException as err:
+            log.error("Роутер %s отклонил команду: %s", self.name, err)
+
+    def _probe(self, ssh: SSH2, group_name: str, group_type: str = ADDRESS_GROUP) -> [str, None]:
+        """
+        Снимает отпечаток конфигурации группы: md5 от ее поддерева, без вывода самих записей
+        Args:
+            ssh (SSH2): Подключенный объект SSH2
+            group_name (str): Название группы
+            group_type (str): address-group или ipv6-address-group
+
+        Returns:
+            str|None: Отпечаток группы, None - если роутер не вернул хэш
+        """
+        command = f"cli-shell-api showCfg firewall group {group_type} {group_name} | md5sum"
+        self.cache.stats.probes += 1
+        ssh.response = str()
+        try:
+            ssh.execute(command)
+        except InvalidCommandException:
+            # Соединение осталось в режиме конфигурации, где команды op режима недоступны
+            self._force_close_configure_mode(ssh)
+            ssh.response = str()
+            ssh.execute(command)
 
-    def get_group_ip_list(self, group_name: str) -> list:
+        match = _MD5_RE.search(ssh.response or '')
+        return match.group(0) if match is not None else None
+
+    def group_changed(self, group_name: str, group_type: str = ADDRESS_GROUP) -> [bool, None]:
         """
-        Получить список IP, записанных в группе
+        Проверяет отпечаток группы, не читая ее целиком
+        Args:
+            group_name (str): Название группы
+            group_type (str): address-group или ipv6-address-group
+
+        Returns:
+            bool|None: True - группа изменилась с прошлого чтения или еще не читалась, None - если не удалось
+                       подключиться к роутеру или он отклонил команду
+        """
+        try:
+            fingerprint = self.connection.run(lambda ssh: self._probe(ssh=ssh, group_name=group_name,
+                                                                      group_type=group_type))
+
+        except SSHConnectionError as err:
+            log.error("Ошибка SSH: %s", err)
+            return None
+
+        except InvalidCommandException as err:
+            log.error("Роутер %s отклонил команду: %s", self.name, err)
+            return None
+
+        return fingerprint is None or fingerprint != self.cache.fingerprint(group_name)
+
+    def get_group_ip_list(self, group_name: str, use_cache: bool = True,
+                          group_type: str = ADDRESS_GROUP) -> [list, None]:
+        """
+        Получить список IPv4 записей группы: адресов, сетей и диапазонов, для ipv6-address-group - IPv6 записей.
+        Если отпечаток группы не изменился с прошлого чтения, записи берутся из кэша
         Args:
             group_name (str): Название группы, из которой необходимо получить IP-адреса
+            use_cache (bool): False - прочитать группу с роутера, даже если отпечаток не изменился
+            group_type (str): address-group или ipv6-address-group
 
         Returns:
-            list: Список IP адресов
+            list|None: Список IP адресов, None - если не удалось подключиться к роутеру или он отклонил команду
         """
+        def read_group(ssh: SSH2) -> list:
+            fingerprint = self._probe(ssh=ssh, group_name=group_name, group_type=group_type)
+            if use_cache and fingerprint is not None and fingerprint == self.cache.fingerprint(group_name):
+                self.cache.stats.hits += 1
+                return self.cache.entries(group_name)
+
+            entries = [entry.value for entry in self._show_group(ssh=ssh, group_name=group_name)
+                       if entry.kind in (IPV6_KINDS if group_type == IPV6_ADDRESS_GROUP else IPV4_KINDS)]
+            if fingerprint is not None:
+                self.cache.store(group_name, fingerprint, entries)
+            return entries
+
         try:
-            if not self.ssh.is_app_authorized():
-                self.__ssh_connect()
-
-            self._force_close_configure_mode()
-            self.ssh.response = str()  # Очищаем последний response
-            self.ssh.execute(f"show firewall group {group_name} | no-more")
-            # Получаем ответ от ввода команды show, разделяем строки по разделителю \r\n, удаляем все пробелы
-            # Ищем строки, что подходят по регулярке, как IP-адрес
-            ip_list = [ip for ip in
-                       map(lambda res_string: re.sub(r"\s+", '', res_string), self.ssh.response.split("\r\n"))
-                       if re.match((r'(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.' * 4)[:-2], ip) is not None]
-            return ip_list
-
-        except SSHTimeoutError as err:
-            log.error(f"Ошибка SSH: {err}")
+            return self.connection.run(read_group)
 
+        except SSHConnectionError as err:
+            log.error("Ошибка SSH: %s", err)
+
+        except InvalidCommandException as err:
+            log.error("Роутер %s отклонил команду: %s", self.name, err)
@@ -1,102 +1,385 @@
-from asyncio import sleep as async_sleep
-from app.setting import DATABASE, UBNT
-from app.lookup import find_all_ip_hostname
+from asyncio import Lock, sleep as async_sleep, to_thread
+from time import monotonic, perf_counter, time
+from app.setting import DATABASE, ROUTERS, LOOKUP, RECONCILERS, DAMPER
+from app.lookup import TtlScheduler
+from app.metrics import Counter, Gauge, Histogram
+from app.ubnt import ADDRESS_GROUP, IPV6_ADDRESS_GROUP, UbntChangeSet
 from app.logger import get_logger
 
 
 log = get_logger(__name__)
 
+# Проход проверки и обновление по файлам хостов не должны одновременно планировать и применять изменения роутеров
+_ROUTER_LOCK = Lock()
 
-def add_new_ip_all_service(hostname: str, ip_address_list: list) -> None:
+PASS_DURATION = Histogram('ufir_pass_duration_seconds', 'Длительность прохода фоновой проверки актуальности')
+PASS_STAGE_DURATION = Histogram('ufir_pass_stage_duration_seconds', 'Длительность этапа прохода: dns, db и router',
+                                labels=('stage',))
+HOSTS_CHECKED = Counter('ufir_hosts_checked_total', 'Хосты, проверенные фоновой проверкой')
+IP_CHANGES = Counter('ufir_ip_changes_total', 'Изменения IP хостов, найденные фоновой проверкой',
+                     labels=('action',))
+# Уже существующая статистика компонентов читается при каждой выдаче метрик
+Counter('ufir_flap_damping_total', 'Подавление удалений IP: suppressed, removed и recovered', labels=('kind',),
+        callback=lambda: {(kind,): value for kind, value in DAMPER.stats.as_dict().items()})
+Gauge('ufir_flap_pending', 'IP, удаление которых подавлено', callback=lambda: len(DAMPER))
+Counter('ufir_dns_cache_total', 'Обращения к кэшу lookup: hits, negative_hits, misses и evictions',
+        labels=('kind',),
+        callback=lambda: {(kind,): value for kind, value in LOOKUP.cache.stats.as_dict().items()
+                          if kind != 'hit_ratio'} if LOOKUP.cache is not None else {})
+Counter('ufir_ssh_connects_total', 'Подключения к роутеру: connects, reconnects и failures', labels=('router', 'kind'),
+        callback=lambda: {(name, kind): value for name, service in ROUTERS.services.items()
+                          for kind, value in service.connection.stats.as_dict().items()
+                          if kind in ('connects', 'reconnects', 'failures')})
+
+
+async def _db_to_thread(func, /, *args, **kwargs):
+    """
+    Выполняет работу с БД в отдельном потоке, не блокируя event loop.
+    Соединение потока после работы возвращается в пул, иначе каждый поток executor занимал бы его навсегда
+    Args:
+        func (Callable): Функция, работающая с БД
+        *args: Позиционные аргументы func
+        **kwargs: Именованные аргументы func
+
+    Returns:
+        Результат func
+    """
+    def run():
+        with DATABASE.connection():
+            return func(*args, **kwargs)
+
+    return await to_thread(run)
+
+
+def _host_reconcilers(hostname: str) -> list:
     """
-        Утилита для добавления IP во всех сервисах, БД и Ubnt
     Args:
         hostname (str): Название хоста
-        ip_address_list (list): Список IP адресов для добавления
+
+    Returns:
+        list: Reconciler групп, в которые входит хост
+    """
+    return [reconciler for reconciler in RECONCILERS.values() if hostname in reconciler.desired.hosts()]
+
+
+async def apply_host_list_changes(added: dict, deleted: dict, lookup_result: dict) -> None:
+    """
+        Утилита для применения изменений списков хостов всех групп в БД одной транзакцией
+        и в желаемое состояние групп Ubnt. Запись в БД идет в отдельном потоке, не блокируя event loop
+    Args:
+        added (dict): Словарь группа - список добавленных в группу хостов
+        deleted (dict): Словарь группа - список убранных из группы хостов
+        lookup_result (dict): Словарь хост - список IP для добавленных хостов
 
     Returns:
         None:
+    """
+    def save() -> None:
+        with DATABASE.write_transaction():
+            DATABASE.apply_ip_changes(added={host: lookup_result.get(host, []) for hosts in added.values()
+                                             for host in hosts}, deleted={})
+            for group, hostname_list in added.items():
+                DATABASE.add_group_hosts(group=group, hostname_list=hostname_list)
+            for group, hostname_list in deleted.items():
+                DATABASE.delete_group_hosts(group=group, hostname_list=hostname_list)
 
+    await _db_to_thread(save)
+
+    for group, hostname_list in added.items():
+        for hostname in hostname_list:
+            RECONCILERS[group].add_host_ip(hostname=hostname, ip_list=lookup_result.get(hostname, []))
+
+    for group, hostname_list in deleted.items():
+        for hostname in hostname_list:
+            RECONCILERS[group].remove_host(hostname=hostname)
+
+
+async def sync_router() -> dict:
+    """
+    Применяет в UBNT план изменений всех групп, накопленный с прошлой синхронизации,
+    за одну сессию конфигурации на каждом роутере.
+    Роутеры обрабатываются параллельно в пуле потоков, event loop на время SSH сессий не блокируется.
+    Непримененные на роутере изменения остаются в его плане
+
+    Returns:
+        dict: Словарь роутер - список примененных ChangeEntry
+    """
+    async with _ROUTER_LOCK:
+        change_sets = {}
+        for router in ROUTERS:
+            change_set = change_sets[router] = UbntChangeSet()
+            for reconciler in RECONCILERS.values():
+                change_set.update(reconciler.plan(router))
+
+        if not any(change_sets.values()):
+            return {}
+
+        applied = await ROUTERS.apply_changes_async(change_sets)
+        for router, entries in applied.items():
+            for reconciler in RECONCILERS.values():
+                reconciler.acknowledge(entries, router=router)
+        return applied
+
+
+def _group_states(reconciler) -> list:
     """
-    hostname_model = DATABASE.get_or_create_host_by_name(hostname=hostname)
-    DATABASE.add_host_ip_list(hostname=hostname_model, ip_list=ip_address_list)
-    UBNT.add_new_ip(ip_address_list=ip_address_list)
+    Args:
+        reconciler (Reconciler): Reconciler группы адресов
+
+    Returns:
+        list: Тройки название группы - тип группы - метод Reconciler для загрузки состояния группы роутера
+    """
+    group_states = [(reconciler.group, ADDRESS_GROUP, reconciler.set_router_state)]
+    if reconciler.group6 is not None:
+        group_states.append((reconciler.group6, IPV6_ADDRESS_GROUP, reconciler.set_router_state6))
+    return group_states
 
 
-def delete_ip_from_all_service(hostname: str, ip_address_list: list) -> None:
+async def _check_router_group(force: bool = False) -> bool:
     """
-        Утилита для удаления IP из всех сервисов, БД и Ubnt
+    Сверяет группы IP адресов на каждом роутере UBNT с желаемым состоянием. Группа читается целиком,
+    только если ее отпечаток изменился с прошлого чтения, иначе проверка стоит одной короткой команды
     Args:
-        hostname (str): Название хоста, откуда необходимо удалить IP
-        ip_address_list (list): Список IP адресов для удаления
+        force (bool): True - прочитать группы целиком, даже если отпечаток не изменился
 
     Returns:
-        None:
+        bool: True - группы удалось проверить на всех роутерах, расхождения попадут в следующий sync_router
+    """
+    checked = True
+    for reconciler in RECONCILERS.values():
+        for group, group_type, set_router_state in _group_states(reconciler):
+            changed = dict.fromkeys(ROUTERS, True) if force else \
+                await ROUTERS.group_changed_async(group_name=group, group_type=group_type)
+            router_ip = await ROUTERS.get_group_ip_list_async(
+                group_name=group, routers=[router for router, value in changed.items() if value],
+                use_cache=not force, group_type=group_type)
+            checked = checked and None not in changed.values() and None not in router_ip.values()
+
+            for router, ubnt_ip in router_ip.items():
+                if ubnt_ip is None:
+                    continue
+
+                log.info("Проверка IP записей группы %s в UBNT %s", group, router)
+                set_router_state(ubnt_ip, router=router)
+                view = reconciler.routers[router]
+                dirty = len(view.dirty6 if group_type == IPV6_ADDRESS_GROUP else view.dirty)
+                if dirty:
+                    log.info("Обнаружены расхождения группы %s в UBNT %s с базой данных в %d %s", group, router, dirty,
+                             'адресах' if group_type == IPV6_ADDRESS_GROUP else 'блоках адресов')
+
+    return checked
+
+
+def _restore_snapshot(scheduler: TtlScheduler, saved: dict) -> bool:
+    """
+    Загружает снимок прошлого запуска: сроки проверки хостов и состояние групп роутеров с их отпечатками.
+    Хосты, TTL которых еще не истек, не проверяются сразу после запуска, а группы сверяются по отпечатку
+    Args:
+        scheduler (TtlScheduler): Расписание проверки хостов
+        saved (dict): Словарь (роутер, группа) - отпечаток сохраненного снимка, дополняется загруженными группами
+
+    Returns:
+        bool: True - состояние всех групп на всех роутерах восстановлено и читать их целиком не нужно
     """
-    hostname_model = DATABASE.get_or_create_host_by_name(hostname=hostname)
+    monotonic_now, now = monotonic(), time()
+    expiry = DATABASE.get_host_expiry()
+    for host, expires_at in expiry.items():
+        scheduler.schedule_at(host, due=monotonic_now + min(max(expires_at - now, 0), scheduler.max_ttl))
 
-    for ip in ip_address_list:
-        DATABASE.delete_ip_by_hostname(hostname=hostname_model, ip_address=ip)
+    snapshots = DATABASE.get_router_snapshots()
+    restored = True
+    for reconciler in RECONCILERS.values():
+        for group, _, set_router_state in _group_states(reconciler):
+            for router, service in ROUTERS.services.items():
+                if (router, group) not in snapshots:
+                    restored = False
+                    continue
 
-    UBNT.delete_ip(ip_address_list=ip_address_list)
+                fingerprint, entries = snapshots[(router, group)]
+                service.cache.restore(group, fingerprint, entries)
+                set_router_state(entries, router=router)
+                saved[(router, group)] = fingerprint
 
+    log.info("Загружен снимок прошлого запуска: сроков проверки хостов %d, групп роутеров %d", len(expiry), len(saved))
+    return restored
 
-def delete_host_from_all_service(hostname: str) -> None:
+
+async def _save_router_snapshots(saved: dict) -> None:
     """
-        Утилита для удаления IP из всех сервисов, БД и Ubnt
+    Сохраняет в БД группы роутеров, отпечаток которых изменился с прошлого сохранения.
+    Группы собираются в event loop, а запись в БД идет в отдельном потоке
     Args:
-        hostname (app.database.models.Host): Модель, откуда необходимо удалить IP
+        saved (dict): Словарь (роутер, группа) - отпечаток сохраненного снимка, обновляется сохраненными группами
 
     Returns:
         None:
     """
-    ip_list = DATABASE.get_host_ip_list(hostname)
-    DATABASE.delete_hostname(hostname=hostname)
-    UBNT.delete_ip(ip_address_list=ip_list)
+    pending = []
+    for reconciler in RECONCILERS.values():
+        for group, _, _ in _group_states(reconciler):
+            for router, service in ROUTERS.services.items():
+                fingerprint = service.cache.fingerprint(group)
+                if fingerprint is None or saved.get((router, group)) == fingerprint:
+                    continue
+                pending.append((router, group, fingerprint, service.cache.entries(group)))
+
+    def save() -> None:
+        for router, group, fingerprint, entries in pending:
+            DATABASE.save_router_snapshot(router=router, group=group, fingerprint=fingerprint, entries=entries)
+
+    if pending:
+        await _db_to_thread(save)
+    for router, group, fingerprint, _ in pending:
+        saved[(router, group)] = fingerprint
 
 
-async def background_checking_relevance(hours: int = 3) -> None:
+def _save_pass_changes(added: dict, deleted: dict, expiry: dict) -> None:
     """
-    Проверять актуальность IP адресов всех записанных хостов через определенный промежуток
+    Записывает в БД изменения IP и сроки проверки хостов за проход
     Args:
-        hours (int): Промежуток между проверками
+        added (dict): Словарь хост - новые IP
+        deleted (dict): Словарь хост - удаленные IP
+        expiry (dict): Словарь хост - время следующей проверки по time()
 
     Returns:
         None:
     """
-    while True:
-        log.info("Проверка IP хостов в базе данных")
-        host_list = DATABASE.get_all_host_with_ip()
-        for host in host_list.keys():
-            lookup_ip = find_all_ip_hostname(hostname=host, logging=False)
-            db_host_ip = host_list[host]
+    if added or deleted:
+        # Изменения всех хостов прохода записываются в БД одной транзакцией
+        DATABASE.apply_ip_changes(added=added, deleted=deleted)
+    DATABASE.save_host_expiry(expiry)
+
+
+class RelevanceChecker:
+    """
+    Состояние фоновой проверки актуальности: расписание проверки хостов, срок следующей полной сверки групп
+    и отпечатки сохраненных снимков групп роутеров. Один вызов run_pass - один проход проверки
+    """
+
+    def __init__(self, hours: int = 3, min_ttl: float = 30):
+        """
+        Args:
+            hours (int): Максимальный промежуток между проверками хоста и промежуток между сверками группы в UBNT
+            min_ttl (float): Минимальный промежуток между проверками хоста в секундах
+        """
+        self.period = hours * 60 * 60
+        self.min_ttl = min_ttl
+        self.scheduler = TtlScheduler(min_ttl=min_ttl, max_ttl=self.period)
+        self.saved_fingerprints = {}
+        # После перезапуска группы читаются целиком, только если для них нет снимка
+        restored = _restore_snapshot(scheduler=self.scheduler, saved=self.saved_fingerprints)
+        self.next_router_check = monotonic() + self.period if restored else monotonic()
+        self.hosts_version = None
 
-            new_ip = set.difference(set(lookup_ip), set(db_host_ip))
-            deleted_ip = set.difference(set(db_host_ip), set(lookup_ip))
+    def next_delay(self) -> float:
+        """
+        Returns:
+            float: Количество секунд до следующего прохода
+        """
+        return min(self.scheduler.next_delay(), max(self.next_router_check - monotonic(), 0))
+
+    async def run_pass(self) -> list:
+        """
+        Проверяет IP хостов, срок проверки которых наступил, сверяет группы роутеров и применяет изменения
+
+        Returns:
+            list: Проверенные хосты
+        """
+        start = perf_counter()
+        scheduler = self.scheduler
+        # Расписание сверяется со списком хостов, только если хосты добавлялись или удалялись
+        # Хост, входящий в несколько групп, проверяется один раз
+        version = tuple(reconciler.desired.version for reconciler in RECONCILERS.values())
+        if self.hosts_version != version:
+            hosts = set().union(*(reconciler.desired.hosts() for reconciler in RECONCILERS.values()))
+            scheduler.sync(hosts)
+            DAMPER.sync(hosts)
+            self.hosts_version = version
+
+        due_hosts = scheduler.pop_due()
+        added_ip, removed_ip, expiry = {}, {}, {}
+
+        if due_hosts:
+            log.info("Проверка IP %d хостов в базе данных", len(due_hosts))
+            with PASS_STAGE_DURATION.time(stage='dns'):
+                lookup_result = await LOOKUP.resolve_all(due_hosts)
+            HOSTS_CHECKED.inc(len(due_hosts))
+
+        for host in due_hosts:
+            result = lookup_result[host]
+            reconcilers = _host_reconcilers(host)
+            if not reconcilers:
+                # Хост удалили из файлов, пока шел lookup
+                continue
+
+            if result is None:
+                # Резолвер не ответил - не трогаем IP хоста и повторяем проверку через минимальный интервал
+                expiry[host] = scheduler.schedule(host, ttl=self.min_ttl) - monotonic() + time()
+                continue
+
+            expiry[host] = scheduler.schedule(host, ttl=result.ttl) - monotonic() + time()
+            # IP, пропавшие из ответа, удаляются только после нескольких пропусков подряд
+            ip_list = DAMPER.observe(hostname=host, current_ip=reconcilers[0].desired.host_ip(host),
+                                     ip_list=result.ip_list)
+            # IP хоста одинаковы во всех его группах, поэтому изменения для БД берутся из первой
+            new_ip, deleted_ip = reconcilers[0].set_host_ip(hostname=host, ip_list=ip_list)
+            for reconciler in reconcilers[1:]:
+                reconciler.set_host_ip(hostname=host, ip_list=ip_list)
 
             if new_ip:
-                log.info(f"Для хоста {host} обнаружены новые IP: {', '.join(new_ip)}")
-                add_new_ip_all_service(hostname=host, ip_address_list=list(new_ip))
+                log.debug("Для хоста %s обнаружены новые IP: %s", host, ', '.join(new_ip))
+                added_ip[host] = new_ip
 
             if deleted_ip:
-                log.info(f"Для хоста {host} обнаружено удаление IP: {', '.join(new_ip)}")
-                delete_ip_from_all_service(hostname=host, ip_address_list=list(deleted_ip))
+                log.debug("Для хоста %s обнаружено удаление IP: %s", host, ', '.join(deleted_ip))
+                removed_ip[host] = deleted_ip
+
+        IP_CHANGES.inc(sum(map(len, added_ip.values())), action='added')
+        IP_CHANGES.inc(sum(map(len, removed_ip.values())), action='removed')
+
+        # Запись в БД блокирующая, поэтому идет в отдельном потоке, а event loop продолжает работу
+        stage_start = perf_counter()
+        await _db_to_thread(_save_pass_changes, added=added_ip, deleted=removed_ip, expiry=expiry)
+        db_duration = perf_counter() - stage_start
 
-        ubnt_ip = UBNT.get_group_ip_list(group_name=UBNT.firewall_group)
-        if ubnt_ip is not None:
-            log.info("Проверка IP записей в UBNT")
+        with PASS_STAGE_DURATION.time(stage='router'):
+            # Изменения группы не через сервис обнаруживаются по отпечатку на каждом проходе,
+            # а раз в период группа читается целиком на случай, если отпечаток их не отразил
+            force = monotonic() >= self.next_router_check
+            async with _ROUTER_LOCK:
+                await _check_router_group(force=force)
+            if force:
+                self.next_router_check = monotonic() + self.period
 
-            db_ip_list = [ip.ip_address for ip in DATABASE.get_all_ip_address()]
-            extra_ip = set.difference(set(ubnt_ip), set(db_ip_list))
-            missing_ip = set.difference(set(db_ip_list), set(ubnt_ip))
+            # Все изменения прохода во всех группах применяются в UBNT за одну сессию конфигурации
+            await sync_router()
 
-            if extra_ip:
-                log.info(f"Обнаружены неудаленные из UBNT IP: {', '.join(extra_ip)}")
-                UBNT.delete_ip(ip_address_list=list(extra_ip))
+        stage_start = perf_counter()
+        await _save_router_snapshots(self.saved_fingerprints)
+        PASS_STAGE_DURATION.observe(db_duration + perf_counter() - stage_start, stage='db')
+        PASS_DURATION.observe(perf_counter() - start)
 
-            if missing_ip:
-                log.info(f"Обнаружены недобавленные в UBNT IP: {', '.join(missing_ip)}")
-                UBNT.add_new_ip(ip_address_list=list(missing_ip))
+        if due_hosts:
+            log.info("Проверка успешно выполнена")
+            if DAMPER.enabled:
+                log.info("Подавление удалений IP: ожидают удаления %d, %s", len(DAMPER), DAMPER.stats.as_dict())
+            if LOOKUP.cache is not None:
+                log.debug("Кэш lookup: хостов %d, %s", len(LOOKUP.cache), LOOKUP.cache.stats.as_dict())
 
-        log.info("Проверка успешно выполнена")
-        await async_sleep(hours * 60 * 60)
+        return due_hosts
+
+
+async def background_checking_relevance(hours: int = 3, min_ttl: float = 30) -> None:
+    """
+    Проверять актуальность IP адресов каждого записанного хоста по истечении TTL его записей
+    Args:
+        hours (int): Максимальный промежуток между проверками хоста и промежуток между сверками группы в UBNT
+        min_ttl (float): Минимальный промежуток между проверками хоста в секундах
+
+    Returns:
+        None:
+    """
+    checker = RelevanceChecker(hours=hours, min_ttl=min_ttl)
+    while True:
+        await checker.run_pass()
+        await async_sleep(checker.next_delay())
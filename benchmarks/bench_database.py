@@ -0,0 +1,86 @@
+"""
+Сравнение профилей SQLite на операциях, из которых состоит работа сервиса
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_database [--hosts 5000] [--ip-per-host 10] [--writes 500]
+"""
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from time import perf_counter
+
+from app.database import Database
+from app.database.models import IpAddress
+from app.database.pragmas import PROFILES
+
+
+def bench_row_writes(database: Database, writes: int) -> float:
+    """Запись по одной строке в своей транзакции, как при добавлении хостов из файла"""
+    host = database.get_or_create_host_by_name('row-writes.bench')
+    start = perf_counter()
+    for index in range(writes):
+        IpAddress.create(hostname_id=host.id, ip_address=f'10.200.{index // 256}.{index % 256}')
+    return writes / (perf_counter() - start)
+
+
+def bench_concurrent_writes(database: Database, writes: int) -> float:
+    """Два потока-писателя, как слежение за файлом и фоновая проверка"""
+    def writer(thread_index: int):
+        with database.connection():
+            host = database.get_or_create_host_by_name(f'concurrent-{thread_index}.bench')
+            for index in range(writes):
+                database.add_host_ip_list(hostname=host,
+                                          ip_list=[f'10.{210 + thread_index}.{index // 256}.{index % 256}'])
+
+    threads = [threading.Thread(target=writer, args=(thread_index,)) for thread_index in range(2)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return 2 * writes / (perf_counter() - start)
+
+
+def bench_reconciliation(database: Database, hosts: int, ip_per_host: int) -> tuple:
+    """Заполнение БД и проход сверки с заменой 10% IP"""
+    start = perf_counter()
+    database.apply_ip_changes(
+        added={f'host-{host}.bench': [f'10.{host // 256 % 200}.{host % 256}.{index}' for index in range(ip_per_host)]
+               for host in range(hosts)},
+        deleted={})
+    fill_time = perf_counter() - start
+
+    start = perf_counter()
+    host_list = database.get_all_host_with_ip()
+    changed = list(host_list)[::10]
+    database.apply_ip_changes(
+        added={host: [ip.rsplit('.', 1)[0] + '.250' for ip in host_list[host][:1]] for host in changed},
+        deleted={host: host_list[host][:1] for host in changed})
+    return fill_time, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=5000)
+    parser.add_argument('--ip-per-host', type=int, default=10)
+    parser.add_argument('--writes', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'профиль':<12} {'строк/с':>10} {'2 писателя, строк/с':>20} "
+          f"{'заполнение ' + str(args.hosts * args.ip_per_host) + ' IP, с':>24} {'проход сверки, с':>18}")
+
+    for profile, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as temp_dir:
+            database = Database(database=str(Path(temp_dir, 'bench.sqlite')), pragmas=pragmas)
+            database.init()
+            row_writes = bench_row_writes(database, writes=args.writes)
+            concurrent_writes = bench_concurrent_writes(database, writes=args.writes // 2)
+            fill_time, pass_time = bench_reconciliation(database, hosts=args.hosts, ip_per_host=args.ip_per_host)
+            database.close()
+
+        print(f"{profile:<12} {row_writes:>10.0f} {concurrent_writes:>20.0f} {fill_time:>24.3f} {pass_time:>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Сравнение IPSet с множеством строк на сверке группы адресов
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_ipset [--size 200000] [--changed 0.05]
+"""
+import argparse
+import random
+import tracemalloc
+from time import perf_counter
+
+import app.ipset.ipset as ipset_module
+from app.ipset import IPSet, int_to_ip
+
+
+def generate(size: int, changed: float) -> tuple:
+    """Группа на роутере и желаемое состояние, отличающееся на долю changed"""
+    values = random.sample(range(0x0A000000, 0x0B000000), int(size * (1 + changed)))
+    router = [int_to_ip(value) for value in values[:size]]
+    desired = [int_to_ip(value) for value in values[int(size * changed):]]
+    return router, desired
+
+
+def diff(router_set, desired_set) -> tuple:
+    """Лишние на роутере и недостающие IP, одинаково для set и IPSet"""
+    return router_set - desired_set, desired_set - router_set
+
+
+def measure(build, router: list, desired: list, lookups: list) -> dict:
+    tracemalloc.start()
+    start = perf_counter()
+    router_set, desired_set = build(router), build(desired)
+    build_time = perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = perf_counter()
+    extra, missing = diff(router_set, desired_set)
+    diff_time = perf_counter() - start
+
+    start = perf_counter()
+    found = sum(ip in router_set for ip in lookups)
+    lookup_time = perf_counter() - start
+
+    return {'build': build_time, 'memory': memory / 2 ** 20, 'diff': diff_time, 'lookup': lookup_time,
+            'result': (len(extra), len(missing), found)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--changed', type=float, default=0.05)
+    parser.add_argument('--lookups', type=int, default=10000)
+    args = parser.parse_args()
+
+    router, desired = generate(args.size, args.changed)
+    lookups = random.sample(desired, min(args.lookups, len(desired)))
+
+    numpy = ipset_module.numpy
+    variants = [('set строк', set)]
+    if numpy is not None:
+        variants.append(('IPSet numpy', IPSet.from_strings))
+    variants.append(('IPSet array', IPSet.from_strings))
+
+    print(f"{args.size} IP в группе, изменено {args.changed:.0%}")
+    print(f"{'вариант':<12} {'из строк, с':>12} {'память, МиБ':>12} {'сверка, с':>10} "
+          f"{args.lookups:>7} проверок, с")
+
+    results = []
+    for name, build in variants:
+        ipset_module.numpy = None if name == 'IPSet array' else numpy
+        result = measure(build, router, desired, lookups)
+        results.append(result['result'])
+        print(f"{name:<12} {result['build']:>12.3f} {result['memory']:>12.1f} {result['diff']:>10.4f} "
+              f"{result['lookup']:>18.4f}")
+    ipset_module.numpy = numpy
+
+    assert len(set(results)) == 1, "Варианты дали разный результат сверки"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Пропускная способность lookup через AsyncLookup с DNS клиентом на локальной DNS заглушке
+(tests.stub_dns.StubDnsServer) с заданной задержкой, потерями, ротацией ответов и долей NXDOMAIN.
+Для каждого количества хостов выводятся lookup/с, p50 и p99 времени получения результата хоста,
+длительность прохода, количество хостов без ответа и запросов к серверу. Второй проход идет через DnsCache
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_lookup [--sizes 1000,10000,50000] [--latency 0.005] [--loss 0.01]
+                                      [--rotate 2] [--nxdomain-rate 0.05] [--concurrency 64]
+"""
+import argparse
+import asyncio
+from os import environ
+from time import perf_counter
+
+from tests.stub_dns import StubDnsServer, synthetic_zone
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_pass(lookup, hosts: list) -> tuple:
+    """Проход resolve_all с замером времени получения результата каждого хоста"""
+    semaphore = asyncio.Semaphore(lookup.concurrency)
+    latencies = []
+
+    async def timed_resolve(hostname: str):
+        start = perf_counter()
+        result = await lookup.resolve(hostname=hostname, semaphore=semaphore)
+        latencies.append(perf_counter() - start)
+        return result
+
+    start = perf_counter()
+    results = await asyncio.gather(*[timed_resolve(hostname) for hostname in hosts])
+    elapsed = perf_counter() - start
+    return elapsed, latencies, sum(result is None for result in results)
+
+
+async def bench(size: int, args) -> list:
+    from app.lookup import AsyncLookup, DnsCache, DnsResolver
+
+    zone = synthetic_zone(hosts=size, ip_per_host=args.ip_per_host, ttl=300)
+    hosts = list(zone)
+    rows = []
+    with StubDnsServer(zone=zone, latency=args.latency, loss=args.loss, rotate=args.rotate,
+                       nxdomain_rate=args.nxdomain_rate, negative_ttl=30) as server:
+        resolver = DnsResolver(nameserver='127.0.0.1', port=server.port)
+        for name, cache in (('без кэша', None), ('с кэшем', DnsCache(max_size=size))):
+            lookup = AsyncLookup(concurrency=args.concurrency, timeout=args.timeout, retries=args.retries,
+                                 resolver=resolver, cache=cache)
+            if cache is not None:
+                # Кэш наполняется первым проходом, замеряется повторный
+                await run_pass(lookup, hosts)
+            queries = server.queries
+            elapsed, latencies, unanswered = await run_pass(lookup, hosts)
+            rows.append((name, size / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), elapsed,
+                         unanswered, server.queries - queries))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--ip-per-host', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--loss', type=float, default=0.01)
+    parser.add_argument('--rotate', type=int, default=2)
+    parser.add_argument('--nxdomain-rate', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=0.5)
+    parser.add_argument('--retries', type=int, default=2)
+    args = parser.parse_args()
+    # Журнал ошибок lookup по каждому NXDOMAIN не должен попадать в замер
+    environ['LOGGING_LEVEL'] = 'CRITICAL'
+
+    print(f"{'хостов':>7} {'проход':<9} {'lookup/с':>9} {'p50, мс':>8} {'p99, мс':>8} {'проход, с':>10} "
+          f"{'без ответа':>10} {'запросов':>9}")
+    for size in map(int, args.sizes.split(',')):
+        for name, rate, p50, p99, elapsed, unanswered, queries in asyncio.run(bench(size, args)):
+            print(f"{size:>7} {name:<9} {rate:>9.0f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {elapsed:>10.2f} "
+                  f"{unanswered:>10} {queries:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Сравнение разбора вывода show firewall group: прежний построчный re.sub и потоковый парсер
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_parser [--entries 50000] [--repeat 5]
+"""
+import argparse
+import re
+from pathlib import Path
+from time import perf_counter
+
+from app.ubnt.parser import parse_show_group
+
+FIXTURE = Path(__file__).parent.parent / 'tests' / 'fixtures' / 'show_firewall_group.txt'
+
+
+def build_output(entries: int) -> str:
+    """Вывод из фикстуры, в котором участники группы размножены до entries записей"""
+    lines = FIXTURE.read_text().splitlines()
+    members = [line for line in lines if line.startswith('  ')]
+    header = [line for line in lines if not line.startswith('  ')]
+    generated = [f"  10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}" for index in range(entries)]
+    return '\r\n'.join(header[:-1] + generated + members + header[-1:])
+
+
+def legacy_parse(response: str) -> list:
+    """Разбор до перехода на парсер: регулярка собиралась заново для каждой строки"""
+    return [ip for ip in map(lambda res_string: re.sub(r"\s+", '', res_string), response.split("\r\n"))
+            if re.match((r'(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.' * 4)[:-2], ip) is not None]
+
+
+def bench(parse, output: str, repeat: int) -> tuple:
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        result = parse(output)
+        best = min(best, perf_counter() - start)
+    return best, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    output = build_output(args.entries)
+    print(f"{args.entries} записей, {len(output) / 2 ** 20:.1f} МиБ вывода")
+    print(f"{'вариант':<10} {'время, с':>10} {'записей':>9}")
+    for name, parse in (('прежний', legacy_parse), ('парсер', lambda text: list(parse_show_group(text)))):
+        elapsed, count = bench(parse, output, args.repeat)
+        print(f"{name:<10} {elapsed:>10.4f} {count:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Сквозной замер работы с роутером на локальном симуляторе EdgeOS (tests.fake_edgeos.FakeEdgeRouter):
+применение изменений и чтение группы через UbntService обоими драйверами, а также проходы
+фоновой проверки актуальности с DNS заглушкой - холодный, без изменений и с заменой 10% IP.
+Для каждого замера выводится время, количество обменов с роутером (строк shell и скриптов) и commit
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_router [--sizes 100,10000,100000] [--ip-per-host 10]
+                                      [--command-latency 0.002] [--commit-latency 0.05]
+"""
+import argparse
+import multiprocessing
+import tempfile
+from os import environ
+from pathlib import Path
+from time import perf_counter
+
+from tests.fake_edgeos import FakeEdgeRouter
+from tests.stub_dns import StubDnsServer, QTYPE_A
+
+GROUP = 'bench-v4'
+
+
+def generate_ip(index: int) -> str:
+    return f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+
+
+def measure(router: FakeEdgeRouter, action) -> tuple:
+    """Выполняет действие и возвращает время, обмены с роутером и commit за время действия"""
+    router.reset_counters()
+    start = perf_counter()
+    action()
+    return perf_counter() - start, router.round_trips, router.commits
+
+
+def bench_service(size: int, driver: str, command_latency: float, commit_latency: float) -> list:
+    """Добавление size адресов одним набором изменений, полное чтение группы и удаление 10% адресов"""
+    from app.ubnt import ScriptDriver, UbntChangeSet, UbntService
+
+    with FakeEdgeRouter(command_latency=command_latency, commit_latency=commit_latency) as router:
+        service = UbntService(host='127.0.0.1', port=router.port, login=router.username, password=router.password,
+                              firewall_group=GROUP, driver=ScriptDriver() if driver == 'script' else None)
+        ip_list = [generate_ip(index) for index in range(size)]
+        added, deleted = UbntChangeSet(), UbntChangeSet()
+        added.add(ip_list, group=GROUP)
+        deleted.delete(ip_list[::10], group=GROUP)
+
+        results = [('применение', *measure(router, lambda: service.apply_changes(added))),
+                   ('чтение группы', *measure(router, lambda: service.get_group_ip_list(GROUP, use_cache=False))),
+                   ('удаление 10%', *measure(router, lambda: service.apply_changes(deleted)))]
+        service.connection.close()
+
+    return results
+
+
+def _bench_passes(size: int, ip_per_host: int, driver: str, command_latency: float, commit_latency: float,
+                  queue) -> None:
+    """Проходы фоновой проверки в отдельном процессе, так как настройки сервиса читаются один раз при импорте"""
+    import asyncio
+
+    hosts = [f"host-{index}.bench" for index in range(max(1, size // ip_per_host))]
+    zone = {host: {QTYPE_A: (0, [generate_ip(index * ip_per_host + offset) for offset in range(ip_per_host)])}
+            for index, host in enumerate(hosts)}
+
+    with tempfile.TemporaryDirectory() as temp_dir, StubDnsServer(zone=zone) as dns, \
+            FakeEdgeRouter(command_latency=command_latency, commit_latency=commit_latency) as router:
+        environ.update({
+            'SQLITE_PATH': str(Path(temp_dir, 'bench.sqlite')), 'LOGGING_PATH': str(Path(temp_dir, 'bench.log')),
+            'LOGGING_LEVEL': 'ERROR', 'HOSTS_LISTS': '', 'HOSTS_FILE_PATH': str(Path(temp_dir, 'hosts.txt')),
+            'UBNT_FIREWALL_GROUP': GROUP, 'UBNT_FIREWALL_GROUP_V6': '', 'UBNT_HOST': '127.0.0.1',
+            'UBNT_PORT': str(router.port), 'UBNT_USER': router.username, 'UBNT_PASSWORD': router.password,
+            'UBNT_DRIVER': driver, 'LOOKUP_BACKEND': 'dns', 'LOOKUP_NAMESERVER': '127.0.0.1',
+            'LOOKUP_NAMESERVER_PORT': str(dns.port), 'LOOKUP_CACHE_SIZE': '0', 'LOOKUP_FLAP_MISSES': '1',
+        })
+        from app.setting import ROUTERS, DATABASE
+        from app.utils.utils import RelevanceChecker, apply_host_list_changes
+
+        asyncio.run(apply_host_list_changes(added={GROUP: hosts}, deleted={}, lookup_result={}))
+        checker = RelevanceChecker(hours=1, min_ttl=0)
+
+        def run_pass():
+            asyncio.run(checker.run_pass())
+
+        results = [('холодный проход', *measure(router, run_pass)),
+                   ('без изменений', *measure(router, run_pass))]
+
+        for index, host in enumerate(hosts[::10]):
+            dns.zone[host][QTYPE_A][1][0] = generate_ip(size + index)
+        results.append(('замена 10% IP', *measure(router, run_pass)))
+
+        ROUTERS.close()
+        DATABASE.close()
+
+    queue.put(results)
+
+
+def bench_passes(size: int, ip_per_host: int, driver: str, command_latency: float, commit_latency: float) -> list:
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_bench_passes,
+                              args=(size, ip_per_host, driver, command_latency, commit_latency, queue))
+    process.start()
+    results = queue.get()
+    process.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,10000,100000')
+    parser.add_argument('--ip-per-host', type=int, default=10)
+    parser.add_argument('--drivers', default='cli,script')
+    parser.add_argument('--command-latency', type=float, default=0.002)
+    parser.add_argument('--commit-latency', type=float, default=0.05)
+    args = parser.parse_args()
+    # Журнал сервиса на каждую операцию не должен попадать в замер
+    environ['LOGGING_LEVEL'] = 'ERROR'
+
+    print(f"{'IP':>7} {'драйвер':<8} {'замер':<16} {'время, с':>9} {'обменов':>8} {'commit':>7}")
+    for size in map(int, args.sizes.split(',')):
+        for driver in args.drivers.split(','):
+            results = bench_service(size, driver, args.command_latency, args.commit_latency)
+            results += bench_passes(size, args.ip_per_host, driver, args.command_latency, args.commit_latency)
+            for name, elapsed, round_trips, commits in results:
+                print(f"{size:>7} {driver:<8} {name:<16} {elapsed:>9.3f} {round_trips:>8} {commits:>7}")
+
+
+if __name__ == '__main__':
+    main()
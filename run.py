@@ -1,13 +1,23 @@
 from app.utils import background_checking_relevance
 from app.file.file_watchdog import HostFileWatchdog
+from app.setting import DATABASE, ROUTERS, HOST_LISTS, METRICS
 from asyncio import get_event_loop
 from os import environ
 
 
 if __name__.endswith("__main__"):
-    WATCHDOG = HostFileWatchdog(file_path=environ.get('HOSTS_FILE_PATH'))
+    WATCHDOG = HostFileWatchdog(host_lists=HOST_LISTS,
+                                quiet_window=float(environ.get('HOSTS_FILE_DEBOUNCE', "1")))
 
     async_loop = get_event_loop()
     async_loop.create_task(WATCHDOG.start())
-    async_loop.create_task(background_checking_relevance(hours=int(environ.get("AUTOCHECK_PERIOD", "1"))))
-    async_loop.run_forever()
+    async_loop.create_task(background_checking_relevance(
+        hours=int(environ.get("AUTOCHECK_PERIOD", "1")),
+        min_ttl=float(environ.get("LOOKUP_MIN_TTL", "30"))))
+    if METRICS is not None:
+        async_loop.create_task(METRICS.serve())
+    try:
+        async_loop.run_forever()
+    finally:
+        ROUTERS.close()
+        DATABASE.close()
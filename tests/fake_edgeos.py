@@ -0,0 +1,352 @@
+import hashlib
+import socket
+import threading
+import time
+import paramiko
+
+_HOST_KEY = paramiko.RSAKey.generate(2048)
+# Тип группы - ключевое слово ее участников
+_GROUP_MEMBERS = {'address-group': 'address', 'ipv6-address-group': 'ipv6-address'}
+
+
+# Начало вывода команд, завершившихся ошибкой
+_ERRORS = ('Invalid command', 'Nothing to delete', 'Cannot exit')
+# cli-shell-api exists ничего не выводит, а отсутствие пути сообщает кодом завершения
+_NOT_EXISTS = 'Path does not exist'
+
+
+def _member(entry: str) -> str:
+    return 'ipv6-address' if ':' in entry else 'address'
+
+
+def _failed(result: str) -> bool:
+    return result.startswith(_ERRORS + (_NOT_EXISTS,)) or result.endswith('command not found')
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, router):
+        self.router = router
+        self.shell_requested = threading.Event()
+        self.exec_commands = {}  # ID канала - команда exec
+        self.exec_requested = threading.Condition()
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.router.username, self.router.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        with self.exec_requested:
+            self.exec_commands[channel.get_id()] = command.decode()
+            self.exec_requested.notify_all()
+        return True
+
+    def wait_exec(self, channel, timeout: float = 10):
+        with self.exec_requested:
+            self.exec_requested.wait_for(lambda: channel.get_id() in self.exec_commands, timeout=timeout)
+            return self.exec_commands.pop(channel.get_id(), None)
+
+
+class _ShellSession:
+    """Интерактивная сессия vbash с режимами op и configure"""
+
+    def __init__(self, router, channel):
+        self.router = router
+        self.channel = channel
+        self.candidate = None  # Конфигурация группы в режиме configure, None - режим op
+
+    @property
+    def prompt(self) -> str:
+        if self.candidate is None:
+            return f"\r\n{self.router.username}@{self.router.hostname}:~$ "
+        return f"\r\n[edit]\r\n{self.router.username}@{self.router.hostname}# "
+
+    def run(self):
+        self.channel.sendall(f"Welcome to EdgeOS{self.prompt}")
+        buffer = b''
+        while True:
+            data = self.channel.recv(65536)
+            if not data:
+                return
+            buffer += data
+            while b'\r' in buffer or b'\n' in buffer:
+                line, buffer = buffer.replace(b'\n', b'\r').split(b'\r', 1)
+                self.router.round_trip()
+                output = self.execute_line(line.decode())
+                if output is None:
+                    return
+                self.channel.sendall(line + b'\r\n' + output.encode() + self.prompt.encode())
+
+    def execute_line(self, line: str):
+        output = []
+        for command in line.split(';'):
+            command, *pipes = [part.strip() for part in command.split('|')]
+            if not command:
+                continue
+            result = self.execute(command)
+            if result is None:
+                return None
+            if 'md5sum' in pipes:
+                result = hashlib.md5(result.encode()).hexdigest() + '  -'
+            output.append(result)
+
+        return '\r\n'.join(part for part in output if part)
+
+    def execute(self, command: str):
+        self.router.commands.append(command)
+        words = command.split()
+
+        if self.candidate is None:
+            if command == 'configure':
+                self.candidate = {group: set(entries) for group, entries in self.router.groups.items()}
+                return ''
+            if command == 'exit':
+                self.channel.close()
+                return None
+            if words[:3] == ['show', 'firewall', 'group'] and len(words) == 4:
+                return self.router.show_group(words[3])
+            if words[:2] == ['cli-shell-api', 'showCfg'] and words[2:4] == ['firewall', 'group'] \
+                    and words[4] in _GROUP_MEMBERS and len(words) == 6:
+                return self.router.show_cfg(words[5])
+            if command == 'show configuration commands':
+                return self.router.show_configuration_commands()
+            return f"{words[0]}: command not found"
+
+        if command == 'configure':
+            return "configure: command not found"
+        if command in ('exit', 'exit discard'):
+            if command == 'exit' and self.candidate != self.router.groups:
+                return "Cannot exit: configuration modified.\r\nUse 'exit discard' to discard the changes and exit."
+            self.candidate = None
+            return 'exit'
+        if command == 'discard':
+            self.candidate = {group: set(entries) for group, entries in self.router.groups.items()}
+            return 'Changes have been discarded'
+        if command == 'commit':
+            self.router.commit({group: set(entries) for group, entries in self.candidate.items()})
+            return ''
+        if command == 'save':
+            self.router.saves += 1
+            return "Saving configuration to '/config/config.boot'...\r\nDone"
+        if words[:2] == ['cli-shell-api', 'exists'] and words[2:4] == ['firewall', 'group'] and len(words) == 8:
+            return '' if words[7] in self.candidate.get(words[5], set()) else _NOT_EXISTS
+        if words[0] in ('set', 'delete') and words[1:3] == ['firewall', 'group'] \
+                and len(words) == 7 and _GROUP_MEMBERS.get(words[3]) == words[5]:
+            group, address = words[4], words[6]
+            if words[0] == 'set':
+                self.candidate.setdefault(group, set()).add(address)
+                return ''
+            if address not in self.candidate.get(group, set()):
+                return "Nothing to delete (the specified value does not exist)"
+            self.candidate[group].discard(address)
+            return ''
+
+        return f"Invalid command: [{command}]"
+
+
+class _ScriptSession(_ShellSession):
+    """Выполнение скрипта vbash из stdin в exec канале, как vbash -s с script-template"""
+
+    def run(self):
+        data = b''
+        while True:
+            chunk = self.channel.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+
+        self.router.round_trip()
+        output, status = [], 0
+        for line in data.decode().splitlines():
+            line = line.strip()
+            if not line or line.startswith(('#', 'source ')):
+                continue
+            if line == 'exit':
+                self.execute(line)
+                break
+
+            status = self.run_or_list([part.strip() for part in line.split('||')], output)
+            if status:
+                break
+
+        self.channel.sendall('\n'.join(output + ['']).encode())
+        self.channel.send_exit_status(status)
+
+    def run_or_list(self, commands: list, output: list) -> int:
+        """
+        Выполняет цепочку a || b || c до первой успешной команды, ! инвертирует результат команды.
+        Возвращает код завершения скрипта, 0 - скрипт продолжается
+        """
+        for command in commands:
+            if command.startswith(('{', 'echo ')):
+                return self.run_fallback(command, output)
+            negate = command.startswith('! ')
+            result = self.execute(command[2:] if negate else command)
+            failed = _failed(result)
+            if failed and not negate:
+                output.append(result)
+            if failed == negate:
+                return 0
+        return 0
+
+    def run_fallback(self, fallback: str, output: list) -> int:
+        """Выполняет команды после || и возвращает код завершения скрипта, 0 - скрипт продолжается"""
+        for command in fallback.strip('{} ').split(';'):
+            words = command.split()
+            if not words:
+                continue
+            if words[0] == 'echo':
+                output.append(' '.join(words[1:]))
+            elif words[0] == 'exit':
+                return int(words[1]) if len(words) > 1 else 1
+            else:
+                self.execute(command.strip())
+        return 0
+
+
+class FakeEdgeRouter:
+    """
+    Локальный SSH сервер, имитирующий shell EdgeOS для групп адресов firewall.
+    command_latency добавляется к каждой строке shell и каждому скрипту, commit_latency - к каждому commit
+    """
+
+    def __init__(self, username: str = 'ubnt', password: str = 'ubnt', hostname: str = 'ubnt',
+                 command_latency: float = 0, commit_latency: float = 0):
+        self.username = username
+        self.password = password
+        self.hostname = hostname
+        self.command_latency = command_latency
+        self.commit_latency = commit_latency
+        self.groups = {}
+        self.commands = []
+        self.commits = 0
+        self.saves = 0
+        self.connections = 0
+        self.scripts = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+        self._transports = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self.port = self._socket.getsockname()[1]
+
+    def round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.command_latency:
+            time.sleep(self.command_latency)
+
+    def reset_counters(self):
+        with self._lock:
+            self.commands = []
+            self.commits = self.saves = self.scripts = self.round_trips = 0
+
+    def commit(self, groups: dict):
+        if self.commit_latency:
+            time.sleep(self.commit_latency)
+        with self._lock:
+            self.groups = groups
+            self.commits += 1
+
+    def show_group(self, group: str) -> str:
+        entries = sorted(self.groups.get(group, set()))
+        return '\r\n'.join([f"Name       : {group}", "Type       : address", "Description: ",
+                            "Rule-Usage : []", f"Members    : {len(entries)}"] + [f"  {entry}" for entry in entries])
+
+    def show_cfg(self, group: str) -> str:
+        return ''.join(f" {_member(entry)} {entry}\n" for entry in sorted(self.groups.get(group, set())))
+
+    def show_configuration_commands(self) -> str:
+        lines = ["set firewall all-ping enable"]
+        for group in sorted(self.groups):
+            lines += [f"set firewall group {_member(entry)}-group {group} {_member(entry)} {entry}"
+                      for entry in sorted(self.groups[group])]
+        return '\r\n'.join(lines + ["set system host-name " + self.hostname])
+
+    def drop_connections(self):
+        """Обрывает все установленные соединения, как при перезагрузке роутера"""
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def _serve(self, client):
+        transport = paramiko.Transport(client)
+        transport.add_server_key(_HOST_KEY)
+        server = _ServerInterface(self)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError):
+            return
+        self._transports.append(transport)
+        channel = transport.accept(timeout=10)
+        if channel is None or not server.shell_requested.wait(timeout=10):
+            return
+        self.connections += 1
+        # Рядом с интерактивным shell клиент может открывать exec каналы для скриптов
+        threading.Thread(target=self._serve_scripts, args=(transport, server), daemon=True).start()
+        try:
+            _ShellSession(self, channel).run()
+        except (OSError, EOFError):
+            pass
+        finally:
+            self._close_channel(channel)
+
+    def _serve_scripts(self, transport, server):
+        while transport.is_active():
+            channel = transport.accept(timeout=1)
+            if channel is None:
+                continue
+            command = server.wait_exec(channel)
+            try:
+                if command is not None:
+                    self.commands.append(command)
+                    self.scripts += 1
+                    _ScriptSession(self, channel).run()
+            except (OSError, EOFError):
+                pass
+            finally:
+                self._close_channel(channel)
+
+    @staticmethod
+    def _close_channel(channel):
+        """Закрывает канал, транспорт которого клиент мог уже закрыть"""
+        try:
+            channel.close()
+        except (OSError, EOFError):
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def __enter__(self):
+        self._socket.listen(16)
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        # shutdown будит поток, заблокированный в accept, иначе закрытый сокет продолжает принимать соединения
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        self.drop_connections()
@@ -0,0 +1,171 @@
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+
+QTYPE_A = 1
+QTYPE_SOA = 6
+QTYPE_AAAA = 28
+
+# Ответ больше этого размера по UDP обрезается с флагом TC, и клиент повторяет запрос по TCP
+MAX_UDP_SIZE = 512
+
+
+def _encode_name(name: str) -> bytes:
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.strip('.').split('.')) + b'\x00'
+
+
+def synthetic_zone(hosts: int, ip_per_host: int = 1, ttl: int = 300, suffix: str = 'bench.test') -> dict:
+    """Зона из hosts хостов host-N.suffix с ip_per_host адресами у каждого"""
+    zone = {}
+    for host in range(hosts):
+        ip_list = []
+        for offset in range(ip_per_host):
+            index = host * ip_per_host + offset
+            ip_list.append(f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}")
+        zone[f"host-{host}.{suffix}"] = {QTYPE_A: (ttl, ip_list)}
+    return zone
+
+
+def build_answer(query: bytes, zone: dict, server=None, max_size: int = None) -> bytes:
+    """
+    Собирает ответ на запрос по синтетической зоне вида {host: {qtype: (ttl, [ip, ...])}}.
+    Если передан сервер, учитываются его доля NXDOMAIN, ротация ответов и TTL отрицательного ответа
+    """
+    qid, flags = struct.unpack_from('!HH', query)
+    offset, labels = 12, []
+    while query[offset]:
+        labels.append(query[offset + 1:offset + 1 + query[offset]].decode())
+        offset += query[offset] + 1
+    qtype = struct.unpack_from('!H', query, offset + 1)[0]
+    question = query[12:offset + 5]
+    hostname = '.'.join(labels).lower()
+
+    if hostname not in zone or (server is not None and server.is_nxdomain(hostname)):
+        authority = b''
+        if server is not None and server.negative_ttl is not None:
+            # SOA: корневые mname и rname, serial, refresh, retry, expire и minimum - TTL отрицательного ответа
+            soa = b'\x00\x00' + struct.pack('!IIIII', 1, 3600, 600, 86400, server.negative_ttl)
+            authority = struct.pack('!BHHIH', 0, QTYPE_SOA, 1, server.negative_ttl, len(soa)) + soa
+        return struct.pack('!HHHHHH', qid, 0x8183, 1, 0, 1 if authority else 0, 0) + question + authority
+
+    ttl, ip_list = zone[hostname].get(qtype, (0, []))
+    if server is not None:
+        ip_list = server.rotate_answer(hostname, qtype, ip_list)
+    family, rtype = (socket.AF_INET, QTYPE_A) if qtype == QTYPE_A else (socket.AF_INET6, QTYPE_AAAA)
+    answers = b''.join(
+        # 0xC00C - указатель на имя из секции запроса
+        struct.pack('!HHHIH', 0xC00C, rtype, 1, ttl, 4 if rtype == QTYPE_A else 16) + socket.inet_pton(family, ip)
+        for ip in ip_list)
+
+    response = struct.pack('!HHHHHH', qid, 0x8180, 1, len(ip_list), 0, 0) + question + answers
+    if max_size is not None and len(response) > max_size:
+        return struct.pack('!HHHHHH', qid, 0x8380, 1, 0, 0, 0) + question
+    return response
+
+
+class _UdpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        stub = self.server.stub
+        if not stub.receive():
+            return
+        sock.sendto(build_answer(data, stub.zone, server=stub, max_size=MAX_UDP_SIZE), self.client_address)
+
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        stub = self.server.stub
+        try:
+            header = self.request.recv(2, socket.MSG_WAITALL)
+            if len(header) < 2:
+                return
+            data = self.request.recv(struct.unpack('!H', header)[0], socket.MSG_WAITALL)
+            # По TCP запросы не теряются
+            stub.receive(lossy=False)
+            answer = build_answer(data, stub.zone, server=stub)
+            self.request.sendall(struct.pack('!H', len(answer)) + answer)
+        except OSError:
+            pass
+
+
+class StubDnsServer:
+    """
+    Локальный DNS сервер по UDP и TCP на одном порту, отвечающий по синтетической зоне.
+    Все случайные решения детерминированы seed, поэтому замеры и тесты повторяемы
+    """
+
+    def __init__(self, zone: dict, latency: float = 0, loss: float = 0, rotate: int = None,
+                 nxdomain_rate: float = 0, negative_ttl: int = None, seed: int = 0):
+        """
+        Args:
+            zone (dict): Зона вида {host: {qtype: (ttl, [ip, ...])}}
+            latency (float): Задержка перед каждым ответом в секундах
+            loss (float): Доля UDP запросов, оставленных без ответа
+            rotate (int|None): Количество адресов в ответе, адреса хоста выдаются по кругу, None - все адреса
+            nxdomain_rate (float): Доля хостов зоны, для которых сервер отвечает NXDOMAIN, выбор зависит от имени
+            negative_ttl (int|None): TTL отрицательного ответа в SOA секции authority, None - без SOA
+            seed (int): Начальное значение генератора потерь
+        """
+        self.zone = {hostname.lower(): records for hostname, records in zone.items()}
+        self.latency = latency
+        self.loss = loss
+        self.rotate = rotate
+        self.nxdomain_rate = nxdomain_rate
+        self.negative_ttl = negative_ttl
+        self.queries = 0
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._positions = {}
+        self._lock = threading.Lock()
+
+        # UDP и TCP слушают один порт, как настоящий DNS сервер
+        for _ in range(16):
+            self._tcp_server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _TcpHandler, bind_and_activate=True)
+            self.port = self._tcp_server.server_address[1]
+            try:
+                self._server = socketserver.ThreadingUDPServer(('127.0.0.1', self.port), _UdpHandler)
+                break
+            except OSError:
+                self._tcp_server.server_close()
+        else:
+            raise OSError("Не удалось занять один порт для UDP и TCP")
+
+        for server in (self._server, self._tcp_server):
+            server.daemon_threads = True
+            server.stub = self
+
+    def receive(self, lossy: bool = True) -> bool:
+        """Учитывает запрос и выдерживает задержку, False - запрос потерян"""
+        with self._lock:
+            self.queries += 1
+            if lossy and self.loss and self._random.random() < self.loss:
+                self.dropped += 1
+                return False
+        if self.latency:
+            time.sleep(self.latency)
+        return True
+
+    def is_nxdomain(self, hostname: str) -> bool:
+        return zlib.crc32(hostname.encode()) % 10000 < self.nxdomain_rate * 10000
+
+    def rotate_answer(self, hostname: str, qtype: int, ip_list: list) -> list:
+        if self.rotate is None or len(ip_list) <= self.rotate:
+            return ip_list
+        with self._lock:
+            position = self._positions.get((hostname, qtype), 0)
+            self._positions[(hostname, qtype)] = (position + self.rotate) % len(ip_list)
+        return [ip_list[(position + index) % len(ip_list)] for index in range(self.rotate)]
+
+    def __enter__(self):
+        for server in (self._server, self._tcp_server):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        for server in (self._server, self._tcp_server):
+            server.shutdown()
+            server.server_close()
@@ -1,8 +1,10 @@
 import pytest
 import random
+import threading
 from app.database import Database
 from app.database.models import *
 from app.database.exceptions import *
+from app.database.pragmas import get_pragmas
 
 
 def generate_random_host():
@@ -11,11 +13,10 @@ def generate_random_host():
 
 @pytest.fixture(scope='session')
 def init_db():
-    db = Database(database="test.sqlite")
-    db.drop_all()
+    db = Database(database=":memory:")
     db.init()
     yield db
-    db.drop_all()
+    db.close()
 
 
 def test_add_hostname(init_db):
@@ -112,3 +113,140 @@ def test_get_hostname_with_ip(init_db):
 
     host_list = init_db.get_all_host_with_ip()
     assert isinstance(host_list, dict)
+
+
+def test_add_ip_list_bulk_unique(init_db):
+    host_payload = init_db.get_or_create_host_by_name(generate_random_host() + '.bulk')
+    ip_payload = [f'10.1.{index // 256}.{index % 256}' for index in range(1000)]
+
+    added_ip_list = init_db.add_host_ip_list(hostname=host_payload, ip_list=ip_payload + ip_payload[:10])
+
+    assert len(added_ip_list) == 1000
+    assert init_db.add_host_ip_list(hostname=host_payload, ip_list=ip_payload[:10]) == []
+    with pytest.raises(IntegrityError):
+        IpAddress.create(hostname_id=host_payload.id, ip_address=ip_payload[0])
+
+
+def test_delete_ip_list_bulk(init_db):
+    host_payload = init_db.get_or_create_host_by_name(generate_random_host() + '.bulk')
+    init_db.add_host_ip_list(hostname=host_payload, ip_list=['10.2.0.1', '10.2.0.2', '10.2.0.3'])
+
+    deleted = init_db.delete_host_ip_list(hostname=host_payload, ip_list=['10.2.0.1', '10.2.0.3', '10.2.0.4'])
+
+    assert deleted == 2
+    assert init_db.get_host_ip_list(hostname=host_payload) == ['10.2.0.2']
+
+
+def test_apply_ip_changes(init_db):
+    first_host = init_db.get_or_create_host_by_name('apply_first.test')
+    init_db.add_host_ip_list(hostname=first_host, ip_list=['10.3.0.1', '10.3.0.2'])
+
+    init_db.apply_ip_changes(added={'apply_first.test': ['10.3.0.3'], 'apply_second.test': ['10.3.0.1']},
+                             deleted={'apply_first.test': ['10.3.0.1']})
+
+    host_list = init_db.get_all_host_with_ip()
+    assert host_list['apply_first.test'] == ['10.3.0.2', '10.3.0.3']
+    assert host_list['apply_second.test'] == ['10.3.0.1']
+
+    init_db.apply_ip_changes(added={}, deleted={'apply_unknown.test': ['10.3.0.9']})
+    assert not Host.select().where(Host.hostname == 'apply_unknown.test').exists()
+
+
+def test_sqlite_pragmas(monkeypatch):
+    monkeypatch.setenv('SQLITE_CACHE_SIZE', '-2000')
+
+    pragmas = get_pragmas('performance')
+
+    assert pragmas['journal_mode'] == 'wal'
+    assert pragmas['cache_size'] == -2000
+    assert 'journal_mode' not in get_pragmas('legacy')
+    with pytest.raises(KeyError):
+        get_pragmas('unknown')
+
+
+def test_models_use_database_handle(init_db):
+    assert Host._meta.database.obj is init_db.db
+    assert IpAddress._meta.database.obj is init_db.db
+    assert init_db.db.database == ':memory:'
+
+
+def test_pool_connections_returned(init_db, tmp_path):
+    pooled = Database(database=str(tmp_path / 'pool.sqlite'), max_connections=2, pool_timeout=5)
+    try:
+        pooled.init()
+        pooled.db.close()
+        errors = []
+
+        def worker(index: int):
+            try:
+                with pooled.connection():
+                    pooled.apply_ip_changes(added={f'pool-{index}.test': [f'10.8.0.{index}']}, deleted={})
+            except Exception as err:
+                errors.append(err)
+
+        # Потоков больше, чем соединений в пуле: сначала по очереди, затем одновременно
+        for index in range(6):
+            thread = threading.Thread(target=worker, args=(index,))
+            thread.start()
+            thread.join()
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(6, 12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(pooled.db._in_use) == 0
+        with pooled.connection():
+            assert len(pooled.get_all_host_with_ip()) == 12
+    finally:
+        pooled.close()
+        database_proxy.initialize(init_db.db)
+
+
+def test_group_membership(init_db):
+    init_db.apply_ip_changes(added={'group_shared.test': ['10.6.0.1'], 'group_banks.test': ['10.6.0.2']}, deleted={})
+    init_db.add_group_hosts(group='banks-v4', hostname_list=['group_shared.test', 'group_banks.test'])
+    init_db.add_group_hosts(group='payments-v4', hostname_list=['group_shared.test', 'group_new.test'])
+
+    group_hosts = init_db.get_all_group_host_with_ip()
+    assert group_hosts['banks-v4'] == {'group_shared.test': ['10.6.0.1'], 'group_banks.test': ['10.6.0.2']}
+    assert group_hosts['payments-v4'] == {'group_shared.test': ['10.6.0.1'], 'group_new.test': []}
+
+    # Хост удаляется, только когда не остается ни в одной группе
+    assert init_db.delete_group_hosts(group='banks-v4', hostname_list=['group_shared.test', 'group_banks.test']) == [
+        'group_banks.test']
+    assert init_db.get_host_by_name('group_banks.test') is None
+    assert init_db.get_group_host_list(group='payments-v4') == ['group_shared.test', 'group_new.test']
+
+    init_db.get_or_create_host_by_name('group_orphan.test')
+    assert init_db.adopt_hosts(group='banks-v4') > 0
+    assert 'group_orphan.test' in init_db.get_group_host_list(group='banks-v4')
+    assert init_db.adopt_hosts(group='banks-v4') == 0
+
+
+def test_ipv6_addresses(init_db):
+    host_payload = init_db.get_or_create_host_by_name('dual_stack.test')
+    init_db.add_host_ip_list(hostname=host_payload, ip_list=['2001:db8::1', '10.7.0.1', '2001:db8:0:0::1'])
+
+    assert init_db.get_host_ip_list(hostname=host_payload) == ['10.7.0.1', '2001:db8::1']
+    assert Ip6Address.get(Ip6Address.ip_address == '2001:db8::1').ip_address == '2001:db8::1'
+
+    init_db.apply_ip_changes(added={'dual_stack.test': ['2001:db8::2']}, deleted={'dual_stack.test': ['2001:db8::1']})
+    assert init_db.get_all_host_with_ip()['dual_stack.test'] == ['10.7.0.1', '2001:db8::2']
+    assert init_db.delete_host_ip_list(hostname=host_payload, ip_list=['2001:db8::2', '10.7.0.1']) == 2
+    assert init_db.get_host_ip_list(hostname=host_payload) == []
+
+
+def test_resolution_snapshot(init_db):
+    init_db.apply_ip_changes(added={'snapshot.test': ['10.8.0.1']}, deleted={})
+
+    init_db.save_host_expiry({'snapshot.test': 1000.0, 'snapshot_deleted.test': 2000.0})
+    init_db.save_host_expiry({'snapshot.test': 1500.0})
+    assert init_db.get_host_expiry()['snapshot.test'] == 1500.0
+    assert 'snapshot_deleted.test' not in init_db.get_host_expiry()
+
+    init_db.save_router_snapshot(router='192.168.1.1:22', group='banks-v4', fingerprint='a1', entries=[])
+    init_db.save_router_snapshot(router='192.168.1.1:22', group='banks-v4', fingerprint='b2',
+                                 entries=['10.8.0.2', '10.8.0.0/24'])
+    assert init_db.get_router_snapshots()[('192.168.1.1:22', 'banks-v4')] == ('b2', ['10.8.0.0/24', '10.8.0.2'])
@@ -1,7 +1,9 @@
+import asyncio
 import pytest
 import os
 from pathlib import Path
 from app.file import *
+from app.file.coalescer import EventCoalescer
 
 
 @pytest.fixture(scope='session', name="host_file")
@@ -21,3 +23,39 @@ def test_search_new_host_from_file(host_file):
     new_hosts = host_file.find_new_host()
 
     assert new_hosts == ['sberbank.ru', 'vk.com']
+
+
+def test_host_file_index(tmp_path):
+    hosts_path = tmp_path / "hosts.txt"
+    hosts_path.write_text("sberbank.ru\nvk.com \n\nnot-a-host\n")
+    index = HostFileIndex(host_file_path=str(hosts_path), hostnames=['vk.com', 'deleted.ru'])
+
+    assert index.update() == (['sberbank.ru'], ['deleted.ru'])
+    assert index.update() is None
+
+    hosts_path.write_text("sberbank.ru\ntinkoff.ru\r\n")
+
+    assert index.update() == (['tinkoff.ru'], ['vk.com'])
+
+
+@pytest.mark.asyncio
+async def test_event_coalescer():
+    updates = []
+
+    async def update():
+        updates.append(asyncio.get_running_loop())
+
+    coalescer = EventCoalescer(callback=update, quiet_window=0.05)
+    coalescer.attach(asyncio.get_running_loop())
+    task = asyncio.ensure_future(coalescer.run())
+
+    # События из потока Observer, как при сохранении через truncate и запись
+    for _ in range(5):
+        await asyncio.get_running_loop().run_in_executor(None, coalescer.notify)
+    await asyncio.sleep(0.2)
+    coalescer.notify()
+    await asyncio.sleep(0.2)
+    task.cancel()
+
+    assert len(updates) == 2
+    assert coalescer.events == 6
@@ -0,0 +1,47 @@
+import pytest
+import app.ipset.ipset as ipset_module
+from app.ipset import IPSet, ip_to_int, int_to_ip
+
+
+@pytest.fixture(params=['numpy', 'array'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(ipset_module, 'numpy', None)
+    return request.param
+
+
+def test_string_round_trip(backend):
+    ip_set = IPSet.from_strings(['10.0.0.2', '192.168.1.1', '10.0.0.2', '0.0.0.0', '255.255.255.255'])
+
+    assert ip_set.to_strings() == ['0.0.0.0', '10.0.0.2', '192.168.1.1', '255.255.255.255']
+    assert ip_to_int('10.0.0.2') in ip_set.values()
+    assert int_to_ip(ip_to_int('192.168.1.1')) == '192.168.1.1'
+    with pytest.raises(ValueError):
+        IPSet.from_strings(['10.0.0.1', '10.0.0.0/24'])
+    assert IPSet.from_strings(['10.0.0.1', '10.0.0.0/24', '::1'], strict=False).to_strings() == ['10.0.0.1']
+
+
+def test_set_operations(backend):
+    first = IPSet.from_strings(['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+    second = IPSet.from_strings(['10.0.0.3', '10.0.0.4'])
+
+    assert (first | second).to_strings() == ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4']
+    assert (first - second).to_strings() == ['10.0.0.1', '10.0.0.2']
+    assert (first & second).to_strings() == ['10.0.0.3']
+    assert (first ^ second).to_strings() == ['10.0.0.1', '10.0.0.2', '10.0.0.4']
+    assert not (IPSet() - first)
+
+
+def test_membership_and_updates(backend):
+    ip_set = IPSet.from_strings(['10.0.0.5', '10.0.0.1'])
+
+    ip_set.add('10.0.0.3')
+    ip_set.add('10.0.0.3')
+    ip_set.discard('10.0.0.5')
+    ip_set.discard('not-an-ip')
+
+    assert list(ip_set) == ['10.0.0.1', '10.0.0.3']
+    assert '10.0.0.3' in ip_set and '10.0.0.5' not in ip_set and 'not-an-ip' not in ip_set
+    assert ip_set == IPSet.from_strings(['10.0.0.3', '10.0.0.1'])
@@ -0,0 +1,23 @@
+import json
+import logging
+from app.logger import JsonFormatter, get_logger
+
+
+def test_get_logger_handlers_once():
+    first = get_logger('tests.logger')
+    second = get_logger('tests.logger')
+
+    assert first is second
+    assert len(first.handlers) == 1
+    assert isinstance(first.handlers[0], logging.handlers.QueueHandler)
+
+
+def test_json_formatter():
+    record = logging.LogRecord(name='app.utils', level=logging.INFO, pathname=__file__, lineno=1,
+                               msg="Проверка IP %d хостов", args=(3,), exc_info=None)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'app.utils'
+    assert entry['message'] == "Проверка IP 3 хостов"
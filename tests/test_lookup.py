@@ -1,9 +1,196 @@
+import asyncio
+import pytest
 from app.lookup import *
+from tests.stub_dns import StubDnsServer, QTYPE_A, QTYPE_AAAA, synthetic_zone
 
 
-def test_find_id_by_hostname():
-    host_payload = "localhost"
+@pytest.mark.asyncio
+async def test_find_id_by_hostname():
+    cache = DnsCache(max_size=10)
+    lookup = AsyncLookup(concurrency=2, timeout=5, retries=1, cache=cache)
 
-    ip_host = find_all_ip_hostname(hostname=host_payload)
+    first = await lookup.resolve(hostname=" localhost")
+    second = await lookup.resolve(hostname="localhost")
 
-    assert ip_host == ['127.0.0.1']
+    assert first.ip_list == second.ip_list == ['127.0.0.1']
+    assert cache.stats.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_async_resolve_all():
+    lookup = AsyncLookup(concurrency=2, timeout=5, retries=1)
+
+    lookup_result = await lookup.resolve_all(['localhost', 'localhost ', 'not-exist.invalid'])
+
+    assert {host: result.ip_list for host, result in lookup_result.items()} == {
+        'localhost': ['127.0.0.1'], 'localhost ': ['127.0.0.1'], 'not-exist.invalid': []}
+
+
+@pytest.mark.asyncio
+async def test_async_resolve_timeout():
+    lookup = AsyncLookup(concurrency=1, timeout=0.01, retries=1)
+
+    async def slow_query(hostname):
+        await asyncio.sleep(1)
+
+    lookup._query = slow_query
+
+    assert await lookup.resolve('localhost') is None
+
+
+@pytest.mark.asyncio
+async def test_resolve_shares_concurrency():
+    lookup = AsyncLookup(concurrency=2, timeout=5, retries=0)
+    running, peak = 0, 0
+
+    async def counting_query(hostname):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return LookupResult(ip_list=['10.0.0.1'])
+
+    lookup._query = counting_query
+    await asyncio.gather(*(lookup.resolve(f'host{index}.test') for index in range(6)))
+
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_dns_resolver_ttl():
+    zone = {'cdn.test': {QTYPE_A: (60, ['10.0.0.1', '10.0.0.2'])}}
+
+    with StubDnsServer(zone=zone) as server:
+        lookup = AsyncLookup(timeout=2, retries=0, resolver=DnsResolver(nameserver='127.0.0.1', port=server.port))
+        lookup_result = await lookup.resolve_all(['cdn.test', 'missing.test'])
+
+    assert lookup_result['cdn.test'] == LookupResult(ip_list=['10.0.0.1', '10.0.0.2'], ttl=60)
+    assert lookup_result['missing.test'].ip_list == []
+
+
+@pytest.mark.asyncio
+async def test_dns_resolver_ipv6():
+    zone = {'dual.test': {QTYPE_A: (300, ['10.0.0.1']), QTYPE_AAAA: (60, ['2001:db8::1'])},
+            'v4.test': {QTYPE_A: (300, ['10.0.0.2'])}}
+
+    with StubDnsServer(zone=zone) as server:
+        lookup = AsyncLookup(timeout=2, retries=0, resolver=DnsResolver(nameserver='127.0.0.1', port=server.port),
+                             ipv6=True)
+        lookup_result = await lookup.resolve_all(['dual.test', 'v4.test'])
+
+    assert lookup_result['dual.test'] == LookupResult(ip_list=['10.0.0.1', '2001:db8::1'], ttl=60)
+    assert lookup_result['v4.test'].ip_list == ['10.0.0.2']
+
+
+@pytest.mark.asyncio
+async def test_dns_resolver_negative_ttl():
+    zone = {'cdn.test': {QTYPE_A: (60, ['10.0.0.1'])}}
+
+    with StubDnsServer(zone=zone, negative_ttl=120) as server:
+        lookup = AsyncLookup(timeout=2, retries=0, resolver=DnsResolver(nameserver='127.0.0.1', port=server.port))
+        lookup_result = await lookup.resolve_all(['missing.test'])
+
+    with StubDnsServer(zone=zone) as server:
+        without_soa = await DnsResolver(nameserver='127.0.0.1', port=server.port).query('missing.test')
+
+    # TTL отрицательного ответа берется из SOA зоны
+    assert lookup_result['missing.test'] == LookupResult(ip_list=[], ttl=120)
+    assert without_soa == LookupResult(ip_list=[], ttl=None)
+
+
+def test_ttl_scheduler():
+    scheduler = TtlScheduler(min_ttl=30, max_ttl=3600)
+    scheduler.sync(['cdn.test', 'stable.test'], now=0)
+
+    assert sorted(scheduler.pop_due(now=0)) == ['cdn.test', 'stable.test']
+
+    scheduler.schedule('cdn.test', ttl=60, now=0)
+    scheduler.schedule('stable.test', ttl=86400, now=0)
+
+    assert scheduler.next_delay(now=0) == 60
+    assert scheduler.pop_due(now=59, window=0) == []
+    assert scheduler.pop_due(now=60, window=0) == ['cdn.test']
+    assert scheduler.next_delay(now=60) == 3540
+
+    scheduler.sync(['cdn.test'], now=60)
+
+    assert 'stable.test' not in scheduler
+
+    # Срок из снимка прошлого запуска не ограничивается min_ttl
+    scheduler.schedule_at('cdn.test', due=61)
+    assert scheduler.pop_due(now=61, window=0) == ['cdn.test']
+
+
+@pytest.mark.asyncio
+async def test_dns_cache():
+    zone = {'cdn.test': {QTYPE_A: (60, ['10.0.0.1'])}}
+    queries = []
+
+    with StubDnsServer(zone=zone) as server:
+        resolver = DnsResolver(nameserver='127.0.0.1', port=server.port)
+        lookup = AsyncLookup(timeout=2, retries=0, resolver=resolver, cache=DnsCache(max_size=2, negative_ttl=10))
+        query = lookup._query
+
+        async def counting_query(hostname):
+            queries.append(hostname)
+            return await query(hostname)
+
+        lookup._query = counting_query
+        # Одновременные запросы одного хоста выполняются одним lookup
+        first = await lookup.resolve_all(['cdn.test', 'cdn.test ', 'missing.test'])
+        second = await lookup.resolve_all(['cdn.test', 'missing.test'])
+
+    assert sorted(queries) == ['cdn.test', 'missing.test']
+    assert first['cdn.test'].ip_list == second['cdn.test'].ip_list == ['10.0.0.1']
+    assert 0 < second['cdn.test'].ttl <= 60
+    assert second['missing.test'].ip_list == []
+    assert lookup.cache.stats.hits == 1 and lookup.cache.stats.negative_hits == 1
+
+
+def test_dns_cache_expiration():
+    cache = DnsCache(max_size=2, min_ttl=10, max_ttl=100, negative_ttl=5, failure_ttl=1, refresh_margin=0)
+
+    cache.store('a.test', LookupResult(ip_list=['10.0.0.1'], ttl=1000), now=0)
+    cache.store('b.test', LookupResult(ip_list=[], ttl=3600), now=0)
+    cache.store('c.test', None, now=0)
+
+    # Самый давно использованный хост вытесняется
+    assert cache.get('a.test', now=0) == (False, None)
+    assert cache.stats.evictions == 1
+    assert cache.get('b.test', now=4) == (True, LookupResult(ip_list=[], ttl=1))
+    assert cache.get('b.test', now=5) == (False, None)
+    assert cache.get('c.test', now=0.5) == (True, None)
+
+    cache.store('a.test', LookupResult(ip_list=['10.0.0.1'], ttl=1000), now=0)
+    assert cache.get('a.test', now=40) == (True, LookupResult(ip_list=['10.0.0.1'], ttl=60))
+    assert cache.get('a.test', now=100) == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_stub_dns_loss_and_nxdomain():
+    zone = synthetic_zone(hosts=50, ip_per_host=4, ttl=120)
+    zone['large.test'] = {QTYPE_A: (60, [f'10.9.{index // 256}.{index % 256}' for index in range(200)])}
+
+    with StubDnsServer(zone=zone, nxdomain_rate=0.2, loss=0.1, seed=1) as server:
+        lookup = AsyncLookup(timeout=0.2, retries=5, resolver=DnsResolver(nameserver='127.0.0.1', port=server.port))
+        lookup_result = await lookup.resolve_all(zone)
+
+    # Потерянные запросы повторяются, а большой ответ не помещается в UDP и приходит по TCP целиком
+    assert all(result is not None for result in lookup_result.values()) and server.dropped > 0
+    assert len(lookup_result['large.test'].ip_list) == 200
+    missing = [host for host, result in lookup_result.items() if not result.ip_list]
+    assert missing == [host for host in zone if server.is_nxdomain(host)] and 0 < len(missing) < 25
+
+
+@pytest.mark.asyncio
+async def test_stub_dns_rotation():
+    zone = synthetic_zone(hosts=1, ip_per_host=4)
+
+    with StubDnsServer(zone=zone, rotate=2, latency=0.05) as server:
+        resolver = DnsResolver(nameserver='127.0.0.1', port=server.port)
+        first, second = [await resolver.query('host-0.bench.test') for _ in range(2)]
+        merged = await AsyncLookup(resolver=resolver, samples=2).resolve('host-0.bench.test')
+
+    assert len(first.ip_list) == len(second.ip_list) == 2
+    assert sorted(first.ip_list + second.ip_list) == sorted(merged.ip_list) == zone['host-0.bench.test'][QTYPE_A][1]
@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from app.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+def test_metrics_render():
+    registry = Registry()
+    changes = Counter('test_ip_changes_total', 'Изменения IP', labels=('action',), registry=registry)
+    Gauge('test_pending', 'Ожидают удаления', callback=lambda: 3, registry=registry)
+    duration = Histogram('test_duration_seconds', 'Длительность', buckets=(0.1, 1), registry=registry)
+
+    changes.inc(2, action='added')
+    changes.inc(action='added')
+    duration.observe(0.05)
+    duration.observe(0.5)
+    duration.observe(5)
+
+    assert registry.render().splitlines() == [
+        '# HELP test_ip_changes_total Изменения IP',
+        '# TYPE test_ip_changes_total counter',
+        'test_ip_changes_total{action="added"} 3',
+        '# HELP test_pending Ожидают удаления',
+        '# TYPE test_pending gauge',
+        'test_pending 3',
+        '# HELP test_duration_seconds Длительность',
+        '# TYPE test_duration_seconds histogram',
+        'test_duration_seconds_bucket{le="0.1"} 1',
+        'test_duration_seconds_bucket{le="1"} 2',
+        'test_duration_seconds_bucket{le="+Inf"} 3',
+        'test_duration_seconds_sum 5.55',
+        'test_duration_seconds_count 3',
+    ]
+    assert changes.value(action='added') == 3 and duration.value() == (3, 5.55)
+
+    with pytest.raises(ValueError):
+        changes.inc(-1, action='added')
+    with pytest.raises(ValueError):
+        changes.inc(router='r1')
+    with pytest.raises(ValueError):
+        Counter('test_pending', 'Повтор имени', registry=registry)
+
+
+@pytest.mark.asyncio
+async def test_metrics_server():
+    registry = Registry()
+    Counter('test_events_total', 'События', registry=registry).inc()
+    server = MetricsServer(host='127.0.0.1', port=0, registry=registry)
+    await server.start()
+
+    async def get(path: str) -> bytes:
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    try:
+        response = await get('/metrics')
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert response.endswith(b'\r\n\r\n' + registry.render().encode())
+        assert (await get('/')).startswith(b'HTTP/1.1 404 Not Found\r\n')
+    finally:
+        await server.close()
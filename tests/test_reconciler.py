@@ -0,0 +1,155 @@
+import pytest
+from app.ipset import ip_to_int
+from app.reconciler import CidrAggregator, FlapDamper, Reconciler
+from app.ubnt import ChangeEntry
+
+GROUP = 'test-group'
+
+
+def plan_entries(reconciler: Reconciler) -> set:
+    return {(entry.action, entry.address) for entry in reconciler.plan()}
+
+
+def test_shared_ip_is_kept_while_owned():
+    reconciler = Reconciler(group=GROUP)
+    reconciler.load({'first.test': ['10.0.0.1', '10.0.0.2'], 'second.test': ['10.0.0.2']})
+    reconciler.set_router_state(['10.0.0.1', '10.0.0.2'])
+    assert not reconciler.plan()
+
+    added, deleted = reconciler.set_host_ip('first.test', ['10.0.0.1'])
+    assert (added, deleted) == ([], ['10.0.0.2'])
+    assert not reconciler.plan()
+    assert reconciler.desired.owners('10.0.0.2') == {'second.test'}
+
+    reconciler.remove_host('second.test')
+    assert plan_entries(reconciler) == {('delete', '10.0.0.2')}
+    assert reconciler.desired_ip.to_strings() == ['10.0.0.1']
+
+
+def test_plan_tracks_only_changes():
+    reconciler = Reconciler(group=GROUP)
+    reconciler.load({f'host-{index}.test': [f'10.1.0.{index}'] for index in range(200)})
+    reconciler.set_router_state([f'10.1.0.{index}' for index in range(200)])
+
+    reconciler.add_host_ip('host-1.test', ['10.2.0.1'])
+    reconciler.delete_host_ip('host-2.test', ['10.1.0.2'])
+    reconciler.add_host_ip('host-3.test', ['10.1.0.4'])
+
+    assert len(reconciler) == 2
+    assert plan_entries(reconciler) == {('set', '10.2.0.1'), ('delete', '10.1.0.2')}
+
+
+def test_acknowledge_keeps_failed_changes():
+    reconciler = Reconciler(group=GROUP)
+    reconciler.set_router_state([])
+    reconciler.add_host_ip('host.test', ['10.3.0.1', '10.3.0.2'])
+
+    reconciler.acknowledge([ChangeEntry('set', GROUP, '10.3.0.1')])
+
+    assert plan_entries(reconciler) == {('set', '10.3.0.2')}
+    assert reconciler.router_ip.to_strings() == ['10.3.0.1']
+
+
+def test_router_state_diff():
+    reconciler = Reconciler(group=GROUP)
+    reconciler.load({'host.test': ['10.4.0.1', '10.4.0.2']})
+
+    # Пока группа не прочитана, план строится только по желаемому состоянию
+    reconciler.remove_host('host.test')
+    assert plan_entries(reconciler) == {('delete', '10.4.0.1'), ('delete', '10.4.0.2')}
+
+    reconciler.add_host_ip('host.test', ['10.4.0.1'])
+    reconciler.set_router_state(['10.4.0.2', '10.4.0.3'])
+    assert plan_entries(reconciler) == {('set', '10.4.0.1'), ('delete', '10.4.0.2'), ('delete', '10.4.0.3')}
+
+
+def test_cidr_aggregation():
+    aggregator = CidrAggregator(coverage=1.0, block_prefix=24)
+    values = sorted(ip_to_int(f'10.5.0.{index}') for index in range(8)) + [ip_to_int('10.5.0.9')]
+
+    assert aggregator.aggregate(aggregator.block(values[0]), values) == ['10.5.0.0/29', '10.5.0.9']
+    assert CidrAggregator(coverage=0.75).aggregate(aggregator.block(values[0]), values[:7]) == ['10.5.0.0/29']
+    assert aggregator.entry_block('10.5.0.0/29') == aggregator.block(values[0])
+    assert aggregator.entry_block('10.5.0.0/16') is None
+    with pytest.raises(ValueError):
+        CidrAggregator(coverage=0)
+
+
+def test_aggregated_plan_replaces_addresses_with_network():
+    reconciler = Reconciler(group=GROUP, aggregator=CidrAggregator(coverage=1.0))
+    reconciler.set_router_state(['10.6.0.0', '10.6.0.1', '10.6.0.2', '172.16.0.0/16'])
+    reconciler.add_host_ip('cdn.test', ['10.6.0.0', '10.6.0.1', '10.6.0.2', '10.6.0.3'])
+
+    change_set = reconciler.plan()
+    assert {(entry.action, entry.address) for entry in change_set} == {
+        ('delete', '10.6.0.0'), ('delete', '10.6.0.1'), ('delete', '10.6.0.2'), ('set', '10.6.0.0/30')}
+    assert change_set.entries()[-1].action == 'set'
+
+    reconciler.acknowledge(change_set)
+    assert not reconciler.plan()
+
+    # Адрес пропал у хоста - сеть раскладывается на меньшую сеть и адрес
+    reconciler.delete_host_ip('cdn.test', ['10.6.0.3'])
+    assert plan_entries(reconciler) == {('delete', '10.6.0.0/30'), ('set', '10.6.0.0/31'), ('set', '10.6.0.2')}
+
+
+def test_routers_keep_separate_state():
+    reconciler = Reconciler(group=GROUP, routers=['first', 'second'])
+    reconciler.load({'host.test': ['10.7.0.1']})
+    reconciler.add_host_ip('host.test', ['10.7.0.2'])
+
+    # Одно и то же изменение планируется для каждого роутера, а подтверждается по отдельности
+    reconciler.acknowledge(reconciler.plan('first'), router='first')
+
+    assert not reconciler.plan('first')
+    assert plan_entries(reconciler) == set()
+    assert {(entry.action, entry.address) for entry in reconciler.plan('second')} == {('set', '10.7.0.2')}
+
+    reconciler.set_router_state([], router='second')
+    assert {(entry.action, entry.address) for entry in reconciler.plan('second')} == {
+        ('set', '10.7.0.1'), ('set', '10.7.0.2')}
+    with pytest.raises(ValueError):
+        Reconciler(group=GROUP, routers=[])
+
+
+def test_ipv6_addresses_go_to_v6_group():
+    reconciler = Reconciler(group=GROUP, group6='test-group-v6')
+    reconciler.load({'dual.test': ['10.8.0.1', '2001:db8::1']})
+    reconciler.set_host_ip('dual.test', ['10.8.0.1', '2001:db8::2'])
+
+    change_set = reconciler.plan()
+    assert [(entry.action, entry.group, entry.address) for entry in change_set] == [
+        ('delete', 'test-group-v6', '2001:db8::1'), ('set', 'test-group-v6', '2001:db8::2')]
+    assert change_set.entries()[-1].command() == \
+        "set firewall group ipv6-address-group test-group-v6 ipv6-address 2001:db8::2"
+
+    reconciler.acknowledge(change_set)
+    assert not reconciler.plan()
+
+    reconciler.set_router_state6(['2001:db8:0::2', '2001:db8::3', '2001:db8:1::/48'])
+    assert plan_entries(reconciler) == {('delete', '2001:db8::3')}
+
+    # Без IPv6 группы IPv6 адреса хостов не применяются
+    reconciler = Reconciler(group=GROUP)
+    reconciler.add_host_ip('dual.test', ['10.8.0.1', '2001:db8::1'])
+    assert plan_entries(reconciler) == {('set', '10.8.0.1')}
+
+
+def test_flap_damping():
+    damper = FlapDamper(missed_threshold=2, grace_period=60)
+    current_ip = ['10.8.0.1', '10.8.0.2']
+
+    # Пропавший IP остается у хоста, пока не наберет пропусков и не пройдет время ожидания
+    assert damper.observe('cdn.test', current_ip, ['10.8.0.1'], now=0) == ['10.8.0.1', '10.8.0.2']
+    assert damper.observe('cdn.test', current_ip, ['10.8.0.1'], now=30) == ['10.8.0.1', '10.8.0.2']
+    assert damper.observe('cdn.test', current_ip, ['10.8.0.1'], now=60) == ['10.8.0.1']
+    assert damper.stats.as_dict() == {'suppressed': 2, 'removed': 1, 'recovered': 0}
+
+    # Вернувшийся IP сбрасывает счетчик пропусков
+    assert damper.observe('cdn.test', current_ip, ['10.8.0.2'], now=100) == ['10.8.0.2', '10.8.0.1']
+    assert damper.observe('cdn.test', current_ip, ['10.8.0.1'], now=110) == ['10.8.0.1', '10.8.0.2']
+    assert damper.stats.recovered == 1 and len(damper) == 1
+
+    damper.sync([])
+    assert len(damper) == 0
+    assert FlapDamper().observe('cdn.test', current_ip, ['10.8.0.1']) == ['10.8.0.1']
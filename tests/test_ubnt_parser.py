@@ -0,0 +1,35 @@
+from pathlib import Path
+from app.ubnt import GroupEntry, classify, parse_show_group, parse_configuration_commands
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def test_parse_show_group():
+    output = (FIXTURES / 'show_firewall_group.txt').read_text().replace('\n', '\r\n')
+
+    entries = list(parse_show_group(output))
+
+    assert entries == [GroupEntry('address', '10.10.0.1'), GroupEntry('address', '10.10.0.2'),
+                       GroupEntry('network', '10.20.0.0/24'), GroupEntry('range', '10.30.0.1-10.30.0.9'),
+                       GroupEntry('ipv6-address', '2001:db8::1'), GroupEntry('ipv6-network', '2001:db8:1::/48')]
+    # Вывод по частям из целых строк дает тот же результат
+    assert list(parse_show_group(output.splitlines(keepends=True))) == entries
+
+
+def test_parse_configuration_commands():
+    output = (FIXTURES / 'show_configuration_commands.txt').read_text()
+
+    entries = [(entry.group_type, entry.group, entry.entry.value) for entry in parse_configuration_commands(output)]
+
+    assert entries == [('address-group', 'banks-v4', '10.10.0.1'), ('address-group', 'banks-v4', '10.20.0.0/24'),
+                       ('address-group', 'banks-v4', '10.30.0.1-10.30.0.9'),
+                       ('ipv6-address-group', 'banks-v6', '2001:db8::1'),
+                       ('network-group', 'lan', '192.168.1.0/24')]
+
+
+def test_classify():
+    assert classify('255.255.255.255').kind == 'address'
+    assert classify('10.0.0.0/33') is None
+    assert classify('256.1.1.1') is None
+    assert classify('Members') is None
+    assert classify('fe80::1').kind == 'ipv6-address'
@@ -1,47 +1,54 @@
+import asyncio
+import threading
+from os import environ
+from time import monotonic
 import pytest
-from app.ubnt import UbntService
+from Exscript import Account
+from Exscript.protocols.exception import InvalidCommandException
+from app.ubnt import (UbntService, UbntChangeSet, ChangeEntry, RouterFleet, CliDriver, ScriptDriver,
+                      IPV6_ADDRESS_GROUP, parse_router_list)
+from app.ubnt.connection import SshConnectionManager
+from app.ubnt.exceptions import SSHConnectionError
+from tests.fake_edgeos import FakeEdgeRouter
 
-# Так как для тестов необходимо использовать настоящее оборудование, то у некоторых может возникнуть проблема
-# С тестированием, тогда стоит отключить данный тест
-SKIP_THIS_TEST_MODULE = True
-
-# Параметры для входа по SSH
-SSH_UBNT_TEST_HOST = '192.168.1.1'
-SSH_UBNT_TEST_LOGIN = 'ubnt'
-SSH_UBNT_TEST_PASSWORD = 'ubnt'
-SSH_UBNT_TEST_KEY_PATH = None
+# По умолчанию тесты идут против локального FakeEdgeRouter. Чтобы проверить настоящее оборудование,
+# нужно указать его адрес в переменной окружения UBNT_TEST_HOST
+SSH_UBNT_TEST_HOST = environ.get('UBNT_TEST_HOST', '192.168.1.1')
+SSH_UBNT_TEST_LOGIN = environ.get('UBNT_TEST_LOGIN', 'ubnt')
+SSH_UBNT_TEST_PASSWORD = environ.get('UBNT_TEST_PASSWORD', 'ubnt')
+SSH_UBNT_TEST_KEY_PATH = environ.get('UBNT_TEST_KEY_PATH')
 UBNT_TEST_GROUP = 'test-v4'
 
 
-@pytest.fixture(scope='session', name='ubnt')
+@pytest.fixture(scope='module', name='ubnt')
 def connect_to_ubnt_ssh():
-    ubnt = UbntService(
-        host=SSH_UBNT_TEST_HOST,
-        login=SSH_UBNT_TEST_LOGIN,
-        password=SSH_UBNT_TEST_PASSWORD,
-        key=SSH_UBNT_TEST_KEY_PATH,
-        firewall_group=UBNT_TEST_GROUP
-    )
+    if 'UBNT_TEST_HOST' in environ:
+        ubnt = UbntService(host=SSH_UBNT_TEST_HOST, login=SSH_UBNT_TEST_LOGIN, password=SSH_UBNT_TEST_PASSWORD,
+                           key=SSH_UBNT_TEST_KEY_PATH, firewall_group=UBNT_TEST_GROUP)
+        yield ubnt
+        ubnt.connection.close()
+        return
 
-    return ubnt
+    with FakeEdgeRouter(username=SSH_UBNT_TEST_LOGIN, password=SSH_UBNT_TEST_PASSWORD) as router:
+        ubnt = UbntService(host='127.0.0.1', port=router.port, login=SSH_UBNT_TEST_LOGIN,
+                           password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP)
+        yield ubnt
+        ubnt.connection.close()
 
 
-@pytest.mark.skipif(SKIP_THIS_TEST_MODULE, reason="Невозможно подключиться к тестовой платформе")
 def test_add_ip_firewall(ubnt):
     ip_payload = ['192.168.10.1', '192.168.11.3']
 
-    ubnt.add_new_ip(ip_address_list=ip_payload)
+    assert len(ubnt.add_new_ip(ip_address_list=ip_payload)) == 2
 
 
-@pytest.mark.skipif(SKIP_THIS_TEST_MODULE, reason="Невозможно подключиться к тестовой платформе")
 def test_delete_ip_firewall(ubnt):
     ip_payload = ['192.168.10.1', '192.168.11.3']
     ubnt.add_new_ip(ip_address_list=ip_payload)
 
-    ubnt.delete_ip(ip_address_list=ip_payload)
+    assert len(ubnt.delete_ip(ip_address_list=ip_payload)) == 2
 
 
-@pytest.mark.skipif(SKIP_THIS_TEST_MODULE, reason="Невозможно подключиться к тестовой платформе")
 def test_get_ip_firewall(ubnt):
     ip_payload = ['192.168.10.1', '192.168.11.3']
     ubnt.add_new_ip(ip_address_list=ip_payload)
@@ -49,3 +56,312 @@ def test_get_ip_firewall(ubnt):
     ubnt_ip = ubnt.get_group_ip_list(UBNT_TEST_GROUP)
 
     assert ubnt_ip == ip_payload
+
+
+class RecordingSSH:
+    """Заглушка SSH2, которая запоминает выполненные команды"""
+
+    def __init__(self, failing_address: str = None, failing_commands: tuple = ()):
+        self.commands = []
+        self.failing_address = failing_address
+        self.failing_commands = failing_commands
+        self.closed = False
+
+    def connect(self, hostname, port):
+        pass
+
+    def login(self, account):
+        pass
+
+    def close(self, force=False):
+        self.closed = True
+
+    def execute(self, command):
+        self.commands.append(command)
+        if self.failing_address is not None and self.failing_address in command:
+            raise InvalidCommandException(f"Invalid address {self.failing_address}")
+        if command.split(';')[0] in self.failing_commands:
+            raise InvalidCommandException(f"Command {command} failed")
+
+
+def use_recording_ssh(ubnt, ssh):
+    ubnt.connection = SshConnectionManager(host=ubnt.host, port=ubnt.port, account=Account(name=ubnt.login),
+                                           ssh_factory=lambda **kwargs: ssh)
+
+
+@pytest.fixture(name='recording_ubnt')
+def create_recording_ubnt():
+    ubnt = UbntService(host=SSH_UBNT_TEST_HOST, login=SSH_UBNT_TEST_LOGIN, firewall_group=UBNT_TEST_GROUP,
+                       pipeline_size=2)
+    use_recording_ssh(ubnt, RecordingSSH())
+
+    return ubnt
+
+
+def test_apply_changes_single_commit(recording_ubnt):
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1', '192.168.10.2', '192.168.10.3'], group=UBNT_TEST_GROUP)
+    change_set.delete(['192.168.11.3', 'not-an-ip'], group=UBNT_TEST_GROUP)
+
+    applied = recording_ubnt.apply_changes(change_set)
+
+    assert len(applied) == 4
+    assert ChangeEntry('delete', UBNT_TEST_GROUP, '192.168.11.3') in applied
+    commands = recording_ubnt.connection.ssh_factory().commands
+    assert commands.count("commit; save") == 1
+    # 4 команды пачками по 2, плюс configure, commit и exit
+    assert len(commands) == 5
+
+
+def test_apply_changes_reports_failed_entry(recording_ubnt):
+    use_recording_ssh(recording_ubnt, RecordingSSH(failing_address='192.168.10.2'))
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1', '192.168.10.2'], group=UBNT_TEST_GROUP)
+
+    applied = recording_ubnt.apply_changes(change_set)
+
+    assert applied == [ChangeEntry('set', UBNT_TEST_GROUP, '192.168.10.1')]
+
+
+def test_rejected_command_does_not_escape(recording_ubnt):
+    # Роутер отклоняет и команду снятия отпечатка, и ее повтор после выхода из режима конфигурации
+    use_recording_ssh(recording_ubnt, RecordingSSH(failing_address='showCfg'))
+
+    assert recording_ubnt.group_changed(UBNT_TEST_GROUP) is None
+    assert recording_ubnt.get_group_ip_list(UBNT_TEST_GROUP) is None
+
+
+def test_failed_commit_cleanup(recording_ubnt):
+    ssh = RecordingSSH(failing_commands=('commit', 'discard'))
+    use_recording_ssh(recording_ubnt, ssh)
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1'], group=UBNT_TEST_GROUP)
+
+    assert recording_ubnt.apply_changes(change_set) == []
+    # discard не прошел - соединение закрыто, чтобы следующая сессия не началась в режиме конфигурации
+    assert ssh.commands[-2:] == ['commit; save', 'discard']
+    assert ssh.closed
+
+
+def test_change_set_last_action_wins():
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1'], group=UBNT_TEST_GROUP)
+    change_set.delete(['192.168.10.1'], group=UBNT_TEST_GROUP)
+
+    assert change_set.entries() == [ChangeEntry('delete', UBNT_TEST_GROUP, '192.168.10.1')]
+    with pytest.raises(KeyError):
+        change_set.record('replace', ['192.168.10.1'], group=UBNT_TEST_GROUP)
+
+
+@pytest.fixture(name='fake_router')
+def start_fake_router():
+    with FakeEdgeRouter(username=SSH_UBNT_TEST_LOGIN, password=SSH_UBNT_TEST_PASSWORD) as router:
+        yield router
+
+
+@pytest.fixture(name='fake_ubnt')
+def connect_to_fake_router(fake_router):
+    ubnt = UbntService(host='127.0.0.1', port=fake_router.port, login=SSH_UBNT_TEST_LOGIN,
+                       password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP)
+    yield ubnt
+    ubnt.connection.close()
+
+
+def test_connection_reused(fake_ubnt, fake_router):
+    fake_ubnt.add_new_ip(['192.168.10.1'])
+    fake_ubnt.add_new_ip(['192.168.10.2'])
+
+    assert fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP) == ['192.168.10.1', '192.168.10.2']
+    assert fake_router.connections == 1
+    assert fake_ubnt.connection.stats.connects == 1
+
+
+def test_connection_reconnect_after_drop(fake_ubnt, fake_router):
+    fake_ubnt.add_new_ip(['192.168.10.1'])
+    fake_router.drop_connections()
+
+    assert fake_ubnt.add_new_ip(['192.168.10.2']) == [ChangeEntry('set', UBNT_TEST_GROUP, '192.168.10.2')]
+    assert fake_ubnt.connection.stats.reconnects == 1
+    assert fake_ubnt.connection.stats.last_connect_latency > 0
+
+
+def test_fake_router_latency():
+    with FakeEdgeRouter(command_latency=0.05, commit_latency=0.1) as router:
+        ubnt = UbntService(host='127.0.0.1', port=router.port, login=SSH_UBNT_TEST_LOGIN,
+                           password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP)
+        ubnt.add_new_ip(['192.168.10.1'])
+        router.reset_counters()
+
+        start = monotonic()
+        ubnt.add_new_ip(['192.168.10.2'])
+        elapsed = monotonic() - start
+        ubnt.connection.close()
+
+    # configure, команда, commit; save и exit
+    assert router.round_trips == 4 and router.commits == 1
+    assert elapsed >= 4 * 0.05 + 0.1
+
+
+def test_connection_idle_timeout(fake_ubnt, fake_router):
+    fake_ubnt.connection.idle_timeout = 0
+    fake_ubnt.add_new_ip(['192.168.10.1'])
+    fake_ubnt.add_new_ip(['192.168.10.2'])
+
+    assert fake_router.connections == 2
+
+
+def test_connection_backoff():
+    with FakeEdgeRouter() as router:
+        port = router.port
+
+    connection = SshConnectionManager(host='127.0.0.1', port=port, account=Account(name='ubnt', password='ubnt'),
+                                      backoff_base=60, timeout=1)
+
+    for _ in range(2):
+        with pytest.raises(SSHConnectionError):
+            with connection.session():
+                pass
+
+    # Вторая попытка не доходит до подключения из-за задержки после первой неудачи
+    assert connection.stats.failures == 1
+
+
+def test_connection_serialized(fake_ubnt, fake_router):
+    threads = [threading.Thread(target=fake_ubnt.add_new_ip, args=([f"192.168.20.{index}"],))
+               for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fake_router.commits == 4
+    assert len(fake_router.groups[UBNT_TEST_GROUP]) == 4
+
+
+def test_group_entries_with_networks(fake_ubnt, fake_router):
+    fake_router.groups[UBNT_TEST_GROUP] = {'192.168.10.1', '10.20.0.0/24', '10.30.0.1-10.30.0.9'}
+
+    assert sorted(fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP)) == ['10.20.0.0/24', '10.30.0.1-10.30.0.9',
+                                                                    '192.168.10.1']
+    configured = fake_ubnt.get_configuration_entries()
+    assert {(entry.group, entry.entry.kind) for entry in configured} == {
+        (UBNT_TEST_GROUP, 'address'), (UBNT_TEST_GROUP, 'network'), (UBNT_TEST_GROUP, 'range')}
+
+
+def test_router_state_cache(fake_ubnt, fake_router):
+    fake_ubnt.add_new_ip(['192.168.10.1'])
+    assert fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP) == ['192.168.10.1']
+
+    # Без изменений на роутере группа не выводится целиком, а после своего commit кэш обновляется локально
+    fake_ubnt.add_new_ip(['192.168.10.2'])
+    assert fake_ubnt.group_changed(UBNT_TEST_GROUP) is False
+    assert fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP) == ['192.168.10.1', '192.168.10.2']
+    assert sum(command.startswith('show firewall group') for command in fake_router.commands) == 1
+    assert fake_ubnt.cache.stats.hits == 1 and fake_ubnt.cache.stats.local_updates == 1
+
+    # Изменение не через сервис меняет отпечаток, и группа читается заново
+    fake_router.groups[UBNT_TEST_GROUP].add('192.168.10.3')
+    assert fake_ubnt.group_changed(UBNT_TEST_GROUP) is True
+    assert fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP) == ['192.168.10.1', '192.168.10.2', '192.168.10.3']
+    assert fake_ubnt.cache.stats.dumps == 2
+
+
+@pytest.mark.asyncio
+async def test_router_fleet():
+    with FakeEdgeRouter() as dead:
+        dead_port = dead.port
+
+    with FakeEdgeRouter() as first, FakeEdgeRouter() as second:
+        services = [UbntService(host='127.0.0.1', port=router.port, login=SSH_UBNT_TEST_LOGIN,
+                                password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP)
+                    for router in (first, second)]
+        services.append(UbntService(host='127.0.0.1', port=dead_port, login=SSH_UBNT_TEST_LOGIN,
+                                    password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP))
+        fleet = RouterFleet(services, workers=2)
+        change_set = UbntChangeSet()
+        change_set.add(['192.168.10.1', '192.168.10.2'], group=UBNT_TEST_GROUP)
+
+        applied = await fleet.apply_changes_async({router: change_set for router in fleet})
+        changed = await fleet.group_changed_async(UBNT_TEST_GROUP)
+        fleet.close()
+
+    assert first.groups[UBNT_TEST_GROUP] == second.groups[UBNT_TEST_GROUP] == {'192.168.10.1', '192.168.10.2'}
+    assert first.commits == second.commits == 1
+    assert applied[f'127.0.0.1:{dead_port}'] == []
+    assert [report.ok for report in fleet.reports.values()] == [True, True, False]
+    assert fleet.failures[f'127.0.0.1:{dead_port}'] == 1
+    assert changed[f'127.0.0.1:{dead_port}'] is None
+    assert parse_router_list('10.0.0.1, 10.0.0.2:2222,10.0.0.1', default_port=22) == [('10.0.0.1', 22),
+                                                                                        ('10.0.0.2', 2222)]
+
+
+@pytest.mark.asyncio
+async def test_router_fleet_async():
+    with FakeEdgeRouter(command_latency=0.05) as router:
+        fleet = RouterFleet([UbntService(host='127.0.0.1', port=router.port, login=SSH_UBNT_TEST_LOGIN,
+                                         password=SSH_UBNT_TEST_PASSWORD, firewall_group=UBNT_TEST_GROUP)])
+        change_set = UbntChangeSet()
+        change_set.add(['192.168.10.1'], group=UBNT_TEST_GROUP)
+
+        # Пока SSH сессия идет в пуле потоков, event loop продолжает выполнять другие задачи
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        applied = await fleet.apply_changes_async({router_name: change_set for router_name in fleet})
+        group_ip = await fleet.get_group_ip_list_async(UBNT_TEST_GROUP, use_cache=False)
+        ticker.cancel()
+        fleet.close()
+
+    assert [len(entries) for entries in applied.values()] == [1]
+    assert list(group_ip.values()) == [['192.168.10.1']]
+    assert ticks > 5
+
+
+def test_ipv6_group(fake_ubnt, fake_router):
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1'], group=UBNT_TEST_GROUP)
+    change_set.add(['2001:db8::1'], group='test-v6')
+
+    assert len(fake_ubnt.apply_changes(change_set)) == 2
+    assert fake_router.groups == {UBNT_TEST_GROUP: {'192.168.10.1'}, 'test-v6': {'2001:db8::1'}}
+    assert fake_router.commits == 1
+    assert fake_ubnt.get_group_ip_list('test-v6', group_type=IPV6_ADDRESS_GROUP) == ['2001:db8::1']
+    assert fake_ubnt.group_changed('test-v6', group_type=IPV6_ADDRESS_GROUP) is False
+
+
+def test_script_driver(fake_ubnt, fake_router):
+    fake_ubnt.driver = ScriptDriver()
+    fake_router.groups[UBNT_TEST_GROUP] = {'192.168.10.9'}
+    assert fake_ubnt.get_group_ip_list(UBNT_TEST_GROUP) == ['192.168.10.9']
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1', '192.168.10.2'], group=UBNT_TEST_GROUP)
+    change_set.delete(['192.168.10.9', '192.168.10.3'], group=UBNT_TEST_GROUP)
+
+    applied = fake_ubnt.apply_changes(change_set)
+
+    # Удаление несуществующего адреса считается примененным, изменения идут одним скриптом без режима configure в shell
+    assert ChangeEntry('delete', UBNT_TEST_GROUP, '192.168.10.3') in applied and len(applied) == 4
+    assert fake_router.groups[UBNT_TEST_GROUP] == {'192.168.10.1', '192.168.10.2'}
+    assert fake_router.scripts == fake_router.commits == 1 and fake_router.connections == 1
+    assert fake_ubnt.group_changed(UBNT_TEST_GROUP) is False
+
+
+def test_drivers_agree(fake_ubnt, fake_router):
+    change_set = UbntChangeSet()
+    change_set.add(['192.168.10.1'], group=UBNT_TEST_GROUP)
+    change_set.delete(['192.168.10.9', '192.168.10.3'], group=UBNT_TEST_GROUP)
+
+    results = {}
+    for driver in (CliDriver(), ScriptDriver()):
+        fake_router.groups = {UBNT_TEST_GROUP: {'192.168.10.9'}}
+        fake_ubnt.driver = driver
+        results[driver.name] = sorted(fake_ubnt.apply_changes(change_set)), fake_router.groups
+
+    assert results['cli'] == results['script']
+    assert len(results['cli'][0]) == 3 and results['cli'][1] == {UBNT_TEST_GROUP: {'192.168.10.1'}}